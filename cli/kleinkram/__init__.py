@@ -11,9 +11,11 @@ from kleinkram.wrappers import download
 from kleinkram.wrappers import get_file
 from kleinkram.wrappers import get_mission
 from kleinkram.wrappers import get_project
+from kleinkram.wrappers import get_recording_info
 from kleinkram.wrappers import list_files
 from kleinkram.wrappers import list_missions
 from kleinkram.wrappers import list_projects
+from kleinkram.wrappers import sync
 from kleinkram.wrappers import update_file
 from kleinkram.wrappers import update_mission
 from kleinkram.wrappers import update_project
@@ -25,9 +27,11 @@ __all__ = [
     "upload",
     "verify",
     "download",
+    "sync",
     "get_file",
     "get_mission",
     "get_project",
+    "get_recording_info",
     "list_files",
     "list_missions",
     "list_projects",
@@ -22,6 +22,7 @@ from kleinkram.config import Credentials
 from kleinkram.config import get_config
 from kleinkram.config import save_config
 from kleinkram.errors import NotAuthenticated
+from kleinkram.metadata_cache import expire_metadata_cache
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +33,16 @@ COOKIE_API_KEY = "clikey"
 
 CLI_VERSION_HEADER = "Kleinkram-Client-Version"
 
+REFRESH_TOKEN_ENDPOINT = "/auth/refresh-token"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+UPLOAD_CREDS = "/files/temporaryAccess"
+UPLOAD_CONFIRM = "/files/upload/confirm"
+UPLOAD_CANCEL = "/files/cancelUpload"
+# requests sent per file of an upload do not expire the metadata cache,
+# `upload_files` expires it once when all files are confirmed
+CACHE_NEUTRAL_ENDPOINTS = (REFRESH_TOKEN_ENDPOINT, UPLOAD_CREDS, UPLOAD_CONFIRM, UPLOAD_CANCEL)
+
 
 Data = Union[PrimitiveData, Any]
 NestedData = Mapping[str, Data]
@@ -65,12 +76,14 @@ def _convert_query_params_to_httpx_format(
 
 class AuthenticatedClient(httpx.Client):
     _config: Config
+    _config_path: Path
     _config_lock: Lock
 
     def __init__(self, config_path: Path = CONFIG_PATH, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
 
         self._config = get_config(path=config_path)
+        self._config_path = config_path
         self._config_lock = Lock()
 
         if self._config.credentials is None:
@@ -84,6 +97,14 @@ class AuthenticatedClient(httpx.Client):
             assert self._config.credentials.auth_token is not None, "unreachable"
             self.cookies.set(COOKIE_AUTH_TOKEN, self._config.credentials.auth_token)
 
+    @property
+    def config(self) -> Config:
+        return self._config
+
+    @property
+    def config_path(self) -> Path:
+        return self._config_path
+
     def _refresh_token(self) -> None:
         if self._config.credentials is None:
             raise NotAuthenticated
@@ -97,7 +118,7 @@ class AuthenticatedClient(httpx.Client):
         self.cookies.set(COOKIE_REFRESH_TOKEN, refresh_token)
 
         logger.info("refreshing token...")
-        response = self.post("/auth/refresh-token")
+        response = self.post(REFRESH_TOKEN_ENDPOINT)
         response.raise_for_status()
         new_access_token = response.cookies[COOKIE_AUTH_TOKEN]
         creds = Credentials(auth_token=new_access_token, refresh_token=refresh_token)
@@ -147,7 +168,7 @@ class AuthenticatedClient(httpx.Client):
         logger.info(f"got response {response}")
 
         # if the requesting a refresh token fails, we are not logged in
-        if (url == "/auth/refresh-token") and response.status_code == 401:
+        if (url == REFRESH_TOKEN_ENDPOINT) and response.status_code == 401:
             logger.info("got 401, not logged in...")
             raise NotAuthenticated
 
@@ -162,6 +183,8 @@ class AuthenticatedClient(httpx.Client):
             logger.info(f"retrying request {method} {full_url}")
             response = self._send_request_with_kleinkram_headers(method, full_url, params=httpx_params, *args, **kwargs)
             logger.info(f"got response {response}")
-            return response
-        else:
-            return response
+
+        # cached listings may be outdated after a write
+        if method.upper() not in SAFE_METHODS and url not in CACHE_NEUTRAL_ENDPOINTS:
+            expire_metadata_cache(self._config)
+        return response
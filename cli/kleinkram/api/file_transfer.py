@@ -1,32 +1,83 @@
 from __future__ import annotations
 
+import base64
+import errno
+import hashlib
+import json
 import logging
+import math
+import os
+import shutil
+import sqlite3
 import sys
+from bisect import bisect_right
+from concurrent.futures import FIRST_COMPLETED
 from concurrent.futures import Future
 from concurrent.futures import ThreadPoolExecutor
 from concurrent.futures import as_completed
+from concurrent.futures import wait
+from contextlib import closing
+from contextlib import nullcontext
+from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
+from threading import Event
+from threading import Lock
 from time import monotonic
 from time import sleep
+from typing import Any
+from typing import Callable
+from typing import Collection
 from typing import Dict
+from typing import List
 from typing import NamedTuple
 from typing import Optional
+from typing import Sequence
+from typing import Set
 from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
 from uuid import UUID
 
 import boto3.s3.transfer
-import botocore.config
 import httpx
 from rich.console import Console
 from tqdm import tqdm
 
+from kleinkram.api.client import UPLOAD_CANCEL
+from kleinkram.api.client import UPLOAD_CONFIRM
+from kleinkram.api.client import UPLOAD_CREDS
 from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.journal import JournalEntry
+from kleinkram.api.journal import UploadJournal
+from kleinkram.api.journal import get_upload_journal
+from kleinkram.api.rate_limit import DOWNLOAD
+from kleinkram.api.rate_limit import UPLOAD
+from kleinkram.api.rate_limit import RateLimiter
+from kleinkram.api.rate_limit import get_rate_limiter
+from kleinkram.api.scheduling import DEFAULT_SCHEDULE
+from kleinkram.api.scheduling import TransferSchedule
+from kleinkram.api.scheduling import schedule_transfers
+from kleinkram.api.transport import S3DownloadPool
+from kleinkram.api.transport import S3Transport
+from kleinkram.api.transport import UploadCredentials
+from kleinkram.api.workers import DEFAULT_WORKERS
+from kleinkram.api.workers import AdaptiveWorkers
 from kleinkram.config import get_config
+from kleinkram.config import get_transfer_workers
+from kleinkram.config import save_transfer_workers
 from kleinkram.errors import AccessDenied
+from kleinkram.errors import InsufficientDiskSpace
+from kleinkram.hash_cache import cached_b64_md5
+from kleinkram.hash_cache import remember_b64_md5
+from kleinkram.metadata_cache import expire_metadata_cache
 from kleinkram.models import File
 from kleinkram.models import FileState
-from kleinkram.utils import b64_md5
+from kleinkram.progress import ByteCounter
+from kleinkram.progress import TransferProgress
+from kleinkram.store import LocalStore
+from kleinkram.store import open_local_store
+from kleinkram.utils import HashingReader
 from kleinkram.utils import format_bytes
 from kleinkram.utils import format_error
 from kleinkram.utils import format_traceback
@@ -34,27 +85,79 @@ from kleinkram.utils import styled_string
 
 logger = logging.getLogger(__name__)
 
-UPLOAD_CREDS = "/files/temporaryAccess"
-UPLOAD_CONFIRM = "/files/upload/confirm"
-UPLOAD_CANCEL = "/files/cancelUpload"
-
 DOWNLOAD_CHUNK_SIZE = 1024 * 1024 * 16
+THROTTLED_DOWNLOAD_CHUNK_SIZE = 1024 * 256
 DOWNLOAD_URL = "/files/download"
 
+# large files are downloaded over several connections, each fetching one segment at a time
+SEGMENTED_DOWNLOAD_THRESHOLD = 1024 * 1024 * 256
+DOWNLOAD_SEGMENT_SIZE = 1024 * 1024 * 64
+DEFAULT_DOWNLOAD_CONNECTIONS = 4
+# bytes of a segmented download that arrive ahead of the hashed prefix are kept
+# in memory up to this size, the rest is read back from the file for hashing
+DOWNLOAD_HASH_BUFFER_SIZE = 1024 * 1024 * 64
+HASH_READ_SIZE = 1024 * 1024
+
 MAX_UPLOAD_RETRIES = 3
-S3_MAX_RETRIES = 60  # same as frontend
-S3_READ_TIMEOUT = 60 * 5  # 5 minutes
 
 RETRY_BACKOFF_BASE = 2  # exponential backoff base
 MAX_RETRIES = 5
 
+MB = 1024 * 1024
+S3_MIN_PART_SIZE = 5 * MB  # s3 rejects smaller parts (except the last one)
+S3_MAX_PARTS = 10_000  # s3 rejects multipart uploads with more parts
+DEFAULT_MULTIPART_THRESHOLD = 8 * MB
+DEFAULT_MIN_PART_SIZE = 8 * MB
+DEFAULT_MAX_PART_SIZE = 32 * MB
+DEFAULT_TARGET_PARTS = 1000
+DEFAULT_MAX_PART_CONCURRENCY = 16
+# parts are buffered in memory while they are uploaded (see `_s3_upload`)
+DEFAULT_MAX_BUFFERED_BYTES = 512 * MB
+
+
+class MultipartConfig(NamedTuple):
+    """\
+    tuning for multipart uploads, fields that are `None` are derived from the file size
+    """
+
+    part_size: Optional[int] = None
+    concurrency: Optional[int] = None
+    threshold: Optional[int] = None
+
 
-class UploadCredentials(NamedTuple):
-    access_key: str
-    secret_key: str
-    session_token: str
-    file_id: UUID
-    bucket: str
+def _default_part_size(size: int) -> int:
+    # aim for `DEFAULT_TARGET_PARTS` parts, rounded up to full MBs
+    part_size = math.ceil(size / DEFAULT_TARGET_PARTS / MB) * MB
+    return min(max(part_size, DEFAULT_MIN_PART_SIZE), DEFAULT_MAX_PART_SIZE)
+
+
+def _get_transfer_config(size: int, multipart: Optional[MultipartConfig] = None) -> boto3.s3.transfer.TransferConfig:
+    """\
+    builds the boto3 transfer config for a file of `size` bytes
+    """
+    multipart = multipart or MultipartConfig()
+
+    part_size = multipart.part_size or _default_part_size(size)
+    # respect the s3 limits regardless of what the user asked for
+    part_size = max(part_size, S3_MIN_PART_SIZE, math.ceil(size / S3_MAX_PARTS))
+    n_parts = max(1, math.ceil(size / part_size))
+
+    concurrency = multipart.concurrency or max(
+        1, min(n_parts, DEFAULT_MAX_PART_CONCURRENCY, DEFAULT_MAX_BUFFERED_BYTES // part_size)
+    )
+    threshold = multipart.threshold or DEFAULT_MULTIPART_THRESHOLD
+
+    config = boto3.s3.transfer.TransferConfig(
+        multipart_threshold=threshold,
+        multipart_chunksize=part_size,
+        max_concurrency=concurrency,
+        use_threads=concurrency > 1,
+        # the crt client reads files on its own, we rely on s3transfer reading them in order
+        preferred_transfer_client="classic",
+    )
+    # bound the memory used by parts read ahead of the upload
+    config.max_in_memory_upload_chunks = concurrency
+    return config
 
 
 def _confirm_file_upload(client: AuthenticatedClient, file_id: UUID, file_hash: str) -> None:
@@ -68,8 +171,12 @@ def _confirm_file_upload(client: AuthenticatedClient, file_id: UUID, file_hash:
 
 
 def _cancel_file_upload(client: AuthenticatedClient, file_id: UUID, mission_id: UUID) -> None:
+    _cancel_file_uploads(client, [file_id], mission_id)
+
+
+def _cancel_file_uploads(client: AuthenticatedClient, file_ids: Sequence[UUID], mission_id: UUID) -> None:
     data = {
-        "uuids": [str(file_id)],
+        "uuids": [str(file_id) for file_id in file_ids],
         "missionUuid": str(mission_id),
     }
     resp = client.post(UPLOAD_CANCEL, json=data)
@@ -85,7 +192,29 @@ SECRET_KEY_FIELD = "secretKey"
 SESSION_TOKEN_FIELD = "sessionToken"
 CREDENTIALS_FIELD = "accessCredentials"
 FILE_ID_FIELD = "fileUUID"
+FILE_NAME_FIELD = "fileName"
 BUCKET_FIELD = "bucket"
+ERROR_FIELD = "error"
+ERRORS_FIELD = "errors"
+ERROR_FILENAME_FIELD = "filename"
+
+
+def _parse_upload_credentials(data: Dict[str, Any]) -> UploadCredentials:
+    bucket = data[BUCKET_FIELD]
+    file_id = UUID(data[FILE_ID_FIELD], version=4)
+
+    creds = data[CREDENTIALS_FIELD]
+    access_key = creds[ACCESS_KEY_FIELD]
+    secret_key = creds[SECRET_KEY_FIELD]
+    session_token = creds[SESSION_TOKEN_FIELD]
+
+    return UploadCredentials(
+        access_key=access_key,
+        secret_key=secret_key,
+        session_token=session_token,
+        file_id=file_id,
+        bucket=bucket,
+    )
 
 
 def _get_upload_creditials(
@@ -107,52 +236,198 @@ def _get_upload_creditials(
 
     data = resp.json()["data"][0]
 
-    if data.get("error") == FILE_EXISTS_ERROR:
+    if data.get(ERROR_FIELD) == FILE_EXISTS_ERROR:
         return None
 
-    bucket = data[BUCKET_FIELD]
-    file_id = UUID(data[FILE_ID_FIELD], version=4)
+    return _parse_upload_credentials(data)
 
-    creds = data[CREDENTIALS_FIELD]
-    access_key = creds[ACCESS_KEY_FIELD]
-    secret_key = creds[SECRET_KEY_FIELD]
-    session_token = creds[SESSION_TOKEN_FIELD]
 
-    return UploadCredentials(
-        access_key=access_key,
-        secret_key=secret_key,
-        session_token=session_token,
-        file_id=file_id,
-        bucket=bucket,
-    )
+def _get_upload_credentials_batch(
+    client: AuthenticatedClient, internal_filenames: Sequence[str], mission_id: UUID
+) -> Dict[str, Optional[UploadCredentials]]:
+    """\
+    requests upload credentials for many files in a single request
+
+    files that already exist map to `None`, files the backend
+    refused for any other reason are missing from the result
+    """
+    ret: Dict[str, Optional[UploadCredentials]] = {}
+    remaining = list(internal_filenames)
+    while remaining:
+        dct = {
+            "filenames": remaining,
+            "missionUUID": str(mission_id),
+            "source": "CLI",
+        }
+        resp = client.post(UPLOAD_CREDS, json=dct)
+
+        # 409 Conflict means some files already exist, the backend lists
+        # them and does not create any file, so we retry with the rest
+        if resp.status_code == 409:
+            errors = resp.json().get(ERRORS_FIELD) or []
+            existing = {error.get(ERROR_FILENAME_FIELD) for error in errors} & set(remaining)
+            if not existing:
+                resp.raise_for_status()
+            ret.update({name: None for name in existing})
+            remaining = [name for name in remaining if name not in existing]
+            continue
+
+        resp.raise_for_status()
+        for data in resp.json()["data"]:
+            name = data[FILE_NAME_FIELD]
+            if data.get(ERROR_FIELD) == FILE_EXISTS_ERROR:
+                ret[name] = None
+            elif data.get(ERROR_FIELD):
+                logger.error(f"no upload credentials for {name}: {data[ERROR_FIELD]}")
+            else:
+                ret[name] = _parse_upload_credentials(data)
+        break
+    return ret
 
 
 def _s3_upload(
     local_path: Path,
     *,
-    endpoint: str,
+    transport: S3Transport,
     credentials: UploadCredentials,
-    pbar: tqdm,
-) -> None:
-    # configure boto3
-    config = botocore.config.Config(
-        retries={"max_attempts": S3_MAX_RETRIES},
-        read_timeout=S3_READ_TIMEOUT,
-    )
-    client = boto3.client(
-        "s3",
-        endpoint_url=endpoint,
-        aws_access_key_id=credentials.access_key,
-        aws_secret_access_key=credentials.secret_key,
-        aws_session_token=credentials.session_token,
-        config=config,
-    )
-    client.upload_file(
-        str(local_path),
-        credentials.bucket,
-        str(credentials.file_id),
-        Callback=pbar.update,
-    )
+    callback: Callable[[int], Any],
+    mission_id: UUID,
+    filename: str,
+    multipart: Optional[MultipartConfig] = None,
+    journal: Optional[UploadJournal] = None,
+    entry: Optional[JournalEntry] = None,
+    limiter: Optional[RateLimiter] = None,
+) -> str:
+    """\
+    uploads the file and returns its b64 md5 hash
+
+    the hash is computed from the bytes read for the upload, s3transfer
+    reads the parts of an open file in order and re-sends them from memory,
+    so every byte is only read from disk once
+
+    multipart uploads are recorded in the `journal` so they can be resumed,
+    pass the journal `entry` of the file to resume its upload, `limiter`
+    throttles the bytes sent
+    """
+    stat = local_path.stat()
+    size = stat.st_size
+    config = _get_transfer_config(size, multipart)
+
+    if journal is not None and (entry is not None or size >= config.multipart_threshold):
+        file_hash = _s3_multipart_upload(
+            local_path,
+            transport=transport,
+            credentials=credentials,
+            callback=callback,
+            config=config,
+            journal=journal,
+            mission_id=mission_id,
+            filename=filename,
+            entry=entry,
+            limiter=limiter,
+        )
+        remember_b64_md5(local_path, file_hash, stat=stat)
+        return file_hash
+
+    # s3transfer calls back while the bytes are sent, blocking there throttles the upload
+    if limiter is not None and limiter.enabled:
+        progress_callback = callback
+
+        def callback(nbytes: int) -> None:
+            limiter.consume(nbytes)
+            progress_callback(nbytes)
+
+    with open(local_path, "rb") as f:
+        reader = HashingReader(f)
+        transport.upload_fileobj(
+            reader,
+            credentials=credentials,
+            callback=callback,
+            config=config,
+        )
+
+    streamed_hash = reader.b64_md5(size)
+    if streamed_hash is None:
+        logger.warning(f"file was not read in order during upload, rehashing {local_path}")
+        return cached_b64_md5(local_path, rehash=True)
+    remember_b64_md5(local_path, streamed_hash, stat=stat)
+    return streamed_hash
+
+
+def _s3_multipart_upload(
+    local_path: Path,
+    *,
+    transport: S3Transport,
+    credentials: UploadCredentials,
+    callback: Callable[[int], Any],
+    config: boto3.s3.transfer.TransferConfig,
+    journal: UploadJournal,
+    mission_id: UUID,
+    filename: str,
+    entry: Optional[JournalEntry] = None,
+    limiter: Optional[RateLimiter] = None,
+) -> str:
+    """\
+    uploads the file part by part and records every part in the journal,
+    returns the b64 md5 hash of the file
+
+    when resuming, parts that s3 already has are only read to compute the hash
+    """
+    stat = local_path.stat()
+    with transport.registered(credentials):
+        if entry is None:
+            part_size = config.multipart_chunksize
+            upload_id = transport.create_multipart_upload(credentials)
+            journal.start(
+                mission_id,
+                filename,
+                local_path,
+                stat=stat,
+                credentials=credentials,
+                upload_id=upload_id,
+                part_size=part_size,
+            )
+            parts: Dict[int, str] = {}
+        else:
+            part_size = entry.part_size
+            upload_id = entry.upload_id
+            try:
+                remote_parts = transport.list_parts(credentials, upload_id)
+            except Exception:
+                # the upload was aborted or the credentials are no longer valid
+                journal.remove(credentials.file_id)
+                raise
+            parts = {n: etag for n, etag in entry.parts.items() if remote_parts.get(n) == etag}
+
+        callbacks = [callback] if limiter is None or not limiter.enabled else [limiter.consume, callback]
+
+        def upload_part(part_number: int, data: bytes) -> Tuple[int, str]:
+            etag = transport.upload_part(credentials, upload_id, part_number, data, callbacks=callbacks)
+            journal.add_part(credentials.file_id, part_number, etag)
+            return part_number, etag
+
+        hash_md5 = hashlib.md5()
+        n_parts = max(1, math.ceil(stat.st_size / part_size))
+        concurrency = config.max_request_concurrency
+        pending: Set[Future[Tuple[int, str]]] = set()
+        with open(local_path, "rb") as f, ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for part_number in range(1, n_parts + 1):
+                data = f.read(part_size)
+                hash_md5.update(data)
+                if part_number in parts:
+                    callback(len(data))
+                    continue
+
+                # bound the number of parts held in memory
+                while len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    parts.update(future.result() for future in done)
+                pending.add(executor.submit(upload_part, part_number, data))
+            parts.update(future.result() for future in as_completed(pending))
+
+        transport.complete_multipart_upload(credentials, upload_id, parts)
+    journal.remove(credentials.file_id)
+    return base64.b64encode(hash_md5.digest()).decode("utf-8")
 
 
 class UploadState(Enum):
@@ -161,31 +436,145 @@ class UploadState(Enum):
     CANCELED = 3
 
 
-def _get_upload_credentials_with_retry(client, pbar, filename, mission_id, max_attempts=5):
-    """
-    Retrieves upload credentials with retry logic.
+CREDENTIALS_BATCH_SIZE = 64
+# temporary credentials expire, so we only prefetch a limited amount of data
+CREDENTIALS_BATCH_MAX_BYTES = 32 * 1024**3
+HANDSHAKE_WORKERS = 4
+
 
-    Args:
-        client: The client object used for retrieving credentials.
-        filename: The internal filename.
-        mission_id: The mission ID.
-        max_attempts: Maximum number of retry attempts.
+def _split_into_windows(files: Dict[str, Path], max_files: int, max_bytes: int) -> List[List[str]]:
+    windows: List[List[str]] = []
+    window: List[str] = []
+    window_bytes = 0
+    for name, path in files.items():
+        size = path.stat().st_size
+        if window and (len(window) >= max_files or window_bytes + size > max_bytes):
+            windows.append(window)
+            window, window_bytes = [], 0
+        window.append(name)
+        window_bytes += size
+    if window:
+        windows.append(window)
+    return windows
 
-    Returns:
-        The upload credentials or None if retrieval fails after all attempts.
+
+class UploadHandshake:
+    """\
+    batches the per file api calls of an upload session
+
+    credentials are requested for a window of files in one request and the
+    next window is prefetched while the current one uploads, cancels are
+    collected and sent in one request, confirms are sent in the background
+    so workers can move on to the next file right away
+
+    `close` must be called at the end, it waits for pending confirms,
+    cancels prefetched credentials that were never used and returns
+    the confirm errors by filename
     """
-    attempt = 0
-    while attempt < max_attempts:
-        creds = _get_upload_creditials(client, internal_filename=filename, mission_id=mission_id)
-        if creds is not None:
-            return creds
 
-        attempt += 1
-        if attempt < max_attempts:
-            delay = 2**attempt  # Exponential backoff (2, 4, 8, 16...)
-            sleep(delay)
+    def __init__(
+        self,
+        client: AuthenticatedClient,
+        mission_id: UUID,
+        files: Dict[str, Path],
+        *,
+        batch_size: int = CREDENTIALS_BATCH_SIZE,
+        max_batch_bytes: int = CREDENTIALS_BATCH_MAX_BYTES,
+    ) -> None:
+        self._client = client
+        self._mission_id = mission_id
+
+        self._windows = _split_into_windows(files, batch_size, max_batch_bytes)
+        self._window_index = {name: idx for idx, window in enumerate(self._windows) for name in window}
+        self._window_futures: Dict[int, Future[Dict[str, Optional[UploadCredentials]]]] = {}
+        self._handed_out: Set[str] = set()
+
+        self._cancels: List[UUID] = []
+        self._confirms: Dict[str, Future[None]] = {}
+
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=HANDSHAKE_WORKERS)
+
+    def _fetch_window(self, idx: int) -> Future[Dict[str, Optional[UploadCredentials]]]:
+        # requires `self._lock`
+        if idx not in self._window_futures:
+            self._window_futures[idx] = self._executor.submit(
+                _get_upload_credentials_batch, self._client, self._windows[idx], self._mission_id
+            )
+        return self._window_futures[idx]
+
+    def credentials(self, filename: str) -> Optional[UploadCredentials]:
+        """\
+        returns the prefetched credentials for `filename`, `None` if the file exists
+        """
+        if filename not in self._window_index:
+            return self.renew(filename)
+
+        idx = self._window_index[filename]
+        with self._lock:
+            if filename in self._handed_out:
+                raise RuntimeError(f"credentials for {filename} were already used, use `renew`")
+            self._handed_out.add(filename)
+            future = self._fetch_window(idx)
+            if idx + 1 < len(self._windows):
+                self._fetch_window(idx + 1)
+
+        creds = future.result()
+        if filename not in creds:
+            raise RuntimeError(f"backend did not issue upload credentials for {filename}")
+        return creds[filename]
+
+    def renew(self, filename: str) -> Optional[UploadCredentials]:
+        """\
+        requests new credentials for `filename` after its upload was canceled,
+        `None` if the backend reports the file as existing
+        """
+        creds = _get_upload_creditials(self._client, internal_filename=filename, mission_id=self._mission_id)
+        if creds is None:
+            logger.warning(f"backend did not issue new upload credentials for {filename}, the file exists")
+        return creds
+
+    def cancel(self, file_id: UUID) -> None:
+        with self._lock:
+            self._cancels.append(file_id)
+
+    def flush_cancels(self) -> None:
+        with self._lock:
+            file_ids, self._cancels = self._cancels, []
+        if not file_ids:
+            return
+        try:
+            _cancel_file_uploads(self._client, file_ids, self._mission_id)
+        except Exception as e:
+            logger.error(f"Failed to cancel upload for {', '.join(map(str, file_ids))}: {e}")
+
+    def confirm(self, filename: str, file_id: UUID, file_hash: str) -> None:
+        future = self._executor.submit(_confirm_file_upload, self._client, file_id, file_hash)
+        with self._lock:
+            self._confirms[filename] = future
+
+    def close(self) -> Dict[str, Exception]:
+        failures: Dict[str, Exception] = {}
+        for filename, confirm in self._confirms.items():
+            try:
+                confirm.result()
+            except Exception as e:
+                logger.error(format_traceback(e))
+                failures[filename] = e
+
+        # prefetched credentials that were never used leave files in the uploading state
+        for window in self._window_futures.values():
+            try:
+                creds = window.result()
+            except Exception:
+                continue  # the worker that needed these already reported the error
+            for filename, cred in creds.items():
+                if cred is not None and filename not in self._handed_out:
+                    self.cancel(cred.file_id)
 
-    return None
+        self.flush_cancels()
+        self._executor.shutdown()
+        return failures
 
 
 # TODO: i dont want to handle errors at this level
@@ -197,53 +586,151 @@ def upload_file(
     path: Path,
     verbose: bool = False,
     s3_endpoint: Optional[str] = None,
+    multipart: Optional[MultipartConfig] = None,
+    transport: Optional[S3Transport] = None,
+    handshake: Optional[UploadHandshake] = None,
+    progress: Optional[Callable[[int], Any]] = None,
+    limiter: Optional[RateLimiter] = None,
 ) -> Tuple[UploadState, int]:
     """
     returns UploadState and bytes uploaded (0 if not uploaded)
     Retries up to 3 times on failure.
+
+    pass a shared `transport` and `handshake` when uploading many files,
+    otherwise they are created for this file only, `progress` is called
+    with the number of bytes whenever some were uploaded, `limiter` throttles
+    the upload
     """
-    if s3_endpoint is None:
-        s3_endpoint = get_config().endpoint.s3
+    if transport is None:
+        with S3Transport(s3_endpoint or get_config().endpoint.s3) as transport:
+            return upload_file(
+                client,
+                mission_id=mission_id,
+                filename=filename,
+                path=path,
+                verbose=verbose,
+                multipart=multipart,
+                transport=transport,
+                handshake=handshake,
+                progress=progress,
+                limiter=limiter,
+            )
 
-    total_size = path.stat().st_size
-    for attempt in range(MAX_UPLOAD_RETRIES):
+    if handshake is None:
+        handshake = UploadHandshake(client, mission_id, {filename: path})
+        try:
+            ret = upload_file(
+                client,
+                mission_id=mission_id,
+                filename=filename,
+                path=path,
+                verbose=verbose,
+                multipart=multipart,
+                transport=transport,
+                handshake=handshake,
+                progress=progress,
+                limiter=limiter,
+            )
+        finally:
+            failures = handshake.close()
+        if filename in failures:
+            raise failures[filename]
+        return ret
+
+    if progress is None:
         with tqdm(
-            total=total_size,
+            total=path.stat().st_size,
             unit="B",
             unit_scale=True,
             desc=f"uploading {path}...",
             leave=False,
             disable=not verbose,
         ) as pbar:
-
-            # get per file upload credentials
-            creds = _get_upload_credentials_with_retry(
-                client, pbar, filename, mission_id, max_attempts=5 if attempt > 0 else 1
+            return upload_file(
+                client,
+                mission_id=mission_id,
+                filename=filename,
+                path=path,
+                verbose=verbose,
+                multipart=multipart,
+                transport=transport,
+                handshake=handshake,
+                progress=pbar.update,
+                limiter=limiter,
             )
 
-            if creds is None:
-                return UploadState.EXISTS, 0
+    journal = get_upload_journal()
+    total_size = path.stat().st_size
+    restarted = False
+    for attempt in range(MAX_UPLOAD_RETRIES):
+        # bytes of failed attempts are taken back from the progress
+        attempt_bytes = ByteCounter()
+
+        def callback(nbytes: int) -> None:
+            attempt_bytes.add(nbytes)
+            progress(nbytes)
+
+        # multipart uploads that were interrupted are resumed from the journal
+        entry = journal.get(mission_id, filename) if journal is not None else None
+        if entry is not None and not entry.is_resumable(path):
+            assert journal is not None
+            logger.warning(f"can not resume upload of {path}, starting over")
+            journal.remove(entry.credentials.file_id)
+            handshake.cancel(entry.credentials.file_id)
+            handshake.flush_cancels()
+            entry, restarted = None, True
+
+        if entry is not None:
+            if verbose:
+                tqdm.write(styled_string(f"resuming upload of {path}", style="yellow"))
+            creds: Optional[UploadCredentials] = entry.credentials
+        elif attempt == 0 and not restarted:
+            # get per file upload credentials, the first ones are prefetched in batches
+            creds = handshake.credentials(filename)
+        else:
+            creds = handshake.renew(filename)
 
-            try:
-                _s3_upload(path, endpoint=s3_endpoint, credentials=creds, pbar=pbar)
-            except Exception as e:
-                logger.error(format_traceback(e))
-                try:
-                    _cancel_file_upload(client, creds.file_id, mission_id)
-                except Exception as cancel_e:
-                    logger.error(f"Failed to cancel upload for {creds.file_id}: {cancel_e}")
-
-                if attempt < 2:  # Retry if not the last attempt
-                    pbar.update(0)
-                    logger.error(f"Retrying upload for {attempt + 1}")
-                    continue
-                else:
-                    logger.error(f"Cancelling upload for {attempt}")
-                    raise e from e
+        if creds is None:
+            return UploadState.EXISTS, 0
 
+        try:
+            file_hash = _s3_upload(
+                path,
+                transport=transport,
+                credentials=creds,
+                callback=callback,
+                mission_id=mission_id,
+                filename=filename,
+                multipart=multipart,
+                journal=journal,
+                entry=entry,
+                limiter=limiter,
+            )
+        except Exception as e:
+            logger.error(format_traceback(e))
+            progress(-attempt_bytes.value)
+
+            # keep uploads that can be resumed, everything else starts over
+            resumable = journal is not None and journal.get(mission_id, filename) is not None
+            if not resumable:
+                handshake.cancel(creds.file_id)
+
+            if attempt < 2:  # Retry if not the last attempt
+                # the cancel has to go through before we can get new credentials
+                handshake.flush_cancels()
+                logger.error(f"Retrying upload for {attempt + 1}")
+                continue
             else:
-                _confirm_file_upload(client, creds.file_id, b64_md5(path))
-                return UploadState.UPLOADED, total_size
+                logger.error(f"Cancelling upload for {attempt}")
+                if resumable:
+                    tqdm.write(f"upload of {path} was interrupted, run the upload again to resume it")
+                raise e from e
+
+        else:
+            handshake.confirm(filename, creds.file_id, file_hash)
+            return UploadState.UPLOADED, total_size
+
+    assert False, "unreachable"
 
 
 def _get_file_download(client: AuthenticatedClient, id: UUID) -> str:
@@ -259,60 +746,625 @@ def _get_file_download(client: AuthenticatedClient, id: UUID) -> str:
 
     resp.raise_for_status()
 
-    return resp.json()["url"]
+    return str(resp.json()["url"])
 
 
-def _url_download(url: str, *, path: Path, size: int, overwrite: bool = False, verbose: bool = False) -> None:
-    if path.exists():
-        if overwrite:
-            path.unlink()
-            downloaded = 0
-        else:
-            downloaded = path.stat().st_size
-            if downloaded >= size:
-                raise FileExistsError(f"file already exists and is complete: {path}")
-    else:
-        downloaded = 0
+# the backend signs download urls for 4 hours
+DOWNLOAD_URL_LIFETIME = 4 * 60 * 60
+# urls are not handed out if they expire sooner than this
+DOWNLOAD_URL_REFRESH_MARGIN = 10 * 60
+DOWNLOAD_URL_PREFETCH = 64
+DOWNLOAD_URL_WORKERS = 8
+
+
+def _url_lifetime(url: str) -> int:
+    # presigned s3 urls carry their lifetime
+    try:
+        return int(parse_qs(urlparse(url).query)["X-Amz-Expires"][0])
+    except (KeyError, ValueError):
+        return DOWNLOAD_URL_LIFETIME
+
+
+class DownloadUrls:
+    """\
+    presigned download urls of a download session
+
+    the backend issues one url per request, so urls for the next files are
+    requested concurrently while the workers download the current ones,
+    urls are cached until shortly before they expire and can be refreshed
+    after the storage rejected them
+
+    `file_ids` are the files in the order they will likely be downloaded,
+    urls of other files are requested on demand
+    """
+
+    def __init__(
+        self,
+        client: AuthenticatedClient,
+        file_ids: Sequence[UUID] = (),
+        *,
+        prefetch: int = DOWNLOAD_URL_PREFETCH,
+        clock: Callable[[], float] = monotonic,
+    ) -> None:
+        self._client = client
+        self._order = list(file_ids)
+        self._index = {file_id: idx for idx, file_id in enumerate(self._order)}
+        self._prefetch = prefetch
+        self._clock = clock
+
+        self._next = 0  # index of the next file to prefetch
+        self._urls: Dict[UUID, Future[Tuple[str, float]]] = {}  # url and expiry
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=DOWNLOAD_URL_WORKERS)
+
+    def _fetch(self, file_id: UUID) -> Tuple[str, float]:
+        requested_at = self._clock()
+        url = _get_file_download(self._client, file_id)
+        return url, requested_at + _url_lifetime(url)
+
+    def _submit(self, file_id: UUID) -> Future[Tuple[str, float]]:
+        # requires `self._lock`
+        self._urls[file_id] = self._executor.submit(self._fetch, file_id)
+        return self._urls[file_id]
+
+    def _is_usable(self, future: Future[Tuple[str, float]]) -> bool:
+        if not future.done():
+            return True
+        if future.exception() is not None:
+            return False
+        _, expires_at = future.result()
+        return expires_at - DOWNLOAD_URL_REFRESH_MARGIN > self._clock()
+
+    def get(self, file_id: UUID) -> str:
+        with self._lock:
+            if file_id in self._index:
+                end = min(len(self._order), self._index[file_id] + self._prefetch + 1)
+                while self._next < end:
+                    if self._order[self._next] not in self._urls:
+                        self._submit(self._order[self._next])
+                    self._next += 1
+
+            future = self._urls.get(file_id)
+            if future is None or not self._is_usable(future):
+                future = self._submit(file_id)
+        return future.result()[0]
+
+    def refresh(self, file_id: UUID, rejected: str) -> str:
+        """\
+        returns a new url for `file_id` unless the cached one differs from `rejected`
+        """
+        with self._lock:
+            future = self._urls.get(file_id)
+            # a pending future is a refresh that is already in flight
+            if future is None or (future.done() and (future.exception() is not None or future.result()[0] == rejected)):
+                future = self._submit(file_id)
+        return future.result()[0]
+
+    def close(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
+
+
+@dataclass
+class _Segment:
+    """\
+    the byte range `[start, end)` of a file, bytes before `offset` are written
+    """
+
+    start: int
+    end: int
+    offset: int
+
+    @property
+    def done(self) -> int:
+        return self.offset - self.start
+
+
+def _split_into_segments(size: int, segment_size: int) -> List[_Segment]:
+    return [_Segment(start, min(start + segment_size, size), start) for start in range(0, size, segment_size)]
+
+
+class _RangesNotSupported(Exception):
+    pass
+
+
+# windows has no positional reads and writes, we seek under a lock instead
+_SEEK_LOCK = Lock()
 
+
+def _pwrite(fd: int, data: bytes, offset: int) -> None:
+    view = memoryview(data)
+    if hasattr(os, "pwrite"):
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view, offset = view[n:], offset + n
+        return
+    with _SEEK_LOCK:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while view:
+            n = os.write(fd, view)
+            view = view[n:]
+
+
+def _pread(fd: int, n: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, n, offset)
+    with _SEEK_LOCK:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, n)
+
+
+class _DownloadHasher:
+    """\
+    md5 of a file that is written at arbitrary offsets
+
+    bytes are hashed in order, bytes written ahead of the hashed prefix are
+    buffered up to `max_buffered` bytes, `catch_up` reads everything else
+    back from the file once the prefix gets there
+    """
+
+    def __init__(self, fd: Optional[int] = None, *, max_buffered: int = DOWNLOAD_HASH_BUFFER_SIZE) -> None:
+        self._fd = fd
+        self._max_buffered = max_buffered
+        self._md5 = hashlib.md5()
+        self._hashed = 0
+        self._pending: Dict[int, bytes] = {}
+        self._buffered = 0
+        self._lock = Lock()
+
+    @property
+    def hashed(self) -> int:
+        return self._hashed
+
+    def update(self, offset: int, data: bytes) -> None:
+        """\
+        `data` must already be written to the file at `offset`
+        """
+        with self._lock:
+            if offset == self._hashed:
+                self._advance(data)
+                self._drain()
+            elif offset > self._hashed and self._buffered + len(data) <= self._max_buffered:
+                self._pending[offset] = data
+                self._buffered += len(data)
+
+    def catch_up(self, end: int) -> None:
+        """\
+        hashes all bytes up to `end`, they must already be written to the file
+        """
+        with self._lock:
+            self._drain()
+            while self._hashed < end:
+                assert self._fd is not None, "catching up requires the file"
+                # read up to the next buffered chunk
+                stop = min([offset for offset in self._pending if offset > self._hashed] + [end])
+                data = _pread(self._fd, min(stop - self._hashed, HASH_READ_SIZE), self._hashed)
+                if not data:
+                    raise RuntimeError(f"unexpected end of file at byte {self._hashed}")
+                self._advance(data)
+                self._drain()
+
+    def _advance(self, data: bytes) -> None:
+        # requires `self._lock`
+        self._md5.update(data)
+        self._hashed += len(data)
+
+    def _drain(self) -> None:
+        # requires `self._lock`
+        while self._hashed in self._pending:
+            data = self._pending.pop(self._hashed)
+            self._buffered -= len(data)
+            self._advance(data)
+
+    def b64_md5(self) -> str:
+        return base64.b64encode(self._md5.digest()).decode("utf-8")
+
+
+def _hash_written(hasher: _DownloadHasher, segments: Sequence[_Segment], starts: Sequence[int]) -> None:
+    """\
+    advances the hash over the bytes that are written in order,
+    `starts` are the start offsets of the segments
+    """
+    i = bisect_right(starts, hasher.hashed) - 1
+    while 0 <= i < len(segments):
+        segment = segments[i]
+        hasher.catch_up(segment.offset)
+        if segment.offset < segment.end:
+            break
+        i += 1
+
+
+PART_SUFFIX = ".part"
+PART_STATE_SUFFIX = ".part.json"
+# how often the progress of a download is saved to its sidecar
+PART_STATE_INTERVAL = 5.0
+
+
+def _preallocate(fd: int, size: int) -> None:
+    """\
+    reserves the space of the whole file up front, this keeps large files in
+    few extents and fails right away if the disk is full, filesystems without
+    support for it get a sparse file instead
+    """
+    if size > 0 and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                raise
+    os.ftruncate(fd, size)
+
+
+class _PartFile:
+    """\
+    a download in progress, `<name>.part` with a `<name>.part.json` sidecar
+
+    the sidecar records the file id, size and remote hash of the download and
+    the byte ranges that were written, a download only resumes if all of them
+    match, completed downloads are renamed into place
+
+    md5 objects can not be saved, a resumed prefix is hashed once more
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        file_id: Optional[UUID],
+        size: int,
+        remote_hash: Optional[str],
+        interval: float = PART_STATE_INTERVAL,
+        clock: Callable[[], float] = monotonic,
+    ) -> None:
+        self.path = path.with_name(path.name + PART_SUFFIX)
+        self.state_path = path.with_name(path.name + PART_STATE_SUFFIX)
+        self.size = size
+        self.segments: List[_Segment] = []
+        self._meta = {"file_id": file_id and str(file_id), "size": size, "hash": remote_hash}
+        self._interval = interval
+        self._clock = clock
+        self._saved_at = clock()
+        self._fd: Optional[int] = None
+        self._lock = Lock()
+
+    @property
+    def fd(self) -> int:
+        assert self._fd is not None, "part file is not open"
+        return self._fd
+
+    def _load(self) -> Optional[List[_Segment]]:
+        if self._meta["file_id"] is None:
+            return None
+        try:
+            state = json.loads(self.state_path.read_text())
+            if any(state.get(key) != value for key, value in self._meta.items()):
+                return None
+            if self.path.stat().st_size != self.size:
+                return None
+            segments = [_Segment(start, end, offset) for start, end, offset in state["segments"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if not all(segment.start <= segment.offset <= segment.end for segment in segments):
+            return None
+        return segments
+
+    def open(self, segment_size: int) -> bool:
+        """\
+        opens the part file, returns `True` if a previous download is resumed
+        """
+        segments = self._load()
+        resumed = segments is not None
+        if segments is None:
+            self.remove()
+            segments = _split_into_segments(self.size, segment_size)
+
+        self.segments = segments
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+        if not resumed:
+            _preallocate(self._fd, self.size)
+            self.save()
+        return resumed
+
+    def _save(self) -> None:
+        # requires `self._lock`, offsets are read before syncing so the sidecar never claims unsynced bytes
+        segments = [[segment.start, segment.end, segment.offset] for segment in self.segments]
+        os.fsync(self.fd)
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        tmp.write_text(json.dumps({**self._meta, "segments": segments}))
+        os.replace(tmp, self.state_path)
+        self._saved_at = self._clock()
+
+    def save(self) -> None:
+        with self._lock:
+            self._save()
+
+    def checkpoint(self) -> None:
+        """\
+        saves the sidecar if the last save is long enough ago
+        """
+        if self._clock() - self._saved_at < self._interval:
+            return
+        with self._lock:
+            if self._clock() - self._saved_at >= self._interval:
+                self._save()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def commit(self, path: Path) -> None:
+        """\
+        moves the completed download to `path`
+        """
+        self.close()
+        os.replace(self.path, path)
+        self.state_path.unlink(missing_ok=True)
+
+    def remove(self) -> None:
+        self.close()
+        self.path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
+
+
+class _DownloadUrl:
+    """\
+    the presigned url of a download, `refresh` is called with a url the storage
+    rejected (e.g. because it expired) and returns a new one
+    """
+
+    def __init__(self, url: str, refresh: Optional[Callable[[str], str]] = None) -> None:
+        self._url = url
+        self._refresh = refresh
+        self._lock = Lock()
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    def refresh(self, rejected: str) -> bool:
+        """\
+        returns `False` if the url can not be refreshed
+        """
+        if self._refresh is None:
+            return False
+        with self._lock:
+            # concurrent segments only refresh once
+            if self._url == rejected:
+                self._url = self._refresh(rejected)
+        return True
+
+
+def _is_forbidden(e: Exception) -> bool:
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 403
+
+
+def _download_segment(
+    client: httpx.Client,
+    url: _DownloadUrl,
+    segment: _Segment,
+    *,
+    fd: int,
+    chunk_size: int,
+    cancelled: Event,
+    progress: Callable[[int], Any],
+    hasher: _DownloadHasher,
+    on_written: Callable[[], None],
+    whole_file: bool = False,
+    limiter: Optional[RateLimiter] = None,
+    verbose: bool = False,
+) -> None:
+    """\
+    downloads a single segment, retries resume at the segment's offset,
+    if the segment is the `whole_file` a server without range support is fine
+    """
     attempt = 0
-    while downloaded < size:
+    while segment.offset < segment.end and not cancelled.is_set():
+        request_url = url.url
         try:
-            headers = {"Range": f"bytes={downloaded}-"}
-            with httpx.stream("GET", url, headers=headers, timeout=S3_READ_TIMEOUT) as response:
-                # Accept both 206 Partial Content and 200 OK if starting from 0
-                if not (response.status_code == 206 or (downloaded == 0 and response.status_code == 200)):
+            headers = {"Range": f"bytes={segment.offset}-{segment.end - 1}"}
+            with client.stream("GET", request_url, headers=headers) as response:
+                if response.status_code == 200 and not (whole_file and segment.offset == 0):
+                    raise _RangesNotSupported("server ignored the range request")
+                if response.status_code not in (200, 206):
                     response.raise_for_status()
                     raise RuntimeError(f"Expected 206 Partial Content, got {response.status_code}")
 
-                mode = "ab" if downloaded > 0 else "wb"
-                with open(path, mode) as f:
-                    with tqdm(
-                        total=size,
-                        initial=downloaded,
-                        desc=f"downloading {path.name}",
-                        unit="B",
-                        unit_scale=True,
-                        leave=False,
-                        disable=not verbose,
-                    ) as pbar:
-                        for chunk in response.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
-                            attempt = 0  # reset attempt counter on successful download of non-empty chunk
-                            if not chunk:
-                                break
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            pbar.update(len(chunk))
-            break  # download complete
+                for chunk in response.iter_bytes(chunk_size=chunk_size):
+                    if cancelled.is_set():
+                        return
+                    attempt = 0  # reset attempt counter on successful download of non-empty chunk
+                    chunk = chunk[: segment.end - segment.offset]
+                    if limiter is not None:
+                        limiter.consume(len(chunk))
+                    _pwrite(fd, chunk, segment.offset)
+                    segment.offset += len(chunk)
+                    hasher.update(segment.offset - len(chunk), chunk)
+                    on_written()
+                    progress(len(chunk))
+
+            if segment.offset < segment.end:
+                raise RuntimeError(f"connection closed at byte {segment.offset} of segment ending at {segment.end}")
+        except _RangesNotSupported:
+            raise
         except Exception as e:
-            logger.info(f"Error: {e}, retrying...")
             attempt += 1
             if attempt > MAX_RETRIES:
                 raise RuntimeError(f"Download failed after {MAX_RETRIES} retries due to {e}") from e
+            if _is_forbidden(e) and url.refresh(request_url):
+                logger.info("download url was rejected, retrying segment with a new url")
+                continue
+            logger.info(f"Error: {e}, retrying segment at {segment.offset}...")
             if verbose:
-                print(f"{e} on attempt {attempt}/{MAX_RETRIES}, retrying after backoff...")
+                tqdm.write(f"{e} on attempt {attempt}/{MAX_RETRIES}, retrying segment after backoff...")
             sleep(RETRY_BACKOFF_BASE**attempt)
 
 
+def _download_segments(
+    client: httpx.Client,
+    url: _DownloadUrl,
+    part: _PartFile,
+    *,
+    connections: int,
+    progress: Callable[[int], Any],
+    limiter: Optional[RateLimiter] = None,
+    verbose: bool = False,
+) -> str:
+    """\
+    downloads the missing bytes of all segments of `part` over `connections`
+    connections, returns the b64 md5 hash of the file
+
+    a failed segment is retried on its own, if it keeps failing the download
+    fails, the written segments are saved to the sidecar either way
+    """
+    segments = part.segments
+    starts = [segment.start for segment in segments]
+    throttled = limiter is not None and limiter.enabled
+    chunk_size = THROTTLED_DOWNLOAD_CHUNK_SIZE if throttled else DOWNLOAD_CHUNK_SIZE
+    cancelled = Event()
+    hasher = _DownloadHasher(part.fd)
+
+    def on_written() -> None:
+        _hash_written(hasher, segments, starts)
+        part.checkpoint()
+
+    # bytes from a previous run count as progress, they are taken back if the download fails
+    resumed = sum(segment.done for segment in segments)
+    progress(resumed)
+    try:
+        on_written()
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = [
+                executor.submit(
+                    _download_segment,
+                    client,
+                    url,
+                    segment,
+                    fd=part.fd,
+                    chunk_size=chunk_size,
+                    cancelled=cancelled,
+                    progress=progress,
+                    hasher=hasher,
+                    on_written=on_written,
+                    whole_file=len(segments) == 1,
+                    limiter=limiter,
+                    verbose=verbose,
+                )
+                for segment in segments
+                if segment.offset < segment.end
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                cancelled.set()
+                raise
+        hasher.catch_up(part.size)
+    except BaseException:
+        progress(-sum(segment.done for segment in segments))
+        part.save()
+        raise
+    return hasher.b64_md5()
+
+
+def _url_download(
+    url: str,
+    *,
+    path: Path,
+    size: int,
+    overwrite: bool = False,
+    verbose: bool = False,
+    progress: Optional[Callable[[int], Any]] = None,
+    limiter: Optional[RateLimiter] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+    refresh_url: Optional[Callable[[str], str]] = None,
+    file_id: Optional[UUID] = None,
+    remote_hash: Optional[str] = None,
+    pool: Optional[S3DownloadPool] = None,
+) -> str:
+    """\
+    downloads `url` to `path`, returns the b64 md5 hash of the file which is
+    computed while downloading, an existing file is only replaced if `overwrite` is set
+
+    the download is written to `<name>.part` and renamed to `path` once it is
+    complete, if `file_id` is given an interrupted download of the same file
+    (same id, size and `remote_hash`) is resumed
+
+    `progress` is called with the number of bytes whenever some were downloaded,
+    `limiter` throttles the download, `refresh_url` is called with the url
+    when the storage rejects it and returns a new one, large files are
+    downloaded over up to `connections` connections at once, connections are
+    taken from `pool` if given
+    """
+    if pool is None:
+        with S3DownloadPool(max_connections=connections) as pool:
+            return _url_download(
+                url,
+                path=path,
+                size=size,
+                overwrite=overwrite,
+                verbose=verbose,
+                progress=progress,
+                limiter=limiter,
+                connections=connections,
+                refresh_url=refresh_url,
+                file_id=file_id,
+                remote_hash=remote_hash,
+                pool=pool,
+            )
+
+    if progress is None:
+        with tqdm(
+            total=size,
+            desc=f"downloading {path.name}",
+            unit="B",
+            unit_scale=True,
+            leave=False,
+            disable=not verbose,
+        ) as pbar:
+            return _url_download(
+                url,
+                path=path,
+                size=size,
+                overwrite=overwrite,
+                verbose=verbose,
+                progress=pbar.update,
+                limiter=limiter,
+                connections=connections,
+                refresh_url=refresh_url,
+                file_id=file_id,
+                remote_hash=remote_hash,
+                pool=pool,
+            )
+
+    if path.exists() and not overwrite:
+        raise FileExistsError(f"file already exists: {path}")
+
+    segmented = connections > 1 and size >= SEGMENTED_DOWNLOAD_THRESHOLD
+    download_url = _DownloadUrl(url, refresh_url)
+    part = _PartFile(path, file_id=file_id, size=size, remote_hash=remote_hash)
+    try:
+        if part.open(DOWNLOAD_SEGMENT_SIZE if segmented else max(size, 1)):
+            logger.info(f"resuming download of {path} from {part.path}")
+
+        client = pool.client(url)
+        try:
+            observed_hash = _download_segments(
+                client, download_url, part, connections=connections, progress=progress, limiter=limiter, verbose=verbose
+            )
+        except _RangesNotSupported as e:
+            logger.info(f"{e}, downloading {path} from the start over a single connection")
+            part.remove()
+            part.open(max(size, 1))
+            observed_hash = _download_segments(
+                client, download_url, part, connections=1, progress=progress, limiter=limiter, verbose=verbose
+            )
+        part.commit(path)
+    finally:
+        part.close()
+    return observed_hash
+
+
 class DownloadState(Enum):
     DOWNLOADED_OK = 1
     SKIPPED_OK = 2
@@ -323,6 +1375,28 @@ class DownloadState(Enum):
     SKIPPED_CORRUPTED = 7
     DOWNLOADED_CORRUPTED = 8
     SKIPPED_CORRUPTED_LOCAL_OK = 9
+    LINKED_FROM_STORE = 10
+
+
+def _materialize_from_store(store: LocalStore, file: File, path: Path, *, verbose: bool = False) -> bool:
+    try:
+        method = store.materialize(file.hash, path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"could not take {path} from the local store, downloading it: {e}")
+        return False
+    if method is None:
+        return False
+    if verbose:
+        tqdm.write(f"{path} taken from the local store ({method})")
+    remember_b64_md5(path, file.hash, stat=path.stat())
+    return True
+
+
+def _add_to_store(store: LocalStore, file: File, path: Path) -> None:
+    try:
+        store.add(path, file.hash)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"could not add {path} to the local store: {e}")
 
 
 def download_file(
@@ -334,9 +1408,25 @@ def download_file(
     allow_corrupt_files: bool = False,
     create_parents: bool = False,
     verbose: bool = False,
+    rehash: bool = False,
+    progress: Optional[Callable[[int], Any]] = None,
+    limiter: Optional[RateLimiter] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+    urls: Optional[DownloadUrls] = None,
+    pool: Optional[S3DownloadPool] = None,
+    store: Optional[LocalStore] = None,
 ) -> Tuple[DownloadState, int]:
     """\
     Returns DownloadState and bytes downloaded (file.size if successful or skipped ok, 0 otherwise)
+
+    hashes of existing files are looked up in the hash cache unless `rehash` is set,
+    `progress` is called with the number of bytes whenever some were downloaded,
+    `limiter` throttles the download, large files are downloaded over up to
+    `connections` connections at once, download urls are taken from `urls` and
+    connections from `pool` if given
+
+    files in the local `store` are linked into place instead of downloaded,
+    downloaded files are added to it
     """
     is_corrupted = file.state == FileState.CORRUPTED
 
@@ -350,7 +1440,7 @@ def download_file(
 
         # compare file size
         if file.size == path.stat().st_size:
-            local_hash = b64_md5(path)
+            local_hash = cached_b64_md5(path, rehash=rehash)
             if local_hash != file.hash and not overwrite and file.hash is not None:
                 return DownloadState.SKIPPED_INVALID_HASH, 0
 
@@ -368,34 +1458,45 @@ def download_file(
         elif verbose:
             tqdm.write(styled_string(f"overwriting {path}, file size mismatch", style="yellow"))
 
-    # request a download url
-    download_url = _get_file_download(client, file.id)
-
     # create parent directories
     if create_parents:
         path.parent.mkdir(parents=True, exist_ok=True)
 
+    # reuse a previous download of the same file
+    if store is not None and file.hash is not None and not is_corrupted:
+        if _materialize_from_store(store, file, path, verbose=verbose):
+            return DownloadState.LINKED_FROM_STORE, file.size
+
+    # request a download url
+    download_url = urls.get(file.id) if urls is not None else _get_file_download(client, file.id)
+
+    def refresh_url(rejected: str) -> str:
+        if urls is not None:
+            return urls.refresh(file.id, rejected)
+        return _get_file_download(client, file.id)
+
     # download the file and check the hash
     try:
-        _url_download(
+        observed_hash = _url_download(
             download_url,
             path=path,
             size=file.size,
             overwrite=overwrite,
             verbose=verbose,
+            progress=progress,
+            limiter=limiter,
+            connections=connections,
+            refresh_url=refresh_url,
+            file_id=file.id,
+            remote_hash=file.hash,
+            pool=pool,
         )
     except Exception as e:
+        # the partial download is kept next to `path` and resumed by the next run
         logger.error(f"Error during download of {path}: {e}")
-        # Attempt to clean up potentially partial file
-        if path.exists():
-            try:
-                path.unlink()
-                logger.info(f"Removed potentially incomplete file {path}")
-            except OSError as unlink_e:
-                logger.error(f"Could not remove partial file {path}: {unlink_e}")
         raise e  # Re-raise to be caught by handler
 
-    observed_hash = b64_md5(path)
+    remember_b64_md5(path, observed_hash, stat=path.stat())
     if file.hash is not None and observed_hash != file.hash:
         print(
             f"HASH MISMATCH: {path} expected={file.hash} observed={observed_hash}",
@@ -407,6 +1508,8 @@ def download_file(
             0,
         )  # 0 bytes considered successful transfer
     # Hash matches or no remote hash to check against
+    if store is not None and file.hash is not None and not is_corrupted:
+        _add_to_store(store, file, path)
     if is_corrupted:
         return DownloadState.DOWNLOADED_CORRUPTED, file.size
     return DownloadState.DOWNLOADED_OK, file.size
@@ -448,10 +1551,18 @@ def _upload_handler(future: Future[Tuple[UploadState, int]], path: Path, *, verb
     return size_bytes
 
 
+# states in which the file was transferred
+DOWNLOADED_STATES = (
+    DownloadState.DOWNLOADED_OK,
+    DownloadState.DOWNLOADED_CORRUPTED,
+    DownloadState.DOWNLOADED_INVALID_HASH,
+)
+
 DOWNLOAD_STATE_COLOR = {
     DownloadState.DOWNLOADED_OK: "green",
     DownloadState.DOWNLOADED_CORRUPTED: "yellow",
     DownloadState.SKIPPED_OK: "green",
+    DownloadState.LINKED_FROM_STORE: "green",
     DownloadState.DOWNLOADED_INVALID_HASH: "red",
     DownloadState.SKIPPED_INVALID_HASH: "yellow",
     DownloadState.SKIPPED_FILE_SIZE_MISMATCH: "yellow",
@@ -489,6 +1600,8 @@ def _download_handler(
         msg = f"downloaded {path} but failed hash check"
     elif state == DownloadState.SKIPPED_OK:
         msg = f"skipped {path} already downloaded (hash ok)"
+    elif state == DownloadState.LINKED_FROM_STORE:
+        msg = f"took {path} from the local store"
     elif state == DownloadState.SKIPPED_INVALID_HASH:
         msg = f"skipped {path}, exists with hash mismatch (use --overwrite?)"
     elif state == DownloadState.SKIPPED_FILE_SIZE_MISMATCH:
@@ -519,6 +1632,7 @@ def _download_handler(
     elif state not in (
         DownloadState.DOWNLOADED_OK,
         DownloadState.SKIPPED_OK,
+        DownloadState.LINKED_FROM_STORE,
     ):
         print(f"SKIP/FAIL: {path.absolute()} ({state.name})", file=sys.stderr)
 
@@ -529,62 +1643,135 @@ def _download_handler(
             DownloadState.DOWNLOADED_OK,
             DownloadState.DOWNLOADED_CORRUPTED,
             DownloadState.SKIPPED_OK,
+            DownloadState.LINKED_FROM_STORE,
         )
         else 0
     )
 
 
+def _get_workers(client: AuthenticatedClient, n_workers: Optional[int]) -> AdaptiveWorkers:
+    """\
+    a fixed number of workers if `n_workers` is given, otherwise adaptive
+    workers starting from the last good value for the endpoint
+    """
+    if n_workers is not None:
+        return AdaptiveWorkers.fixed(n_workers)
+    return AdaptiveWorkers(get_transfer_workers(client.config) or DEFAULT_WORKERS)
+
+
+def _remember_workers(client: AuthenticatedClient, workers: AdaptiveWorkers, n_workers: Optional[int]) -> None:
+    # a transient error would lower the workers of every later session
+    if n_workers is not None or workers.errors:
+        return
+    try:
+        save_transfer_workers(client.config, workers.best, path=client.config_path)
+    except Exception as e:
+        logger.warning(f"could not save the number of workers: {e}")
+
+
 def upload_files(
     client: AuthenticatedClient,
     files: Dict[str, Path],
     mission_id: UUID,
     *,
     verbose: bool = False,
-    n_workers: int = 2,
+    n_workers: Optional[int] = None,
+    multipart: Optional[MultipartConfig] = None,
+    s3_endpoint: Optional[str] = None,
+    max_rate: Optional[int] = None,
+    schedule: TransferSchedule = DEFAULT_SCHEDULE,
 ) -> None:
+    """\
+    uploads files to a mission, `n_workers` files at a time,
+    if `n_workers` is `None` the number of workers adapts to the throughput,
+    `schedule` decides which files are started first
+
+    all workers share a bandwidth limit of `max_rate` bytes per second,
+    by default the limit follows the rate schedule in the config
+    """
+    schedule = TransferSchedule(schedule)
     console = Console(file=sys.stderr)
-    with tqdm(
-        total=len(files),
-        unit="files",
+    workers = _get_workers(client, n_workers)
+    limiter = get_rate_limiter(client.config, UPLOAD, max_rate)
+    # one connection pool for all workers, large enough for all parts in flight
+    part_concurrency = (multipart and multipart.concurrency) or DEFAULT_MAX_PART_CONCURRENCY
+    transport = S3Transport(
+        s3_endpoint or get_config().endpoint.s3,
+        max_pool_connections=workers.max_workers * part_concurrency,
+    )
+    existing_files = {name: path for name, path in files.items() if path.is_file()}
+    sizes = {name: path.stat().st_size for name, path in existing_files.items()}
+    # files with interrupted uploads already have credentials
+    journal = get_upload_journal()
+    new_files = {
+        name: path for name, path in existing_files.items() if journal is None or journal.get(mission_id, name) is None
+    }
+    handshake = UploadHandshake(client, mission_id, new_files)
+    with transport, TransferProgress(
+        sum(sizes.values()),
+        total_files=len(files),
         desc="Uploading files",
         disable=not verbose,
-        leave=True,
-    ) as pbar:
+        listeners=[workers.record],
+    ) as progress:
         start = monotonic()
         futures: Dict[Future[Tuple[UploadState, int]], Path] = {}
 
         skipped_files = 0
         failed_files = 0
-        with ThreadPoolExecutor(max_workers=n_workers) as executor:
-            for name, path in files.items():
-                if not path.is_file():
-                    console.print(f"[yellow]Skipping non-existent file: {path}[/yellow]")
-                    pbar.update()
-                    continue
-
-                future = executor.submit(
-                    upload_file,
-                    client=client,
-                    mission_id=mission_id,
-                    filename=name,
-                    path=path,
-                    verbose=verbose,
-                )
-                futures[future] = path
-
-            total_uploaded_bytes = 0
-            for future in as_completed(futures):
-
-                if future.exception():
-                    failed_files += 1
-
-                if future.exception() is None and future.result()[0] == UploadState.EXISTS:
-                    skipped_files += 1
-
-                path = futures[future]
-                uploaded_bytes = _upload_handler(future, path, verbose=verbose)
-                total_uploaded_bytes += uploaded_bytes
-                pbar.update()
+        total_uploaded_bytes = 0
+        try:
+            with ThreadPoolExecutor(max_workers=workers.max_workers) as executor:
+                for name, path in schedule_transfers(list(files.items()), lambda item: sizes.get(item[0], 0), schedule):
+                    if name not in existing_files:
+                        console.print(f"[yellow]Skipping non-existent file: {path}[/yellow]")
+                        progress.file_done()
+                        continue
+
+                    future = executor.submit(
+                        workers.run,
+                        upload_file,
+                        client=client,
+                        mission_id=mission_id,
+                        filename=name,
+                        path=path,
+                        verbose=verbose,
+                        multipart=multipart,
+                        transport=transport,
+                        handshake=handshake,
+                        progress=progress.update,
+                        limiter=limiter,
+                    )
+                    futures[future] = path
+
+                for future in as_completed(futures):
+                    path = futures[future]
+
+                    if future.exception():
+                        failed_files += 1
+                        progress.skip(path.stat().st_size)
+
+                    if future.exception() is None and future.result()[0] == UploadState.EXISTS:
+                        skipped_files += 1
+                        progress.skip(path.stat().st_size)
+
+                    uploaded_bytes = _upload_handler(future, path, verbose=verbose)
+                    total_uploaded_bytes += uploaded_bytes
+                    progress.file_done()
+        finally:
+            confirm_failures = handshake.close()
+            _remember_workers(client, workers, n_workers)
+            expire_metadata_cache(client.config)
+
+    # confirms are sent in the background, files are only uploaded once they are confirmed
+    for name, exc in confirm_failures.items():
+        path = files[name]
+        failed_files += 1
+        total_uploaded_bytes -= path.stat().st_size
+        if verbose:
+            tqdm.write(format_error(f"error confirming upload of {path}", exc, verbose=verbose))
+        else:
+            print(f"ERROR: {path.absolute()}: {exc}", file=sys.stderr)
 
     end = monotonic()
     elapsed_time = end - start
@@ -596,6 +1783,7 @@ def upload_files(
         console.print(f"Upload took {elapsed_time:.2f} seconds")
         console.print(f"Total uploaded: {format_bytes(total_uploaded_bytes)}")
         console.print(f"Average speed: {format_bytes(avg_speed_bps, speed=True)}")
+        console.print(f"Schedule: {schedule.value}")
 
         if failed_files > 0:
             console.print(
@@ -607,6 +1795,71 @@ def upload_files(
             console.print(f"\nUploaded {len(files) - skipped_files} files, {skipped_files} skipped")
 
 
+def _in_store(store: Optional[LocalStore], file: File) -> bool:
+    if store is None or file.hash is None or file.state != FileState.OK:
+        return False
+    try:
+        return file.hash in store
+    except sqlite3.Error:
+        return False
+
+
+def _likely_downloads(
+    files: Dict[Path, File],
+    *,
+    overwrite: bool,
+    allow_corrupt_files: bool,
+    store: Optional[LocalStore] = None,
+) -> List[UUID]:
+    """\
+    the files that will most likely be downloaded, existing files are usually
+    skipped and files in the local `store` are linked into place
+    """
+    states = (FileState.OK, FileState.CORRUPTED) if allow_corrupt_files else (FileState.OK,)
+    return [
+        file.id
+        for path, file in files.items()
+        if file.state in states
+        and (not path.exists() or (overwrite and path.stat().st_size != file.size))
+        and not _in_store(store, file)
+    ]
+
+
+def _existing_ancestor(path: Path) -> Path:
+    for parent in path.parents:
+        if parent.exists():
+            return parent
+    return Path.cwd()
+
+
+def _check_disk_space(files: Dict[Path, File], file_ids: Collection[UUID]) -> None:
+    """\
+    raises `InsufficientDiskSpace` if the files in `file_ids` do not fit on the
+    filesystems they are downloaded to, part files of interrupted downloads
+    are preallocated and thus already count as written
+    """
+    needed: Dict[int, int] = {}
+    roots: Dict[int, Path] = {}
+    file_ids = set(file_ids)
+    for path, file in files.items():
+        if file.id not in file_ids:
+            continue
+        part = path.with_name(path.name + PART_SUFFIX)
+        allocated = part.stat().st_size if part.is_file() else 0
+
+        root = _existing_ancestor(path)
+        device = root.stat().st_dev
+        roots.setdefault(device, root)
+        needed[device] = needed.get(device, 0) + max((file.size or 0) - allocated, 0)
+
+    for device, nbytes in needed.items():
+        free = shutil.disk_usage(roots[device]).free
+        if nbytes > free:
+            raise InsufficientDiskSpace(
+                f"the download needs {format_bytes(nbytes)} but only {format_bytes(free)} are free on {roots[device]}"
+            )
+
+
 def download_files(
     client: AuthenticatedClient,
     files: Dict[Path, File],
@@ -615,24 +1868,59 @@ def download_files(
     overwrite: bool = False,
     allow_corrupt_files: bool = False,
     create_parents: bool = False,
-    n_workers: int = 2,
+    n_workers: Optional[int] = None,
+    rehash: bool = False,
+    max_rate: Optional[int] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+    schedule: TransferSchedule = DEFAULT_SCHEDULE,
+    check_disk_space: bool = True,
+    local_store: bool = True,
 ) -> None:
+    """\
+    downloads files to the given paths, `n_workers` files at a time,
+    if `n_workers` is `None` the number of workers adapts to the throughput,
+    large files are downloaded over up to `connections` connections each,
+    `schedule` decides which files are started first
+
+    unless `check_disk_space` is unset the download fails before it starts
+    if the files do not fit on the destination filesystem, with `local_store`
+    files are reused from and added to the local store in the config, if any
+
+    all workers share a bandwidth limit of `max_rate` bytes per second,
+    by default the limit follows the rate schedule in the config
+    """
+    schedule = TransferSchedule(schedule)
+    store = open_local_store(client.config) if local_store else None
+    # urls are prefetched in the order the files are started
+    scheduled = schedule_transfers(list(files.items()), lambda item: item[1].size or 0, schedule)
+    likely_downloads = _likely_downloads(
+        dict(scheduled), overwrite=overwrite, allow_corrupt_files=allow_corrupt_files, store=store
+    )
+    if check_disk_space:
+        _check_disk_space(files, likely_downloads)
+
     console = Console(file=sys.stderr)
-    with tqdm(
-        total=len(files),
-        unit="files",
+    workers = _get_workers(client, n_workers)
+    limiter = get_rate_limiter(client.config, DOWNLOAD, max_rate)
+    urls = DownloadUrls(client, likely_downloads)
+    # one connection pool for all workers, large enough for all segments in flight
+    pool = S3DownloadPool(max_connections=workers.max_workers * connections)
+    with closing(urls), pool, closing(store) if store is not None else nullcontext(), TransferProgress(
+        sum(file.size or 0 for file in files.values()),
+        total_files=len(files),
         desc="Downloading files",
         disable=not verbose,
-        leave=True,
-    ) as pbar:
+        listeners=[workers.record],
+    ) as progress:
 
         start = monotonic()
         futures: Dict[Future[Tuple[DownloadState, int]], Tuple[File, Path]] = {}
         failed_files = 0
         state_counts: Dict[DownloadState, int] = {}
-        with ThreadPoolExecutor(max_workers=n_workers) as executor:
-            for path, file in files.items():
+        with ThreadPoolExecutor(max_workers=workers.max_workers) as executor:
+            for path, file in scheduled:
                 future = executor.submit(
+                    workers.run,
                     download_file,
                     client=client,
                     file=file,
@@ -641,6 +1929,13 @@ def download_files(
                     allow_corrupt_files=allow_corrupt_files,
                     create_parents=create_parents,
                     verbose=verbose,
+                    rehash=rehash,
+                    progress=progress.update,
+                    limiter=limiter,
+                    connections=connections,
+                    urls=urls,
+                    pool=pool,
+                    store=store,
                 )
                 futures[future] = (file, path)
 
@@ -649,12 +1944,16 @@ def download_files(
                 file, path = futures[future]
                 if future.exception() is not None:
                     failed_files += 1
+                    progress.skip(file.size or 0)
                 else:
                     state, _ = future.result()
                     state_counts[state] = state_counts.get(state, 0) + 1
+                    if state not in DOWNLOADED_STATES:
+                        progress.skip(file.size or 0)
                 downloaded_bytes = _download_handler(future, file, path, verbose=verbose)
                 total_downloaded_bytes += downloaded_bytes
-                pbar.update()
+                progress.file_done()
+    _remember_workers(client, workers, n_workers)
 
     end = monotonic()
     elapsed_time = end - start
@@ -664,11 +1963,13 @@ def download_files(
     console.print(f"Download took {elapsed_time:.2f} seconds")
     console.print(f"Total downloaded/verified: {format_bytes(total_downloaded_bytes)}")
     console.print(f"Average speed: {format_bytes(avg_speed_bps, speed=True)}")
+    console.print(f"Schedule: {schedule.value}")
     console.print(
         "Summary: "
         f"{state_counts.get(DownloadState.DOWNLOADED_OK, 0)} downloaded OK, "
         f"{state_counts.get(DownloadState.DOWNLOADED_CORRUPTED, 0)} downloaded corrupted, "
         f"{state_counts.get(DownloadState.SKIPPED_OK, 0)} skipped already-present, "
+        f"{state_counts.get(DownloadState.LINKED_FROM_STORE, 0)} from local store, "
         f"{state_counts.get(DownloadState.SKIPPED_CORRUPTED, 0)} skipped corrupted (blocked), "
         f"{state_counts.get(DownloadState.SKIPPED_CORRUPTED_LOCAL_OK, 0)} skipped corrupted (already present), "
         f"{state_counts.get(DownloadState.SKIPPED_INVALID_HASH, 0)} skipped hash mismatch, "
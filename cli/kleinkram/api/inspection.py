@@ -0,0 +1,89 @@
+"""\
+inspects remote recordings without downloading them
+
+mcap files list their channels and message counts in the summary at the end
+of the file, ros1 bags have an index section with their connections and
+per chunk message counts, both are read with a few range requests
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import replace
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.partial_download import file_reader
+from kleinkram.api.transport import S3DownloadPool
+from kleinkram.errors import FileTypeNotSupported
+from kleinkram.mcap import NS_PER_S
+from kleinkram.mcap import McapSummary
+from kleinkram.mcap import read_summary
+from kleinkram.models import File
+from kleinkram.models import RecordingInfo
+from kleinkram.models import TopicInfo
+from kleinkram.rosbag import BagIndex
+from kleinkram.rosbag import read_bag_index
+
+INSPECTABLE_SUFFIXES = (".mcap", ".bag")
+
+
+def _datetime(ns: Optional[int]) -> Optional[datetime]:
+    if ns is None:
+        return None
+    return datetime.fromtimestamp(ns / NS_PER_S, tz=timezone.utc)
+
+
+def _recording_info(counts: Dict[Tuple[str, str], Optional[int]], start: Optional[int], end: Optional[int]) -> RecordingInfo:
+    topics = [TopicInfo(name=topic, type_=type_, message_count=n) for (topic, type_), n in sorted(counts.items())]
+    return RecordingInfo(topics=topics, start_time=_datetime(start), end_time=_datetime(end))
+
+
+def mcap_recording_info(summary: McapSummary) -> RecordingInfo:
+    # several channels may share a topic
+    counts: Dict[Tuple[str, str], Optional[int]] = {}
+    channel_counts = summary.statistics.channel_message_counts if summary.statistics is not None else None
+    for channel in summary.channels.values():
+        schema = summary.schemas.get(channel.schema_id)
+        key = (channel.topic, schema.name if schema is not None else "")
+        n = channel_counts.get(channel.id, 0) if channel_counts is not None else None
+        previous = counts.get(key, 0)
+        counts[key] = None if n is None or previous is None else previous + n
+    return _recording_info(counts, summary.start_time, summary.end_time)
+
+
+def bag_recording_info(index: BagIndex) -> RecordingInfo:
+    counts: Counter[Tuple[str, str]] = Counter()
+    for connection in index.connections.values():
+        counts[(connection.topic, connection.type)] += index.message_counts.get(connection.id, 0)
+    return _recording_info(dict(counts), index.start_time, index.end_time)
+
+
+def inspect_file(client: AuthenticatedClient, file: File, *, pool: Optional[S3DownloadPool] = None) -> RecordingInfo:
+    """\
+    reads the topics, message counts and time span of a remote mcap or ros1 bag file
+
+    raises `FileTypeNotSupported` for other files, `McapError` or `BagError`
+    if the file has no index or is not a valid recording
+    """
+    suffix = Path(file.name).suffix
+    if suffix not in INSPECTABLE_SUFFIXES:
+        raise FileTypeNotSupported(f"can not inspect {file.name}, only {', '.join(INSPECTABLE_SUFFIXES)} files")
+
+    if pool is None:
+        with S3DownloadPool(max_connections=1) as pool:
+            return inspect_file(client, file, pool=pool)
+
+    reader = file_reader(client, file, pool)
+    if suffix == ".mcap":
+        return mcap_recording_info(read_summary(reader.read, file.size))
+    return bag_recording_info(read_bag_index(reader.read, file.size))
+
+
+def with_topics(file: File, info: RecordingInfo) -> File:
+    return replace(file, topics=list(dict.fromkeys(topic.name for topic in info.topics)))
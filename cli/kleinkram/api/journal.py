@@ -0,0 +1,193 @@
+"""\
+an on-disk journal of in-flight multipart uploads
+
+for every multipart upload we record the upload id, the temporary
+credentials and the parts that were already uploaded, if the process
+dies a rerun of the same upload only sends the missing parts
+
+the journal contains temporary s3 credentials, it is only readable by the user
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+from uuid import UUID
+
+from kleinkram.api.transport import UploadCredentials
+from kleinkram.config import STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_JOURNAL_PATH = STATE_DIR / "uploads.sqlite"
+
+# the backend issues upload credentials that are valid for 4 hours,
+# leave some time to actually finish the upload
+CREDENTIALS_MAX_AGE = 60 * 60 * 3
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS uploads (
+    mission_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    file_id TEXT NOT NULL UNIQUE,
+    bucket TEXT NOT NULL,
+    access_key TEXT NOT NULL,
+    secret_key TEXT NOT NULL,
+    session_token TEXT NOT NULL,
+    upload_id TEXT NOT NULL,
+    part_size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (mission_id, filename)
+);
+CREATE TABLE IF NOT EXISTS parts (
+    file_id TEXT NOT NULL,
+    part_number INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    PRIMARY KEY (file_id, part_number)
+);
+"""
+
+
+class JournalEntry(NamedTuple):
+    path: Path
+    size: int
+    mtime_ns: int
+    inode: int
+    credentials: UploadCredentials
+    upload_id: str
+    part_size: int
+    created_at: float
+    parts: Dict[int, str]  # part number -> etag
+
+    def is_resumable(self, path: Path) -> bool:
+        """\
+        true if the file did not change and the credentials did not expire
+        """
+        if path.resolve() != self.path:
+            return False
+        stat = path.stat()
+        if (stat.st_size, stat.st_mtime_ns, stat.st_ino) != (self.size, self.mtime_ns, self.inode):
+            return False
+        return time() - self.created_at < CREDENTIALS_MAX_AGE
+
+
+class UploadJournal:
+    def __init__(self, db_path: Path = UPLOAD_JOURNAL_PATH) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        os.chmod(db_path, 0o600)
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def get(self, mission_id: UUID, filename: str) -> Optional[JournalEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, size, mtime_ns, inode, file_id, bucket, access_key, secret_key, "
+                "session_token, upload_id, part_size, created_at FROM uploads WHERE mission_id = ? AND filename = ?",
+                (str(mission_id), filename),
+            ).fetchone()
+            if row is None:
+                return None
+            parts = self._conn.execute("SELECT part_number, etag FROM parts WHERE file_id = ?", (row[4],)).fetchall()
+
+        path, size, mtime_ns, inode, file_id, bucket, access_key, secret_key, session_token = row[:9]
+        upload_id, part_size, created_at = row[9:]
+        credentials = UploadCredentials(
+            access_key=access_key,
+            secret_key=secret_key,
+            session_token=session_token,
+            file_id=UUID(file_id, version=4),
+            bucket=bucket,
+        )
+        return JournalEntry(
+            path=Path(path),
+            size=size,
+            mtime_ns=mtime_ns,
+            inode=inode,
+            credentials=credentials,
+            upload_id=upload_id,
+            part_size=part_size,
+            created_at=created_at,
+            parts=dict(parts),
+        )
+
+    def start(
+        self,
+        mission_id: UUID,
+        filename: str,
+        path: Path,
+        *,
+        stat: os.stat_result,
+        credentials: UploadCredentials,
+        upload_id: str,
+        part_size: int,
+    ) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(mission_id),
+                    filename,
+                    str(path.resolve()),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    stat.st_ino,
+                    str(credentials.file_id),
+                    credentials.bucket,
+                    credentials.access_key,
+                    credentials.secret_key,
+                    credentials.session_token,
+                    upload_id,
+                    part_size,
+                    time(),
+                ),
+            )
+
+    def add_part(self, file_id: UUID, part_number: int, etag: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO parts VALUES (?, ?, ?)",
+                (str(file_id), part_number, etag),
+            )
+
+    def remove(self, file_id: UUID) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM uploads WHERE file_id = ?", (str(file_id),))
+            self._conn.execute("DELETE FROM parts WHERE file_id = ?", (str(file_id),))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_UPLOAD_JOURNAL: Optional[UploadJournal] = None
+_UPLOAD_JOURNAL_DISABLED = False
+_UPLOAD_JOURNAL_LOCK = Lock()
+
+
+def get_upload_journal() -> Optional[UploadJournal]:
+    """\
+    returns the shared upload journal, `None` if it can not be opened
+    """
+    global _UPLOAD_JOURNAL, _UPLOAD_JOURNAL_DISABLED
+
+    with _UPLOAD_JOURNAL_LOCK:
+        if _UPLOAD_JOURNAL is None and not _UPLOAD_JOURNAL_DISABLED:
+            try:
+                _UPLOAD_JOURNAL = UploadJournal()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"could not open upload journal {UPLOAD_JOURNAL_PATH}, uploads can not be resumed: {e}")
+                _UPLOAD_JOURNAL_DISABLED = True
+        return _UPLOAD_JOURNAL
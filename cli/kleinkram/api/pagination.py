@@ -1,14 +1,32 @@
 from __future__ import annotations
 
+import logging
+import sqlite3
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime
 from typing import Any
+from typing import Deque
 from typing import Dict
 from typing import Generator
 from typing import List
 from typing import Mapping
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import cast
 
+import httpx
+
 from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.deser import _parse_datetime
+from kleinkram.metadata_cache import Listing
+from kleinkram.metadata_cache import get_metadata_cache
+from kleinkram.metadata_cache import metadata_scope
+
+logger = logging.getLogger(__name__)
 
 DataPage = Dict[str, Any]
 
@@ -17,6 +35,65 @@ PAGE_SIZE = 128
 SKIP = "skip"
 TAKE = "take"
 EXACT_MATCH = "exactMatch"
+# backends that page by cursor return an opaque `nextCursor` with every page
+# (`null` on the last one), it is sent back instead of `skip`
+CURSOR = "cursor"
+NEXT_CURSOR = "nextCursor"
+# once the first page tells the total count, the remaining pages are fetched
+# concurrently, at most this many requests are in flight
+MAX_CONCURRENT_PAGES = 8
+
+# cached listings are refreshed newest first, see `cached_paginated_request`
+SORT_BY = "sortBy"
+SORT_ORDER = "sortOrder"
+UPDATED_AT = "updatedAt"
+UUID = "uuid"
+
+
+def _check_response(resp: httpx.Response) -> None:
+    # explicitly handle 404 if json contains message
+    if resp.status_code == 404 and "message" in resp.json():
+        raise ValueError(resp.json()["message"])
+
+    # raise for other errors
+    resp.raise_for_status()
+
+
+def _get_page(client: AuthenticatedClient, endpoint: str, params: Mapping[str, Any]) -> Dict[str, Any]:
+    resp = client.get(endpoint, params=params)
+    _check_response(resp)
+    return cast(Dict[str, Any], resp.json())
+
+
+def _concurrent_pages(
+    client: AuthenticatedClient,
+    endpoint: str,
+    params: Mapping[str, Any],
+    skips: Sequence[int],
+    concurrency: int,
+) -> Generator[List[DataPage], None, None]:
+    """\
+    fetches the pages at `skips` concurrently, yields them in order
+    """
+    todo = iter(skips)
+    pending: Deque[Future[Dict[str, Any]]] = deque()
+
+    def submit() -> None:
+        skip = next(todo, None)
+        if skip is not None:
+            pending.append(executor.submit(_get_page, client, endpoint, {**params, SKIP: skip}))
+
+    # pending requests are cancelled when the consumer stops early
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            for _ in range(concurrency):
+                submit()
+            while pending:
+                paged_data = pending.popleft().result()
+                submit()
+                yield cast(List[DataPage], paged_data["data"])
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
 
 def paginated_request(
@@ -26,7 +103,16 @@ def paginated_request(
     max_entries: Optional[int] = None,
     page_size: int = PAGE_SIZE,
     exact_match: bool = False,
+    concurrency: int = MAX_CONCURRENT_PAGES,
 ) -> Generator[DataPage, None, None]:
+    """\
+    yields the entries of all pages in order
+
+    if the backend returns a cursor with the first page, the pages are walked
+    by cursor, every page costs the same and entries added in the meantime
+    are neither duplicated nor skipped, otherwise the remaining pages are
+    fetched by offset, `concurrency` requests at a time
+    """
     total_entries_count = 0
 
     params = dict(params or {})
@@ -37,16 +123,7 @@ def paginated_request(
         params[EXACT_MATCH] = str(exact_match).lower()  # pass string rather than bool
 
     while True:
-        resp = client.get(endpoint, params=params)
-
-        # explicitly handle 404 if json contains message
-        if resp.status_code == 404 and "message" in resp.json():
-            raise ValueError(resp.json()["message"])
-
-        # raise for other errors
-        resp.raise_for_status()
-
-        paged_data = resp.json()
+        paged_data = _get_page(client, endpoint, params)
         data_page = cast(List[DataPage], paged_data["data"])
 
         for entry in data_page:
@@ -55,11 +132,139 @@ def paginated_request(
             if max_entries is not None and max_entries <= total_entries_count:
                 return
 
+        if NEXT_CURSOR in paged_data:
+            cursor = paged_data[NEXT_CURSOR]
+            if not cursor or not data_page:
+                return
+            params.pop(SKIP, None)
+            params[CURSOR] = cursor
+            continue
+
         count = cast(int, paged_data["count"])
         skip = cast(int, paged_data["skip"])
         take = cast(int, paged_data["take"])
 
-        if count - skip - take <= 0:
+        if count - skip - take <= 0 or not data_page:
             return
 
+        if concurrency > 1:
+            break
         params[SKIP] = total_entries_count
+
+    # the server may return less than `page_size` entries per page
+    step = len(data_page)
+    params[TAKE] = step
+    end = count if max_entries is None else min(count, max_entries)
+    skips = range(total_entries_count, end, step)
+    with closing(_concurrent_pages(client, endpoint, params, skips, concurrency)) as pages:
+        for page in pages:
+            # entries were removed in the meantime
+            if not page:
+                return
+            for entry in page:
+                total_entries_count += 1
+                yield entry
+                if max_entries is not None and max_entries <= total_entries_count:
+                    return
+
+
+def _updated_at(entry: DataPage) -> datetime:
+    return _parse_datetime(entry[UPDATED_AT])
+
+
+def _changed_entries(
+    client: AuthenticatedClient, endpoint: str, params: Mapping[str, Any], first_page: Dict[str, Any], since: datetime
+) -> List[DataPage]:
+    """\
+    the entries updated at or after `since`, pages are sorted newest first
+    """
+    ret: List[DataPage] = []
+    page, skip = first_page, 0
+    while True:
+        data_page = cast(List[DataPage], page["data"])
+        for entry in data_page:
+            if _updated_at(entry) < since:
+                return ret
+            ret.append(entry)
+        skip += len(data_page)
+        if not data_page or skip >= page["count"]:
+            return ret
+        page = _get_page(client, endpoint, {**params, SKIP: skip})
+
+
+def _refresh_listing(
+    client: AuthenticatedClient, endpoint: str, params: Mapping[str, Any], listing: Optional[Listing], incremental: bool
+) -> Tuple[List[DataPage], Optional[str], bool]:
+    """\
+    returns the entries, the etag of the first page and whether all entries were fetched
+
+    the first page is requested conditionally, if nothing changed the server
+    answers with 304, otherwise only the entries updated since the last sync
+    are fetched and merged into `listing`, if the number of entries does not
+    match the count of the server (entries were deleted) everything is fetched
+    """
+    params = {**params, SORT_BY: UPDATED_AT, SORT_ORDER: "DESC"}
+    headers = {"If-None-Match": listing.etag} if listing is not None and listing.etag else {}
+    resp = client.get(endpoint, params={**params, TAKE: PAGE_SIZE, SKIP: 0}, headers=headers)
+    if resp.status_code == 304 and listing is not None:
+        return listing.entries, listing.etag, False
+    _check_response(resp)
+    first_page = cast(Dict[str, Any], resp.json())
+    etag = resp.headers.get("ETag")
+
+    if incremental and listing is not None and listing.entries:
+        since = max(_updated_at(entry) for entry in listing.entries)
+        changed = _changed_entries(client, endpoint, {**params, TAKE: PAGE_SIZE}, first_page, since)
+        merged = {entry[UUID]: entry for entry in listing.entries}
+        merged.update((entry[UUID], entry) for entry in changed)
+        if len(merged) == first_page["count"]:
+            return sorted(merged.values(), key=_updated_at, reverse=True), etag, False
+
+    return list(paginated_request(client, endpoint, params=params)), etag, True
+
+
+def cached_paginated_request(
+    client: AuthenticatedClient,
+    endpoint: str,
+    params: Optional[Mapping[str, Any]] = None,
+    max_entries: Optional[int] = None,
+    exact_match: bool = False,
+    incremental: bool = True,
+) -> Generator[DataPage, None, None]:
+    """\
+    like `paginated_request` but served from the metadata cache if it is
+    enabled, cached entries are sorted by `updatedAt`, newest first
+
+    a listing older than the ttl is refreshed, with `incremental` only the
+    entries that changed since are fetched, this needs the `updatedAt` of an
+    entry to change whenever the entry does, deleted entries are only noticed
+    if the count changes or when the listing is fetched completely again
+    after `max_age`
+    """
+    config = client.config
+    cache = get_metadata_cache(config)
+    if cache is None or config.metadata_cache is None or max_entries is not None:
+        yield from paginated_request(client, endpoint, params=params, max_entries=max_entries, exact_match=exact_match)
+        return
+
+    params = dict(params or {})
+    if exact_match:
+        params[EXACT_MATCH] = str(exact_match).lower()
+
+    scope = metadata_scope(config)
+    try:
+        listing = cache.get(scope, endpoint, params)
+    except sqlite3.Error as e:
+        logger.warning(f"metadata cache error, listing without cache: {e}")
+        yield from paginated_request(client, endpoint, params=params)
+        return
+    if listing is not None and cache.is_fresh(listing, config.metadata_cache.ttl):
+        yield from listing.entries
+        return
+
+    entries, etag, complete = _refresh_listing(client, endpoint, params, listing, incremental)
+    try:
+        cache.put(scope, endpoint, params, entries, etag, complete=complete)
+    except sqlite3.Error as e:
+        logger.warning(f"could not update metadata cache: {e}")
+    yield from entries
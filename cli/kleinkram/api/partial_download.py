@@ -0,0 +1,325 @@
+"""\
+downloads only some topics in some time window of remote mcap files
+
+the summary at the end of a file is read with range requests against the
+presigned url, then only the chunks that may hold matching messages are
+fetched and the matching messages are written to a new, indexed mcap file,
+`<name>.filtered.mcap` next to where the whole file would be downloaded to
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from time import sleep
+from typing import TYPE_CHECKING
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import httpx
+from rich.console import Console
+
+from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.file_transfer import DEFAULT_DOWNLOAD_CONNECTIONS
+from kleinkram.api.file_transfer import MAX_RETRIES
+from kleinkram.api.file_transfer import PART_SUFFIX
+from kleinkram.api.file_transfer import RETRY_BACKOFF_BASE
+from kleinkram.api.file_transfer import _DownloadUrl
+from kleinkram.api.file_transfer import _get_file_download
+from kleinkram.api.file_transfer import _is_forbidden
+from kleinkram.api.rate_limit import DOWNLOAD
+from kleinkram.api.rate_limit import RateLimiter
+from kleinkram.api.rate_limit import get_rate_limiter
+from kleinkram.api.transport import S3DownloadPool
+from kleinkram.mcap import McapError
+from kleinkram.mcap import McapWriter
+from kleinkram.mcap import TimeBound
+from kleinkram.mcap import copy_messages
+from kleinkram.mcap import read_chunk
+from kleinkram.mcap import read_summary
+from kleinkram.mcap import resolve_time
+from kleinkram.mcap import select_chunks
+from kleinkram.mcap import topic_matcher
+from kleinkram.models import File
+from kleinkram.models import FileState
+from kleinkram.utils import format_bytes
+
+if TYPE_CHECKING:
+    from kleinkram.mcap import ChunkIndex
+
+logger = logging.getLogger(__name__)
+
+FILTERED_SUFFIX = ".filtered"
+# chunks closer than this are fetched with a single request
+RANGE_MERGE_GAP = 1024 * 1024
+# merged requests are not larger than this
+MAX_RANGE_SIZE = 64 * 1024 * 1024
+
+
+class McapFilter(NamedTuple):
+    """\
+    `topics` are topic names or glob patterns, `start` and `end` are seconds
+    relative to the first message of each file or absolute datetimes
+    """
+
+    topics: Optional[Sequence[str]] = None
+    start: Optional[TimeBound] = None
+    end: Optional[TimeBound] = None
+
+
+class FilteredDownload(NamedTuple):
+    messages: int
+    fetched: int  # bytes read from the storage
+
+
+def filtered_path(path: Path) -> Path:
+    return path.with_name(f"{path.stem}{FILTERED_SUFFIX}{path.suffix}")
+
+
+class RangeReader:
+    """\
+    reads byte ranges of a presigned url, failed requests are retried
+    """
+
+    def __init__(
+        self,
+        client: httpx.Client,
+        url: _DownloadUrl,
+        size: int,
+        *,
+        limiter: Optional[RateLimiter] = None,
+    ) -> None:
+        self._client = client
+        self._url = url
+        self._size = size
+        self._limiter = limiter
+        self._lock = Lock()
+        self.fetched = 0
+
+    def read(self, offset: int, length: int) -> bytes:
+        attempt = 0
+        while True:
+            request_url = self._url.url
+            try:
+                headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+                response = self._client.get(request_url, headers=headers)
+                if response.status_code == 200 and (offset, length) != (0, self._size):
+                    raise McapError("the storage does not support range requests")
+                response.raise_for_status()
+                data = response.content
+                if len(data) != length:
+                    raise RuntimeError(f"expected {length} bytes at {offset}, got {len(data)}")
+            except McapError:
+                raise
+            except Exception as e:
+                attempt += 1
+                if attempt > MAX_RETRIES:
+                    raise RuntimeError(f"Download failed after {MAX_RETRIES} retries due to {e}") from e
+                if _is_forbidden(e) and self._url.refresh(request_url):
+                    logger.info("download url was rejected, retrying with a new url")
+                    continue
+                logger.info(f"Error: {e}, retrying range at {offset}...")
+                sleep(RETRY_BACKOFF_BASE**attempt)
+                continue
+
+            if self._limiter is not None:
+                self._limiter.consume(len(data))
+            with self._lock:
+                self.fetched += len(data)
+            return data
+
+
+class _Range(NamedTuple):
+    offset: int
+    length: int
+    chunks: List[ChunkIndex]
+
+
+def _merge_ranges(chunks: Sequence[ChunkIndex], *, gap: int = RANGE_MERGE_GAP, max_size: int = MAX_RANGE_SIZE) -> List[_Range]:
+    """\
+    groups chunks sorted by offset into requests, skipping at most `gap` bytes between chunks
+    """
+    ret: List[_Range] = []
+    for idx in chunks:
+        if ret:
+            last = ret[-1]
+            end = idx.chunk_start_offset + idx.chunk_length
+            if idx.chunk_start_offset - (last.offset + last.length) <= gap and end - last.offset <= max_size:
+                ret[-1] = _Range(last.offset, end - last.offset, last.chunks + [idx])
+                continue
+        ret.append(_Range(idx.chunk_start_offset, idx.chunk_length, [idx]))
+    return ret
+
+
+def _fetch_in_order(
+    executor: ThreadPoolExecutor, read: Callable[[int, int], bytes], ranges: Sequence[_Range], *, ahead: int
+) -> Iterator[Tuple[_Range, bytes]]:
+    """\
+    fetches `ranges` concurrently but yields them in order, at most `ahead` are held in memory
+    """
+    todo = iter(ranges)
+    pending: Deque[Tuple[_Range, Future[bytes]]] = deque()
+    for rng in islice(todo, ahead):
+        pending.append((rng, executor.submit(read, rng.offset, rng.length)))
+    while pending:
+        rng, future = pending.popleft()
+        for nxt in islice(todo, 1):
+            pending.append((nxt, executor.submit(read, nxt.offset, nxt.length)))
+        yield rng, future.result()
+
+
+def file_reader(
+    client: AuthenticatedClient,
+    file: File,
+    pool: S3DownloadPool,
+    *,
+    limiter: Optional[RateLimiter] = None,
+) -> RangeReader:
+    """\
+    reads byte ranges of a remote file, the download url is refreshed when it expires
+    """
+    url = _DownloadUrl(_get_file_download(client, file.id), lambda rejected: _get_file_download(client, file.id))
+    return RangeReader(pool.client(url.url), url, file.size, limiter=limiter)
+
+
+def download_filtered_mcap(
+    client: AuthenticatedClient,
+    *,
+    file: File,
+    path: Path,
+    mcap_filter: McapFilter,
+    overwrite: bool = False,
+    limiter: Optional[RateLimiter] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+    pool: Optional[S3DownloadPool] = None,
+) -> FilteredDownload:
+    """\
+    writes the messages of the remote mcap `file` that match `mcap_filter` to `path`,
+    up to `connections` chunk ranges are fetched at once, connections are taken from `pool`
+
+    raises `McapIndexMissing` if the file has no index, such files can only be downloaded as a whole
+    """
+    if pool is None:
+        with S3DownloadPool(max_connections=connections) as pool:
+            return download_filtered_mcap(
+                client,
+                file=file,
+                path=path,
+                mcap_filter=mcap_filter,
+                overwrite=overwrite,
+                limiter=limiter,
+                connections=connections,
+                pool=pool,
+            )
+
+    if path.exists() and not overwrite:
+        raise FileExistsError(f"file already exists: {path}")
+
+    reader = file_reader(client, file, pool, limiter=limiter)
+    summary = read_summary(reader.read, file.size)
+
+    matches = topic_matcher(mcap_filter.topics)
+    start = resolve_time(mcap_filter.start, summary.start_time)
+    end = resolve_time(mcap_filter.end, summary.start_time)
+    ranges = _merge_ranges(select_chunks(summary, matches=matches, start=start, end=end))
+
+    tmp = path.with_name(path.name + PART_SUFFIX)
+    messages = 0
+    try:
+        with open(tmp, "wb") as fp, ThreadPoolExecutor(max_workers=connections) as executor:
+            writer = McapWriter(fp, profile=summary.header.profile)
+            for rng, data in _fetch_in_order(executor, reader.read, ranges, ahead=connections):
+                for idx in rng.chunks:
+                    offset = idx.chunk_start_offset - rng.offset
+                    records = read_chunk(data[offset : offset + idx.chunk_length])  # noqa: E203
+                    messages += copy_messages(records, writer, summary, matches=matches, start=start, end=end)
+            writer.finish()
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return FilteredDownload(messages=messages, fetched=reader.fetched)
+
+
+def download_filtered_mcaps(
+    client: AuthenticatedClient,
+    files: Dict[Path, File],
+    mcap_filter: McapFilter,
+    *,
+    overwrite: bool = False,
+    create_parents: bool = False,
+    verbose: bool = False,
+    max_rate: Optional[int] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+) -> None:
+    """\
+    downloads the parts of the mcap files that match `mcap_filter`, one file
+    at a time, the parts are written next to the given paths, see `filtered_path`,
+    other files are skipped
+    """
+    console = Console(file=sys.stderr)
+    limiter = get_rate_limiter(client.config, DOWNLOAD, max_rate)
+
+    counts: Dict[str, int] = {"downloaded": 0, "skipped": 0, "failed": 0}
+    total_size = fetched = messages = 0
+    with S3DownloadPool(max_connections=connections) as pool:
+        for path, file in files.items():
+            out = filtered_path(path)
+            reason: Optional[str] = None
+            if path.suffix != ".mcap":
+                reason = "not an mcap file"
+            elif file.state != FileState.OK:
+                reason = f"file is {file.state.value}"
+            elif out.exists() and not overwrite:
+                reason = f"{out} already exists"
+            if reason is not None:
+                counts["skipped"] += 1
+                if verbose:
+                    console.print(f"skipping {file.name}, {reason}")
+                continue
+
+            if create_parents:
+                out.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                result = download_filtered_mcap(
+                    client,
+                    file=file,
+                    path=out,
+                    mcap_filter=mcap_filter,
+                    overwrite=overwrite,
+                    limiter=limiter,
+                    connections=connections,
+                    pool=pool,
+                )
+            except Exception as e:
+                counts["failed"] += 1
+                console.print(f"[red]could not download part of {file.name}: {e}[/red]")
+                continue
+
+            counts["downloaded"] += 1
+            total_size += file.size
+            fetched += result.fetched
+            messages += result.messages
+            if verbose:
+                console.print(
+                    f"{out}: {result.messages} messages, fetched {format_bytes(result.fetched)} "
+                    f"of {format_bytes(file.size)}"
+                )
+
+    share = f" ({fetched / total_size:.2%})" if total_size else ""
+    console.print(f"Fetched {format_bytes(fetched)} of {format_bytes(total_size)}{share}, {messages} messages")
+    console.print("Summary: " + ", ".join(f"{n} {what}" for what, n in counts.items()))
@@ -0,0 +1,148 @@
+"""\
+bandwidth limits for uploads and downloads
+
+all worker threads of a transfer share one token bucket per direction,
+the rate is either fixed (`--max-rate`) or follows the time of day
+schedule in the config
+"""
+
+from __future__ import annotations
+
+import logging
+from datetime import datetime
+from datetime import time
+from threading import Lock
+from time import monotonic
+from time import sleep
+from typing import Callable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+
+from kleinkram.config import Config
+from kleinkram.config import RateWindow
+from kleinkram.utils import parse_rate
+
+logger = logging.getLogger(__name__)
+
+UPLOAD = "upload"
+DOWNLOAD = "download"
+
+# the bucket holds at most this many seconds worth of bytes
+BURST_SECONDS = 0.25
+# how often the schedule is checked for a new rate
+SCHEDULE_CHECK_INTERVAL = 10.0
+
+
+class _ParsedWindow(NamedTuple):
+    start: time
+    end: time
+    rate: Optional[int]
+
+
+def _parse_time(s: str) -> time:
+    try:
+        return datetime.strptime(s.strip(), "%H:%M").time()
+    except ValueError:
+        raise ValueError(f"invalid time of day {s!r}, expected HH:MM")
+
+
+def _parse_schedule(schedule: Sequence[RateWindow], direction: str) -> List[_ParsedWindow]:
+    ret = []
+    for window in schedule:
+        rate = getattr(window, direction)
+        parsed_rate = parse_rate(rate) if rate is not None else None
+        if parsed_rate == 0:
+            raise ValueError(f"invalid rate {rate!r}, rates must be positive")
+        ret.append(_ParsedWindow(start=_parse_time(window.start), end=_parse_time(window.end), rate=parsed_rate))
+    return ret
+
+
+def _in_window(window: _ParsedWindow, now: time) -> bool:
+    if window.start <= window.end:
+        return window.start <= now < window.end
+    # wraps around midnight
+    return now >= window.start or now < window.end
+
+
+class RateLimiter:
+    """\
+    a token bucket that blocks `consume` until the bytes may be sent
+
+    tokens are taken right away and the caller sleeps until the bucket is
+    back in credit, so concurrent callers share the rate fairly,
+    `max_rate` takes precedence over the `schedule`, the first window of
+    the schedule containing the current time of day applies
+    """
+
+    def __init__(
+        self,
+        max_rate: Optional[int] = None,
+        *,
+        schedule: Sequence[RateWindow] = (),
+        direction: str = UPLOAD,
+        clock: Callable[[], float] = monotonic,
+        time_of_day: Callable[[], time] = lambda: datetime.now().time(),
+        sleep: Callable[[float], None] = sleep,
+    ) -> None:
+        self._max_rate = max_rate
+        self._schedule = _parse_schedule(schedule, direction)
+        self._clock = clock
+        self._time_of_day = time_of_day
+        self._sleep = sleep
+
+        self._lock = Lock()
+        self._rate: Optional[int] = None
+        self._rate_checked_at: Optional[float] = None
+        self._tokens = 0.0
+        self._last = clock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_rate is not None or bool(self._schedule)
+
+    def rate(self) -> Optional[int]:
+        """\
+        the current rate in bytes per second, `None` if unlimited
+        """
+        if self._max_rate is not None:
+            return self._max_rate
+        now = self._time_of_day()
+        for window in self._schedule:
+            if _in_window(window, now):
+                return window.rate
+        return None
+
+    def _current_rate(self, now: float) -> Optional[int]:
+        # requires `self._lock`
+        if self._rate_checked_at is None or now - self._rate_checked_at >= SCHEDULE_CHECK_INTERVAL:
+            rate = self.rate()
+            if rate != self._rate and self._rate_checked_at is not None:
+                logger.info(f"bandwidth limit changed to {rate} B/s")
+            self._rate, self._rate_checked_at = rate, now
+        return self._rate
+
+    def consume(self, nbytes: int) -> None:
+        if nbytes <= 0 or not self.enabled:
+            return
+
+        with self._lock:
+            now = self._clock()
+            rate = self._current_rate(now)
+            if rate is None:
+                self._last = now
+                return
+
+            burst = rate * BURST_SECONDS
+            self._tokens = min(burst, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            self._sleep(wait)
+
+
+def get_rate_limiter(config: Config, direction: str, max_rate: Optional[int] = None) -> RateLimiter:
+    return RateLimiter(max_rate, schedule=config.rate_schedule, direction=direction)
@@ -29,6 +29,7 @@ from kleinkram.api.deser import _parse_file
 from kleinkram.api.deser import _parse_mission
 from kleinkram.api.deser import _parse_project
 from kleinkram.api.deser import _parse_run
+from kleinkram.api.pagination import cached_paginated_request
 from kleinkram.api.pagination import paginated_request
 from kleinkram.api.query import FileQuery
 from kleinkram.api.query import MissionQuery
@@ -149,9 +150,17 @@ def get_files(
     client: AuthenticatedClient,
     file_query: FileQuery,
     max_entries: Optional[int] = None,
+    cached: bool = True,
 ) -> Generator[File, None, None]:
+    """\
+    `cached=False` lists the files from the server even if the metadata cache is enabled,
+    a cached listing may still hold files that were deleted since
+    """
     params = _file_query_to_params(file_query)
-    response_stream = paginated_request(client, FILE_ENDPOINT, params=params, max_entries=max_entries)
+    if cached:
+        response_stream = cached_paginated_request(client, FILE_ENDPOINT, params=params, max_entries=max_entries)
+    else:
+        response_stream = paginated_request(client, FILE_ENDPOINT, params=params, max_entries=max_entries)
     yield from map(lambda f: _parse_file(FileObject(f)), response_stream)
 
 
@@ -161,7 +170,10 @@ def get_missions(
     max_entries: Optional[int] = None,
 ) -> Generator[Mission, None, None]:
     params = _mission_query_to_params(mission_query)
-    response_stream = paginated_request(client, MISSION_ENDPOINT, params=params, max_entries=max_entries)
+    # the file count and size of a mission change without its `updatedAt`
+    response_stream = cached_paginated_request(
+        client, MISSION_ENDPOINT, params=params, max_entries=max_entries, incremental=False
+    )
     yield from map(lambda m: _parse_mission(MissionObject(m)), response_stream)
 
 
@@ -172,7 +184,7 @@ def get_projects(
     exact_match: bool = False,
 ) -> Generator[Project, None, None]:
     params = _project_query_to_params(project_query)
-    response_stream = paginated_request(
+    response_stream = cached_paginated_request(
         client,
         PROJECT_ENDPOINT,
         params=params,
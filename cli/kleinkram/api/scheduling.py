@@ -0,0 +1,58 @@
+"""\
+decides in which order the files of a transfer are started
+
+the workers take files from a fifo queue, if a huge file happens to be last
+it runs alone long after all other workers went idle, starting the
+largest files first keeps all workers busy until the end
+"""
+
+from __future__ import annotations
+
+from enum import Enum
+from typing import Callable
+from typing import List
+from typing import Sequence
+from typing import TypeVar
+from typing import Union
+
+T = TypeVar("T")
+
+
+class TransferSchedule(str, Enum):
+    LARGEST_FIRST = "largest-first"  # shortest total time
+    MIXED = "mixed"  # largest first, every other file is a small one
+    IN_ORDER = "in-order"  # the order the files were given in
+
+
+DEFAULT_SCHEDULE = TransferSchedule.LARGEST_FIRST
+
+
+def schedule_transfers(
+    items: Sequence[T],
+    size: Callable[[T], int],
+    policy: Union[TransferSchedule, str] = DEFAULT_SCHEDULE,
+) -> List[T]:
+    """\
+    orders `items` according to `policy`, `size` returns the size of an item
+
+    the sort is stable, items of equal size keep their order,
+    `mixed` alternates between the largest and the smallest remaining item
+    so files keep completing while the large ones are transferred
+    """
+    policy = TransferSchedule(policy)
+    if policy == TransferSchedule.IN_ORDER:
+        return list(items)
+
+    by_size = sorted(items, key=size, reverse=True)
+    if policy == TransferSchedule.LARGEST_FIRST:
+        return by_size
+
+    ret: List[T] = []
+    large, small = 0, len(by_size) - 1
+    while large <= small:
+        ret.append(by_size[large])
+        large += 1
+        if large <= small:
+            ret.append(by_size[small])
+            small -= 1
+    return ret
@@ -0,0 +1,263 @@
+"""\
+this file contains long lived transports that are shared by all
+transfer workers of a session, the API client lives in `client.py`
+"""
+
+from __future__ import annotations
+
+import logging
+from contextlib import contextmanager
+from io import BytesIO
+from threading import Lock
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import NamedTuple
+from typing import Optional
+from typing import Protocol
+from typing import Sequence
+from typing import Tuple
+from uuid import UUID
+
+import boto3.s3.transfer
+import boto3.session
+import botocore.config
+import botocore.credentials
+import httpx
+from s3transfer.utils import ReadFileChunk
+from s3transfer.utils import signal_not_transferring
+from s3transfer.utils import signal_transferring
+
+logger = logging.getLogger(__name__)
+
+S3_MAX_RETRIES = 60  # same as frontend
+S3_READ_TIMEOUT = 60 * 5  # 5 minutes
+S3_MAX_POOL_CONNECTIONS = 10  # botocore default
+# idle download connections are kept open this long, presigned urls
+# of one session mostly point to the same host
+S3_KEEPALIVE_EXPIRY = 60.0  # seconds
+
+# the shared client is never used with these, every request
+# is signed with the credentials registered for its object key
+PLACEHOLDER_ACCESS_KEY = "kleinkram"
+PLACEHOLDER_SECRET_KEY = "kleinkram"
+
+OBJECT_KEY_CONTEXT = "kleinkram_object_key"
+
+
+class ReadableFile(Protocol):
+    """\
+    what s3transfer needs from a file object to upload it
+    """
+
+    def read(self, size: int = -1) -> bytes: ...
+
+    def seek(self, offset: int, whence: int = 0) -> int: ...
+
+    def tell(self) -> int: ...
+
+
+class UploadCredentials(NamedTuple):
+    access_key: str
+    secret_key: str
+    session_token: str
+    file_id: UUID
+    bucket: str
+
+
+class S3DownloadPool:
+    """\
+    one pooled http client per storage host for downloads
+
+    presigned download urls need no credentials, sharing the clients between
+    all download workers saves a connection and tls handshake per file
+    and per retry, the pool is separate from the API client on purpose
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = S3_MAX_POOL_CONNECTIONS,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: float = S3_KEEPALIVE_EXPIRY,
+        timeout: float = S3_READ_TIMEOUT,
+    ) -> None:
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections if max_keepalive_connections is None else max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._timeout = timeout
+        self._clients: Dict[Tuple[str, str, Optional[int]], httpx.Client] = {}
+        self._lock = Lock()
+
+    def client(self, url: str) -> httpx.Client:
+        """\
+        the client for the host of `url`
+        """
+        parsed = httpx.URL(url)
+        key = (parsed.scheme, parsed.host, parsed.port)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = httpx.Client(timeout=self._timeout, limits=self._limits)
+                self._clients[key] = client
+        return client
+
+    def close(self) -> None:
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+    def __enter__(self) -> S3DownloadPool:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+class S3Transport:
+    """\
+    a single s3 client (and thus connection pool) per endpoint
+
+    the backend hands out temporary credentials per file, instead of
+    building a new client for every file we register the credentials
+    for the object key and sign each request with the matching ones
+    """
+
+    def __init__(self, endpoint: str, *, max_pool_connections: int = S3_MAX_POOL_CONNECTIONS) -> None:
+        self.endpoint = endpoint
+
+        self._credentials: Dict[str, botocore.credentials.Credentials] = {}
+        self._lock = Lock()
+
+        config = botocore.config.Config(
+            retries={"max_attempts": S3_MAX_RETRIES},
+            read_timeout=S3_READ_TIMEOUT,
+            max_pool_connections=max_pool_connections,
+        )
+        self.client = boto3.session.Session().client(
+            "s3",
+            endpoint_url=endpoint,
+            aws_access_key_id=PLACEHOLDER_ACCESS_KEY,
+            aws_secret_access_key=PLACEHOLDER_SECRET_KEY,
+            config=config,
+        )
+        self.client.meta.events.register("provide-client-params.s3.*", self._remember_object_key)
+        self.client.meta.events.register("before-sign.s3.*", self._inject_credentials)
+        # enables the callbacks of request bodies once they are sent, s3transfer
+        # registers the same handlers for its uploads (hence the same ids)
+        self.client.meta.events.register_first(
+            "request-created.s3", signal_not_transferring, unique_id="s3upload-not-transferring"
+        )
+        self.client.meta.events.register_last("request-created.s3", signal_transferring, unique_id="s3upload-transferring")
+
+    def _remember_object_key(self, params: Dict[str, Any], context: Dict[str, Any], **kwargs: Any) -> None:
+        _ = kwargs
+        if "Key" in params:
+            context[OBJECT_KEY_CONTEXT] = params["Key"]
+
+    def _inject_credentials(self, request: Any, **kwargs: Any) -> None:
+        _ = kwargs
+        key = request.context.get(OBJECT_KEY_CONTEXT)
+        with self._lock:
+            credentials = self._credentials.get(key)
+        if credentials is None:
+            raise RuntimeError(f"no upload credentials registered for object: {key}")
+        request.context.setdefault("signing", {})["request_credentials"] = credentials
+
+    def register(self, credentials: UploadCredentials) -> None:
+        with self._lock:
+            self._credentials[str(credentials.file_id)] = botocore.credentials.Credentials(
+                credentials.access_key,
+                credentials.secret_key,
+                credentials.session_token,
+            )
+
+    def unregister(self, credentials: UploadCredentials) -> None:
+        with self._lock:
+            self._credentials.pop(str(credentials.file_id), None)
+
+    @contextmanager
+    def registered(self, credentials: UploadCredentials) -> Iterator[None]:
+        self.register(credentials)
+        try:
+            yield
+        finally:
+            self.unregister(credentials)
+
+    def upload_fileobj(
+        self,
+        fileobj: ReadableFile,
+        *,
+        credentials: UploadCredentials,
+        callback: Optional[Callable[[int], Any]] = None,
+        config: Optional[boto3.s3.transfer.TransferConfig] = None,
+    ) -> None:
+        with self.registered(credentials):
+            self.client.upload_fileobj(
+                fileobj,
+                credentials.bucket,
+                str(credentials.file_id),
+                Callback=callback,
+                Config=config,
+            )
+
+    # the multipart calls below expect the credentials to be registered
+
+    def create_multipart_upload(self, credentials: UploadCredentials) -> str:
+        resp = self.client.create_multipart_upload(Bucket=credentials.bucket, Key=str(credentials.file_id))
+        return str(resp["UploadId"])
+
+    def upload_part(
+        self,
+        credentials: UploadCredentials,
+        upload_id: str,
+        part_number: int,
+        body: bytes,
+        *,
+        callbacks: Sequence[Callable[[int], Any]] = (),
+    ) -> str:
+        """\
+        `callbacks` are called with the number of bytes as they are sent
+        """
+        # like s3transfer we only report bytes that are sent, not bytes read for checksums
+        reader = ReadFileChunk(BytesIO(body), len(body), len(body), callbacks=list(callbacks), enable_callbacks=False)
+        resp = self.client.upload_part(
+            Bucket=credentials.bucket,
+            Key=str(credentials.file_id),
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=reader,
+        )
+        return str(resp["ETag"])
+
+    def list_parts(self, credentials: UploadCredentials, upload_id: str) -> Dict[int, str]:
+        """\
+        returns the etags of the parts s3 already has by part number
+        """
+        parts: Dict[int, str] = {}
+        paginator = self.client.get_paginator("list_parts")
+        for page in paginator.paginate(Bucket=credentials.bucket, Key=str(credentials.file_id), UploadId=upload_id):
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"]
+        return parts
+
+    def complete_multipart_upload(self, credentials: UploadCredentials, upload_id: str, parts: Dict[int, str]) -> None:
+        self.client.complete_multipart_upload(
+            Bucket=credentials.bucket,
+            Key=str(credentials.file_id),
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]} for n in sorted(parts)]},
+        )
+
+    def close(self) -> None:
+        self.client.close()
+
+    def __enter__(self) -> S3Transport:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
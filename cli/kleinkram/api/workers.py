@@ -0,0 +1,180 @@
+"""\
+controls how many files are transferred at the same time
+"""
+
+from __future__ import annotations
+
+import logging
+from contextlib import contextmanager
+from threading import Condition
+from time import monotonic
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+from typing import TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MIN_WORKERS = 1
+MAX_WORKERS = 32
+DEFAULT_WORKERS = 2
+
+# seconds of transfer the throughput is measured over before adapting
+ADJUST_INTERVAL = 5.0
+# keep adding workers while the throughput improves by at least this much
+MIN_IMPROVEMENT = 0.1
+# remove a worker if the throughput falls this much below the best so far
+MAX_DECLINE = 0.25
+
+
+class AdaptiveWorkers:
+    """\
+    limits the number of concurrent transfers and adapts the limit to the throughput
+
+    starts with `initial` workers and adds workers as long as the aggregate
+    throughput keeps improving, then settles on the best limit seen,
+    halves the limit on errors and removes workers if the throughput falls,
+    with `min_workers == max_workers` the limit is fixed
+
+    transfers run in `slot()` and report the bytes they moved to `record`
+    """
+
+    def __init__(
+        self,
+        initial: int = DEFAULT_WORKERS,
+        *,
+        min_workers: int = MIN_WORKERS,
+        max_workers: int = MAX_WORKERS,
+        interval: float = ADJUST_INTERVAL,
+        clock: Callable[[], float] = monotonic,
+    ) -> None:
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self._interval = interval
+        self._clock = clock
+        self._cond = Condition()
+
+        self._limit = min(max(initial, min_workers), max_workers)
+        self._active = 0
+        self._ramping = self._limit < max_workers
+
+        self._best_limit = self._limit
+        self._best_throughput = 0.0
+        self._last_throughput: Optional[float] = None
+        self._errors = 0
+
+        self._window_start = clock()
+        self._window_bytes = 0
+        self._window_saturated = False
+
+    @classmethod
+    def fixed(cls, n_workers: int) -> AdaptiveWorkers:
+        return cls(n_workers, min_workers=n_workers, max_workers=n_workers)
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def best(self) -> int:
+        """\
+        the limit with the highest measured throughput so far
+        """
+        return self._best_limit
+
+    @property
+    def errors(self) -> int:
+        """\
+        the number of failed transfers, the limit they forced says nothing about the throughput
+        """
+        return self._errors
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._cond:
+            while self._active >= self._limit:
+                self._window_saturated = True
+                self._cond.wait()
+            self._active += 1
+            if self._active >= self._limit:
+                self._window_saturated = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """\
+        runs `fn` in a slot, exceptions count as errors
+        """
+        with self.slot():
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                self.record_error()
+                raise
+
+    def record(self, nbytes: int) -> None:
+        with self._cond:
+            self._window_bytes += nbytes
+            now = self._clock()
+            if now - self._window_start >= self._interval:
+                self._adjust(now)
+
+    def record_error(self) -> None:
+        with self._cond:
+            limit = max(self.min_workers, self._limit // 2)
+            if limit != self._limit:
+                logger.info(f"transfer failed, reducing workers from {self._limit} to {limit}")
+            self._errors += 1
+            self._ramping = False
+            self._last_throughput = None
+            self._set_limit(limit)
+            self._reset_window(self._clock())
+
+    def _set_limit(self, limit: int) -> None:
+        # requires `self._cond`
+        self._limit = limit
+        self._cond.notify_all()
+
+    def _reset_window(self, now: float) -> None:
+        # requires `self._cond`
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_saturated = self._active >= self._limit
+
+    def _adjust(self, now: float) -> None:
+        # requires `self._cond`
+        throughput = self._window_bytes / (now - self._window_start)
+        saturated = self._window_saturated
+        self._reset_window(now)
+
+        # with less transfers than workers (e.g. at the end) the measurement says nothing
+        if not saturated:
+            return
+
+        last, self._last_throughput = self._last_throughput, throughput
+        if self._ramping:
+            if last is None or throughput >= last * (1 + MIN_IMPROVEMENT):
+                self._best_limit, self._best_throughput = self._limit, throughput
+                limit = min(self.max_workers, self._limit + max(1, self._limit // 2))
+                self._ramping = limit < self.max_workers
+            else:
+                self._ramping = False
+                limit = self._best_limit
+        elif throughput < self._best_throughput * (1 - MAX_DECLINE):
+            limit = max(self.min_workers, self._limit - 1)
+            # compare against the new conditions from now on
+            self._best_limit, self._best_throughput = limit, throughput
+        else:
+            self._best_throughput = max(self._best_throughput, throughput)
+            return
+
+        if limit != self._limit:
+            logger.info(f"adjusting workers from {self._limit} to {limit} at {throughput / 1e6:.1f} MB/s")
+        self._set_limit(limit)
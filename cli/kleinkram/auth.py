@@ -12,6 +12,7 @@ from kleinkram.config import CONFIG_PATH
 from kleinkram.config import Credentials
 from kleinkram.config import get_config
 from kleinkram.config import save_config
+from kleinkram.metadata_cache import prune_metadata_cache
 
 DEFAULT_CALLBACK_PORT = 8000
 CLI_CALLBACK_ENDPOINT = "/cli/callback"
@@ -201,6 +202,18 @@ def login_flow(
     key: Optional[str] = None,
     headless: bool = False,
     user: Optional[str] = None,
+) -> None:
+    _login(oAuthProvider=oAuthProvider, key=key, headless=headless, user=user)
+    # listings cached for another user are of no use anymore
+    prune_metadata_cache(get_config())
+
+
+def _login(
+    *,
+    oAuthProvider: str,
+    key: Optional[str] = None,
+    headless: bool = False,
+    user: Optional[str] = None,
 ) -> None:
     config = get_config()
     # use cli key login
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+from datetime import datetime
 from pathlib import Path
 from typing import List
 from typing import Optional
@@ -9,10 +10,16 @@ import typer
 
 import kleinkram.core
 from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.file_transfer import DEFAULT_DOWNLOAD_CONNECTIONS
+from kleinkram.api.partial_download import McapFilter
 from kleinkram.api.query import FileQuery
 from kleinkram.api.query import MissionQuery
 from kleinkram.api.query import ProjectQuery
+from kleinkram.api.scheduling import DEFAULT_SCHEDULE
+from kleinkram.api.scheduling import TransferSchedule
+from kleinkram.cli.options import parse_rate_option
 from kleinkram.config import get_shared_state
+from kleinkram.mcap import TimeBound
 from kleinkram.utils import split_args
 
 logger = logging.getLogger(__name__)
@@ -22,6 +29,21 @@ Download files from kleinkram.
 """
 
 
+def _parse_time_option(name: str, value: Optional[str]) -> Optional[TimeBound]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise typer.BadParameter(
+            f"invalid time `{value}`, expected seconds since the first message or an iso datetime", param_hint=name
+        )
+
+
 download_typer = typer.Typer(name="download", no_args_is_help=True, invoke_without_command=True, help=HELP)
 
 
@@ -56,7 +78,57 @@ def download(
         "--create-dirs",
         help="create missing destination directories without prompting",
     ),
+    rehash: bool = typer.Option(False, "--rehash", help="ignore cached hashes of existing local files"),
+    workers: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="number of files transferred in parallel (default: adapts to the throughput)",
+    ),
+    max_rate: Optional[str] = typer.Option(
+        None,
+        help="limit the download bandwidth, e.g. 50MB/s (default: rate schedule in the config)",
+    ),
+    connections: int = typer.Option(
+        DEFAULT_DOWNLOAD_CONNECTIONS,
+        min=1,
+        help="number of connections used to download each large file",
+    ),
+    schedule: TransferSchedule = typer.Option(
+        DEFAULT_SCHEDULE,
+        case_sensitive=False,
+        help="order files are started in, largest-first finishes soonest, mixed interleaves small files",
+    ),
+    check_disk_space: bool = typer.Option(
+        True,
+        help="check that the files fit on the destination filesystem before downloading",
+    ),
+    local_store: bool = typer.Option(
+        True,
+        help="reuse files from the local store configured in ~/.kleinkram.json",
+    ),
+    topics: Optional[List[str]] = typer.Option(
+        None,
+        "--topic",
+        help="only download messages on these topics (names or patterns) of mcap files",
+    ),
+    start: Optional[str] = typer.Option(
+        None,
+        help="only download messages of mcap files from this time on, seconds since the first message or an iso datetime",
+    ),
+    end: Optional[str] = typer.Option(
+        None,
+        help="only download messages of mcap files up to this time, seconds since the first message or an iso datetime",
+    ),
 ) -> None:
+    parsed_max_rate = parse_rate_option("--max-rate", max_rate)
+    mcap_filter = None
+    if topics or start is not None or end is not None:
+        mcap_filter = McapFilter(
+            topics=topics or None,
+            start=_parse_time_option("--start", start),
+            end=_parse_time_option("--end", end),
+        )
+
     if include_corrupt_files:
         typer.secho(
             "Warning: --include-corrupt-files enables downloading files marked as CORRUPTED. "
@@ -98,4 +170,12 @@ def download(
         nested=nested,
         overwrite=overwrite,
         verbose=get_shared_state().verbose,
+        rehash=rehash,
+        n_workers=workers,
+        max_rate=parsed_max_rate,
+        connections=connections,
+        schedule=schedule,
+        check_disk_space=check_disk_space,
+        local_store=local_store,
+        mcap_filter=mcap_filter,
     )
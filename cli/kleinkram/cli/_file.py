@@ -4,6 +4,7 @@ from typing import Optional
 
 import typer
 
+import kleinkram.api.inspection
 import kleinkram.api.routes
 import kleinkram.core
 from kleinkram.api.client import AuthenticatedClient
@@ -13,21 +14,15 @@ from kleinkram.api.query import ProjectQuery
 from kleinkram.api.routes import get_file
 from kleinkram.config import get_shared_state
 from kleinkram.printing import print_file_info
+from kleinkram.printing import print_recording_info
 from kleinkram.utils import split_args
 
 INFO_HELP = "get information about a file"
+TOPICS_HELP = "list the topics of a remote mcap or ros1 bag file, only its index is downloaded"
 DELETE_HELP = "delete a file"
 
 
-file_typer = typer.Typer(no_args_is_help=True, context_settings={"help_option_names": ["-h", "--help"]})
-
-
-@file_typer.command(help=INFO_HELP)
-def info(
-    project: Optional[str] = typer.Option(None, "--project", "-p", help="project id or name"),
-    mission: Optional[str] = typer.Option(None, "--mission", "-m", help="mission id or name"),
-    file: str = typer.Option(..., "--file", "-f", help="file id or name"),
-) -> None:
+def _file_query(project: Optional[str], mission: Optional[str], file: str) -> FileQuery:
     project_ids, project_patterns = split_args([project] if project else [])
     project_query = ProjectQuery(ids=project_ids, patterns=project_patterns)
 
@@ -39,17 +34,43 @@ def info(
     )
 
     file_ids, file_patterns = split_args([file])
-    file_query = FileQuery(
+    return FileQuery(
         ids=file_ids,
         patterns=file_patterns,
         mission_query=mission_query,
     )
 
+
+file_typer = typer.Typer(no_args_is_help=True, context_settings={"help_option_names": ["-h", "--help"]})
+
+
+@file_typer.command(help=INFO_HELP)
+def info(
+    project: Optional[str] = typer.Option(None, "--project", "-p", help="project id or name"),
+    mission: Optional[str] = typer.Option(None, "--mission", "-m", help="mission id or name"),
+    file: str = typer.Option(..., "--file", "-f", help="file id or name"),
+    inspect: bool = typer.Option(False, help="read the topics from the index of mcap and ros1 bag files"),
+) -> None:
     client = AuthenticatedClient()
-    file_parsed = get_file(client, file_query)
+    file_parsed = get_file(client, _file_query(project, mission, file))
+    if inspect:
+        info = kleinkram.api.inspection.inspect_file(client, file_parsed)
+        file_parsed = kleinkram.api.inspection.with_topics(file_parsed, info)
     print_file_info(file_parsed, pprint=get_shared_state().verbose)
 
 
+@file_typer.command(help=TOPICS_HELP)
+def topics(
+    project: Optional[str] = typer.Option(None, "--project", "-p", help="project id or name"),
+    mission: Optional[str] = typer.Option(None, "--mission", "-m", help="mission id or name"),
+    file: str = typer.Option(..., "--file", "-f", help="file id or name"),
+) -> None:
+    client = AuthenticatedClient()
+    file_parsed = get_file(client, _file_query(project, mission, file))
+    info = kleinkram.api.inspection.inspect_file(client, file_parsed)
+    print_recording_info(file_parsed, info, pprint=get_shared_state().verbose)
+
+
 @file_typer.command(help=DELETE_HELP)
 def delete(
     project: Optional[str] = typer.Option(None, "--project", "-p", help="project id or name"),
@@ -60,23 +81,6 @@ def delete(
     if not confirm:
         typer.confirm(f"delete {project} {mission}", abort=True)
 
-    project_ids, project_patterns = split_args([project] if project else [])
-    project_query = ProjectQuery(ids=project_ids, patterns=project_patterns)
-
-    mission_ids, mission_patterns = split_args([mission] if mission else [])
-    mission_query = MissionQuery(
-        ids=mission_ids,
-        patterns=mission_patterns,
-        project_query=project_query,
-    )
-
-    file_ids, file_patterns = split_args([file])
-    file_query = FileQuery(
-        ids=file_ids,
-        patterns=file_patterns,
-        mission_query=mission_query,
-    )
-
     client = AuthenticatedClient()
-    file_parsed = get_file(client, file_query)
+    file_parsed = get_file(client, _file_query(project, mission, file))
     kleinkram.core.delete_files(client=client, file_ids=[file_parsed.id])
@@ -20,6 +20,7 @@ from kleinkram.models import Run
 from kleinkram.printing import print_run_info
 from kleinkram.printing import print_run_logs
 from kleinkram.printing import print_runs_table
+from kleinkram.progress import TransferProgress
 from kleinkram.utils import split_args
 
 HELP = """\
@@ -179,7 +180,7 @@ def download_artifacts(
 
             # Write to file with Progress Bar
             with open(filename, "wb") as f:
-                with typer.progressbar(length=total_length, label=f"Saving to {filename}") as progress:
+                with TransferProgress(total_length, desc=f"Saving to {filename}") as progress:
                     for chunk in r.iter_content(chunk_size=8192):
                         if chunk:
                             f.write(chunk)
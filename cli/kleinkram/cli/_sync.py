@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import List
+from typing import Optional
+
+import typer
+
+import kleinkram.core
+from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.file_transfer import DEFAULT_DOWNLOAD_CONNECTIONS
+from kleinkram.api.query import MissionQuery
+from kleinkram.api.query import ProjectQuery
+from kleinkram.cli.options import parse_rate_option
+from kleinkram.config import get_shared_state
+from kleinkram.sync_plan import SyncDirection
+from kleinkram.utils import split_args
+
+logger = logging.getLogger(__name__)
+
+HELP = """\
+Sync a local directory with missions.
+
+The directory has the layout of `klein download --nested`, i.e. project-name/mission-name/file.
+Only files that changed since the last sync are transferred, files are never deleted.
+"""
+
+
+sync_typer = typer.Typer(name="sync", no_args_is_help=True, invoke_without_command=True, help=HELP)
+
+
+@sync_typer.callback()
+def sync(
+    dest: str = typer.Argument(help="local directory to sync"),
+    projects: List[str] = typer.Option(..., "--project", "-p", help="project names, ids or patterns"),
+    missions: Optional[List[str]] = typer.Option(None, "--mission", "-m", help="mission names, ids or patterns"),
+    direction: SyncDirection = typer.Option(
+        SyncDirection.BOTH,
+        case_sensitive=False,
+        help="download remote changes, upload new local files or both",
+    ),
+    overwrite: bool = typer.Option(False, help="replace local files that differ from the remote files"),
+    full: bool = typer.Option(False, "--full", help="compare all missions, also the ones unchanged since the last sync"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="only show what would be transferred"),
+    rehash: bool = typer.Option(False, "--rehash", help="ignore cached hashes of local files"),
+    workers: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="number of files transferred in parallel (default: adapts to the throughput)",
+    ),
+    max_rate: Optional[str] = typer.Option(
+        None,
+        help="limit the bandwidth, e.g. 50MB/s (default: rate schedule in the config)",
+    ),
+    connections: int = typer.Option(
+        DEFAULT_DOWNLOAD_CONNECTIONS,
+        min=1,
+        help="number of connections used to download each large file",
+    ),
+) -> None:
+    parsed_max_rate = parse_rate_option("--max-rate", max_rate)
+
+    mission_ids, mission_patterns = split_args(missions or [])
+    project_ids, project_patterns = split_args(projects)
+    mission_query = MissionQuery(
+        patterns=mission_patterns,
+        ids=mission_ids,
+        project_query=ProjectQuery(patterns=project_patterns, ids=project_ids),
+    )
+
+    kleinkram.core.sync(
+        client=AuthenticatedClient(),
+        query=mission_query,
+        root=Path(dest),
+        direction=direction,
+        overwrite=overwrite,
+        full=full,
+        dry_run=dry_run,
+        verbose=get_shared_state().verbose,
+        rehash=rehash,
+        n_workers=workers,
+        max_rate=parsed_max_rate,
+        connections=connections,
+    )
@@ -9,10 +9,15 @@ import typer
 import kleinkram.core
 import kleinkram.utils
 from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.file_transfer import MultipartConfig
 from kleinkram.api.query import MissionQuery
 from kleinkram.api.query import ProjectQuery
+from kleinkram.api.scheduling import DEFAULT_SCHEDULE
+from kleinkram.api.scheduling import TransferSchedule
 from kleinkram.cli._file_validator import FileValidator
 from kleinkram.cli._file_validator import _report_skipped_files
+from kleinkram.cli.options import parse_rate_option
+from kleinkram.cli.options import parse_size_option
 from kleinkram.config import get_shared_state
 from kleinkram.errors import MissionNotFound
 from kleinkram.utils import load_metadata
@@ -77,6 +82,41 @@ def upload(
     ),
     experimental_datatypes: bool = typer.Option(False, help="allow experimental datatypes (yaml, svo2, db3, tum)"),
     ignore_missing_tags: bool = typer.Option(False, help="ignore mission tags"),
+    part_size: Optional[str] = typer.Option(
+        None,
+        help="multipart upload part size, e.g. 64MB (default: derived from file size)",
+    ),
+    part_concurrency: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="number of parts uploaded in parallel per file (default: derived from file size)",
+    ),
+    multipart_threshold: Optional[str] = typer.Option(
+        None,
+        help="files larger than this are uploaded in parts, e.g. 8MB",
+    ),
+    workers: Optional[int] = typer.Option(
+        None,
+        min=1,
+        help="number of files transferred in parallel (default: adapts to the throughput)",
+    ),
+    max_rate: Optional[str] = typer.Option(
+        None,
+        help="limit the upload bandwidth, e.g. 50MB/s (default: rate schedule in the config)",
+    ),
+    check_file_size: bool = typer.Option(
+        True,
+        help="compare the size of files that already exist in the mission and report mismatches",
+    ),
+    check_file_hash: bool = typer.Option(
+        False,
+        help="compare the hash of files that already exist in the mission and report mismatches",
+    ),
+    schedule: TransferSchedule = typer.Option(
+        DEFAULT_SCHEDULE,
+        case_sensitive=False,
+        help="order files are started in, largest-first finishes soonest, mixed interleaves small files",
+    ),
 ) -> None:
     original_file_paths = [Path(file) for file in files]
     mission_query = _build_mission_query(mission, project)
@@ -93,8 +133,15 @@ def upload(
 
     _handle_no_files_to_upload(original_count=len(original_file_paths), uploaded_count=len(files_to_upload))
 
+    multipart = MultipartConfig(
+        part_size=parse_size_option("--part-size", part_size),
+        concurrency=part_concurrency,
+        threshold=parse_size_option("--multipart-threshold", multipart_threshold),
+    )
+    parsed_max_rate = parse_rate_option("--max-rate", max_rate)
+
     try:
-        kleinkram.core.upload(
+        skipped = kleinkram.core.upload(
             client=AuthenticatedClient(),
             query=mission_query,
             file_paths=files_to_upload,
@@ -102,10 +149,16 @@ def upload(
             metadata=load_metadata(Path(metadata)) if metadata else None,
             ignore_missing_metadata=ignore_missing_tags,
             verbose=get_shared_state().verbose,
+            multipart=multipart,
+            n_workers=workers,
+            max_rate=parsed_max_rate,
+            check_file_size=check_file_size,
+            check_file_hash=check_file_hash,
+            schedule=schedule,
         )
         typer.echo(
             typer.style(
-                f"\nSuccessfully uploaded {len(files_to_upload)} file(s).",
+                f"\nSuccessfully uploaded {len(files_to_upload) - len(skipped)} file(s).",
                 fg=typer.colors.GREEN,
             )
         )
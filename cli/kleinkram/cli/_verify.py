@@ -63,6 +63,7 @@ def verify(
         True,
         help="check file size. If True, file names and file sizes are checked.",
     ),
+    rehash: bool = typer.Option(False, "--rehash", help="ignore cached hashes of local files"),
 ) -> None:
     # get all filepaths
     original_file_paths = [Path(file) for file in files]
@@ -95,5 +96,6 @@ def verify(
         check_file_hash=check_file_hash,
         check_file_size=check_file_size,
         verbose=verbose,
+        rehash=rehash,
     )
     print_file_verification_status(file_status, pprint=verbose)
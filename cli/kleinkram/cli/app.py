@@ -5,7 +5,6 @@ import os
 import sys
 import time
 from enum import Enum
-from pathlib import Path
 from typing import List
 from typing import Optional
 
@@ -27,11 +26,13 @@ from kleinkram.cli._list import list_typer
 from kleinkram.cli._mission import mission_typer
 from kleinkram.cli._project import project_typer
 from kleinkram.cli._run import run_typer
+from kleinkram.cli._sync import sync_typer
 from kleinkram.cli._upload import upload_typer
 from kleinkram.cli._verify import verify_typer
 from kleinkram.cli.error_handling import ErrorHandledTyper
 from kleinkram.cli.error_handling import display_error
 from kleinkram.config import MAX_TABLE_SIZE
+from kleinkram.config import STATE_DIR
 from kleinkram.config import Config
 from kleinkram.config import check_config_compatibility
 from kleinkram.config import get_config
@@ -41,14 +42,12 @@ from kleinkram.errors import InvalidCLIVersion
 from kleinkram.utils import format_traceback
 from kleinkram.utils import get_supported_api_version
 
-# slightly cursed lambdas so that linters don't complain about unreachable code
-if (lambda: os.name)() == "posix":
-    LOG_DIR = Path().home() / ".local" / "state" / "kleinkram"
-elif (lambda: os.name)() == "nt":
-    LOG_DIR = Path().home() / "AppData" / "Local" / "kleinkram"
-else:
+# slightly cursed lambda so that linters don't complain about unreachable code
+if (lambda: os.name)() not in ("posix", "nt"):
     raise OSError(f"Unsupported OS {os.name}")
 
+LOG_DIR = STATE_DIR
+
 LOG_FILE = LOG_DIR / f"{time.time_ns()}.log"
 LOG_FORMAT = "%(asctime)s | %(name)s | %(levelname)s | %(message)s"
 
@@ -108,6 +107,7 @@ app.add_typer(endpoint_typer, name="endpoint", rich_help_panel=CommandTypes.AUTH
 app.add_typer(download_typer, name="download", rich_help_panel=CommandTypes.CORE)
 app.add_typer(upload_typer, name="upload", rich_help_panel=CommandTypes.CORE)
 app.add_typer(verify_typer, name="verify", rich_help_panel=CommandTypes.CORE)
+app.add_typer(sync_typer, name="sync", rich_help_panel=CommandTypes.CORE)
 app.add_typer(list_typer, name="list", rich_help_panel=CommandTypes.CORE)
 
 app.add_typer(file_typer, name="file", rich_help_panel=CommandTypes.CRUD)
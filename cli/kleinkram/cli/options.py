@@ -0,0 +1,33 @@
+"""\
+parsers for option values shared by several commands
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+import typer
+
+from kleinkram.utils import parse_rate
+from kleinkram.utils import parse_size
+
+
+def parse_size_option(name: str, value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise typer.BadParameter(f"invalid size `{value}`, expected something like 64MB", param_hint=name)
+
+
+def parse_rate_option(name: str, value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        rate = parse_rate(value)
+    except ValueError:
+        rate = 0
+    if rate <= 0:
+        raise typer.BadParameter(f"invalid rate `{value}`, expected something like 50MB/s", param_hint=name)
+    return rate
@@ -15,9 +15,12 @@ from dataclasses import field
 from enum import Enum
 from pathlib import Path
 from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import List
 from typing import NamedTuple
 from typing import Optional
+from typing import TypeVar
 
 from rich.table import Table
 from rich.text import Text
@@ -28,9 +31,17 @@ from kleinkram.utils import format_traceback
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 CONFIG_PATH = Path().home() / ".kleinkram.json"
 MAX_TABLE_SIZE = 256
 
+# logs and local caches live here
+if os.name == "nt":
+    STATE_DIR = Path().home() / "AppData" / "Local" / "kleinkram"
+else:
+    STATE_DIR = Path().home() / ".local" / "state" / "kleinkram"
+
 
 class Environment(Enum):
     LOCAL = "local"
@@ -50,6 +61,39 @@ class Credentials(NamedTuple):
     api_key: Optional[str] = None
 
 
+class RateWindow(NamedTuple):
+    """\
+    bandwidth limits between `start` and `end` (local time, `HH:MM`),
+    rates are strings like `10MB/s`, `None` means unlimited
+    """
+
+    start: str
+    end: str
+    upload: Optional[str] = None
+    download: Optional[str] = None
+
+
+class LocalStoreConfig(NamedTuple):
+    """\
+    a directory downloaded files are kept in and reused from,
+    `max_size` is a string like `500GB`, `None` means unlimited
+    """
+
+    path: str
+    max_size: Optional[str] = None
+
+
+class MetadataCacheConfig(NamedTuple):
+    """\
+    project, mission and file listings are kept locally and reused for `ttl`
+    seconds, after that they are refreshed with the entries that changed,
+    a listing is fetched completely again after `max_age` seconds
+    """
+
+    ttl: float = 300.0
+    max_age: float = 24 * 3600.0
+
+
 DEFAULT_LOCAL_API = "http://localhost:3000"
 DEFAULT_LOCAL_S3 = "http://localhost:9000"
 
@@ -123,6 +167,14 @@ class Config:
     selected_endpoint: str = field(default_factory=lambda: _get_default_selected_endpoint().name)
     endpoints: Dict[str, Endpoint] = field(default_factory=_get_default_endpoints)
     endpoint_credentials: Dict[str, Credentials] = field(default_factory=_get_default_credentials)
+    # last good number of concurrent file transfers per endpoint
+    transfer_workers: Dict[str, int] = field(default_factory=dict)
+    # time of day bandwidth limits, `--max-rate` takes precedence
+    rate_schedule: List[RateWindow] = field(default_factory=list)
+    # downloads are reused from here across destinations if set
+    local_store: Optional[LocalStoreConfig] = None
+    # listings are cached locally if set
+    metadata_cache: Optional[MetadataCacheConfig] = None
 
     @property
     def endpoint(self) -> Endpoint:
@@ -147,15 +199,37 @@ def _config_to_dict(config: Config) -> Dict[str, Any]:
         "endpoints": {key: value._asdict() for key, value in config.endpoints.items()},
         "endpoint_credentials": {key: value._asdict() for key, value in config.endpoint_credentials.items()},
         "selected_endpoint": config.endpoint.name,
+        "transfer_workers": config.transfer_workers,
+        "rate_schedule": [window._asdict() for window in config.rate_schedule],
+        "local_store": config.local_store._asdict() if config.local_store is not None else None,
+        "metadata_cache": config.metadata_cache._asdict() if config.metadata_cache is not None else None,
     }
 
 
+def _optional_section(dct: Dict[str, Any], key: str, parse: Callable[[Any], T]) -> Optional[T]:
+    """\
+    a broken optional section is dropped instead of the whole config and the credentials in it
+    """
+    value = dct.get(key)
+    if value is None:
+        return None
+    try:
+        return parse(value)
+    except (TypeError, ValueError, KeyError, AttributeError) as e:
+        logger.warning(f"ignoring invalid `{key}` in the config: {e}")
+        return None
+
+
 def _config_from_dict(dct: Dict[str, Any]) -> Config:
     return Config(
         dct["version"],
         dct["selected_endpoint"],
         {key: Endpoint(**value) for key, value in dct["endpoints"].items()},
         {key: Credentials(**value) for key, value in dct["endpoint_credentials"].items()},
+        _optional_section(dct, "transfer_workers", lambda value: {key: int(n) for key, n in value.items()}) or {},
+        _optional_section(dct, "rate_schedule", lambda value: [RateWindow(**window) for window in value]) or [],
+        _optional_section(dct, "local_store", lambda value: LocalStoreConfig(**value)),
+        _optional_section(dct, "metadata_cache", lambda value: MetadataCacheConfig(**value)),
     )
 
 
@@ -229,6 +303,17 @@ def add_endpoint(config: Config, endpoint: Endpoint, path: Path = CONFIG_PATH) -
     save_config(config, path)
 
 
+def get_transfer_workers(config: Config) -> Optional[int]:
+    return config.transfer_workers.get(config.selected_endpoint)
+
+
+def save_transfer_workers(config: Config, workers: int, path: Path = CONFIG_PATH) -> None:
+    if get_transfer_workers(config) == workers:
+        return
+    config.transfer_workers[config.selected_endpoint] = workers
+    save_config(config, path)
+
+
 def check_config_compatibility(path: Path = CONFIG_PATH) -> bool:
     """\
     returns `False` if config file exists but is not compatible with the current version
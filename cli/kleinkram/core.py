@@ -14,12 +14,15 @@ this file contains the main functionality of kleinkram cli
 
 from __future__ import annotations
 
+import sys
+from collections import Counter
 from pathlib import Path
 from typing import Collection
 from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Sequence
+from typing import Tuple
 from uuid import UUID
 
 import httpx
@@ -27,19 +30,33 @@ from rich.console import Console
 from tqdm import tqdm
 
 import kleinkram.api.file_transfer
+import kleinkram.api.partial_download
 import kleinkram.api.routes
 import kleinkram.errors
 from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.file_transfer import DEFAULT_DOWNLOAD_CONNECTIONS
+from kleinkram.api.file_transfer import MultipartConfig
+from kleinkram.api.partial_download import McapFilter
 from kleinkram.api.query import FileQuery
 from kleinkram.api.query import MissionQuery
 from kleinkram.api.query import ProjectQuery
 from kleinkram.api.query import check_mission_query_is_creatable
+from kleinkram.api.scheduling import DEFAULT_SCHEDULE
+from kleinkram.api.scheduling import TransferSchedule
 from kleinkram.errors import InvalidFileQuery
 from kleinkram.errors import MissionNotFound
+from kleinkram.hash_cache import cached_b64_md5
+from kleinkram.models import File
 from kleinkram.models import FileState
 from kleinkram.models import FileVerificationStatus
 from kleinkram.printing import files_to_table
-from kleinkram.utils import b64_md5
+from kleinkram.sync_plan import SyncDirection
+from kleinkram.sync_plan import SyncManifest
+from kleinkram.sync_plan import SyncPlan
+from kleinkram.sync_plan import plan_sync
+from kleinkram.sync_plan import print_sync_plan
+from kleinkram.sync_plan import record_sync
+from kleinkram.sync_plan import unchanged_missions
 from kleinkram.utils import check_file_paths
 from kleinkram.utils import file_paths_from_files
 from kleinkram.utils import get_filename_map
@@ -54,11 +71,28 @@ def download(
     nested: bool = False,
     overwrite: bool = False,
     verbose: bool = False,
+    rehash: bool = False,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+    schedule: TransferSchedule = DEFAULT_SCHEDULE,
+    check_disk_space: bool = True,
+    local_store: bool = True,
+    mcap_filter: Optional[McapFilter] = None,
 ) -> None:
     """\
     downloads files, asserts that the destination dir exists
     returns the files that were downloaded
 
+    `rehash` ignores cached hashes of files that already exist locally,
+    `n_workers` files are downloaded in parallel, by default this adapts to the throughput,
+    `max_rate` limits the bandwidth in bytes per second,
+    large files are downloaded over up to `connections` connections each,
+    `schedule` decides which files are started first,
+    `check_disk_space` fails early if the files do not fit on the disk,
+    `local_store` reuses files from the local store in the config, if any,
+    with `mcap_filter` only the matching messages of mcap files are downloaded
+
     TODO: the above is a lie, at the moment we just return all files that were found
     this might include some files that were skipped or not downloaded for some reason
     we would need to modify the `download_files` function to return this in the future
@@ -80,6 +114,19 @@ def download(
         table = files_to_table(files, title="downloading files...")
         Console().print(table)
 
+    if mcap_filter is not None:
+        kleinkram.api.partial_download.download_filtered_mcaps(
+            client,
+            paths,
+            mcap_filter,
+            overwrite=overwrite,
+            create_parents=nested,
+            verbose=verbose,
+            max_rate=max_rate,
+            connections=connections,
+        )
+        return
+
     kleinkram.api.file_transfer.download_files(
         client,
         paths,
@@ -87,6 +134,13 @@ def download(
         allow_corrupt_files=allow_corrupt_files,
         overwrite=overwrite,
         create_parents=nested,
+        rehash=rehash,
+        n_workers=n_workers,
+        max_rate=max_rate,
+        connections=connections,
+        schedule=schedule,
+        check_disk_space=check_disk_space,
+        local_store=local_store,
     )
 
 
@@ -99,12 +153,29 @@ def upload(
     metadata: Optional[Dict[str, str]] = None,
     ignore_missing_metadata: bool = False,
     verbose: bool = False,
-) -> None:
+    multipart: Optional[MultipartConfig] = None,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    check_file_size: bool = True,
+    check_file_hash: bool = False,
+    schedule: TransferSchedule = DEFAULT_SCHEDULE,
+) -> Dict[Path, FileVerificationStatus]:
     """\
-    uploads files to a mission
+    uploads files to a mission, returns the files that were skipped
+    because they already exist in the mission
 
     create a mission if it does not exist if `create` is True
     in that case you can also specify `metadata` and `ignore_missing_metadata`
+
+    the files of the mission are listed once before uploading, files with the
+    same name are skipped, `check_file_size` and `check_file_hash` additionally
+    compare them to the local files to report mismatches
+
+    `multipart` tunes part size, per-file concurrency and the multipart threshold,
+    by default these are derived from the size of each file,
+    `n_workers` files are uploaded in parallel, by default this adapts to the throughput,
+    `max_rate` limits the bandwidth in bytes per second,
+    `schedule` decides which files are started first
     """
     # check that file paths are for valid files and have valid suffixes
     check_file_paths(file_paths)
@@ -135,7 +206,103 @@ def upload(
     assert mission is not None, "unreachable"
 
     filename_map = get_filename_map(file_paths)
-    kleinkram.api.file_transfer.upload_files(client, filename_map, mission.id, verbose=verbose)
+    # which files are skipped is decided on a fresh listing
+    remote_files = {
+        f.name: f
+        for f in kleinkram.api.routes.get_files(
+            client, file_query=FileQuery(mission_query=MissionQuery(ids=[mission.id])), cached=False
+        )
+    }
+    filename_map, skipped = _remote_diff(
+        filename_map,
+        remote_files,
+        check_file_size=check_file_size,
+        check_file_hash=check_file_hash,
+    )
+    _print_skipped_uploads(skipped, verbose=verbose)
+
+    if filename_map:
+        kleinkram.api.file_transfer.upload_files(
+            client,
+            filename_map,
+            mission.id,
+            verbose=verbose,
+            multipart=multipart,
+            n_workers=n_workers,
+            max_rate=max_rate,
+            schedule=schedule,
+        )
+    return skipped
+
+
+def _remote_diff(
+    filename_map: Dict[str, Path],
+    remote_files: Dict[str, File],
+    *,
+    check_file_size: bool,
+    check_file_hash: bool,
+) -> Tuple[Dict[str, Path], Dict[Path, FileVerificationStatus]]:
+    """\
+    splits local files into the ones that still need to be uploaded
+    and the ones that already exist remotely together with their status
+
+    files that are still uploading are kept, an interrupted upload is resumed
+    """
+    missing: Dict[str, Path] = {}
+    skipped: Dict[Path, FileVerificationStatus] = {}
+    for name, path in filename_map.items():
+        remote_file = remote_files.get(name)
+        if remote_file is None or remote_file.state == FileState.UPLOADING:
+            missing[name] = path
+            continue
+        skipped[path] = _file_status(
+            path,
+            remote_file,
+            check_file_size=check_file_size,
+            check_file_hash=check_file_hash,
+        )
+    return missing, skipped
+
+
+def _print_skipped_uploads(skipped: Dict[Path, FileVerificationStatus], *, verbose: bool) -> None:
+    if not skipped:
+        return
+
+    console = Console(file=sys.stderr)
+    counts = Counter(skipped.values())
+    details = ", ".join(f"{n} {status.value}" for status, n in counts.items())
+    console.print(f"Skipping {len(skipped)} file(s) that already exist in the mission ({details})")
+
+    for path, status in skipped.items():
+        if status in (FileVerificationStatus.MISMATCHED_SIZE, FileVerificationStatus.MISMATCHED_HASH):
+            console.print(f"[yellow]{path} differs from the file in the mission ({status.value}), not uploading[/yellow]")
+        elif verbose:
+            console.print(f"{path}: {status.value}")
+
+
+def _file_status(
+    path: Path,
+    remote_file: File,
+    *,
+    check_file_size: bool,
+    check_file_hash: bool,
+    rehash: bool = False,
+) -> FileVerificationStatus:
+    if remote_file.state == FileState.UPLOADING:
+        return FileVerificationStatus.UPLOADING
+    if remote_file.state != FileState.OK:
+        return FileVerificationStatus.UNKNOWN
+
+    if check_file_size and remote_file.size != path.stat().st_size:
+        return FileVerificationStatus.MISMATCHED_SIZE
+
+    if check_file_hash:
+        if remote_file.hash is None:
+            return FileVerificationStatus.COMPUTING_HASH
+        if remote_file.hash != cached_b64_md5(path, rehash=rehash):
+            return FileVerificationStatus.MISMATCHED_HASH
+
+    return FileVerificationStatus.UPLOADED
 
 
 def verify(
@@ -147,7 +314,13 @@ def verify(
     check_file_hash: bool = True,
     check_file_size: bool = False,
     verbose: bool = False,
+    rehash: bool = False,
 ) -> Dict[Path, FileVerificationStatus]:
+    """\
+    compares local files with the files of a mission
+
+    local hashes are looked up in the hash cache unless `rehash` is set
+    """
 
     # add deprecated warning for skip_hash
     if skip_hash is not None:
@@ -163,7 +336,9 @@ def verify(
     # check that the mission exists
     _ = kleinkram.api.routes.get_mission(client, query)
 
-    remote_files = {f.name: f for f in kleinkram.api.routes.get_files(client, file_query=FileQuery(mission_query=query))}
+    remote_files = {
+        f.name: f for f in kleinkram.api.routes.get_files(client, file_query=FileQuery(mission_query=query), cached=False)
+    }
     filename_map = get_filename_map(file_paths)
 
     # verify files
@@ -178,36 +353,84 @@ def verify(
             file_status[file] = FileVerificationStatus.MISSING
             continue
 
-        remote_file = remote_files[name]
-
-        if remote_file.state == FileState.UPLOADING:
-            file_status[file] = FileVerificationStatus.UPLOADING
-        elif remote_file.state == FileState.OK:
-
-            # default case, will be overwritten if we find a mismatch
-            file_status[file] = FileVerificationStatus.UPLOADED
+        file_status[file] = _file_status(
+            file,
+            remote_files[name],
+            check_file_size=check_file_size,
+            check_file_hash=check_file_hash,
+            rehash=rehash,
+        )
 
-            if check_file_size:
-                if remote_file.size == file.stat().st_size:
-                    file_status[file] = FileVerificationStatus.UPLOADED
-                else:
-                    file_status[file] = FileVerificationStatus.MISMATCHED_SIZE
+    return file_status
 
-            if file_status[file] != FileVerificationStatus.UPLOADED:
-                continue  # abort if we already found a mismatch
 
-            if check_file_hash:
-                if remote_file.hash is None:
-                    file_status[file] = FileVerificationStatus.COMPUTING_HASH
-                elif remote_file.hash == b64_md5(file):
-                    file_status[file] = FileVerificationStatus.UPLOADED
-                else:
-                    file_status[file] = FileVerificationStatus.MISMATCHED_HASH
+def sync(
+    *,
+    client: AuthenticatedClient,
+    query: MissionQuery,
+    root: Path,
+    direction: SyncDirection = SyncDirection.BOTH,
+    overwrite: bool = False,
+    full: bool = False,
+    dry_run: bool = False,
+    verbose: bool = False,
+    rehash: bool = False,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+) -> SyncPlan:
+    """\
+    syncs the missions matching `query` with `root`, which has the nested
+    layout of `download`, returns what was (or with `dry_run` would be) done
 
-        else:
-            file_status[file] = FileVerificationStatus.UNKNOWN
+    missions that did not change since their last complete sync are skipped
+    unless `full` is set, with `overwrite` local files that differ from the
+    remote files are replaced instead of being reported as conflicts,
+    the remaining arguments are passed on to the transfers
+    """
+    if not root.is_dir():
+        raise ValueError(f"Destination {root.absolute()} is not a directory")
+
+    missions = list(kleinkram.api.routes.get_missions(client, query))
+    manifest = SyncManifest.load(root)
+    unchanged = set() if full else unchanged_missions(root, missions, manifest)
+    changed = [mission for mission in missions if mission.id not in unchanged]
+
+    files: List[File] = []
+    if changed:
+        file_query = FileQuery(mission_query=MissionQuery(ids=[mission.id for mission in changed]))
+        files = list(kleinkram.api.routes.get_files(client, file_query=file_query))
+
+    plan = plan_sync(root, changed, files, manifest, direction=direction, overwrite=overwrite, rehash=rehash)
+    plan.skipped_missions = [mission for mission in missions if mission.id in unchanged]
+    print_sync_plan(plan, verbose=verbose)
+    if dry_run:
+        return plan
+
+    if plan.downloads:
+        kleinkram.api.file_transfer.download_files(
+            client,
+            plan.downloads,
+            verbose=verbose,
+            overwrite=True,
+            create_parents=True,
+            n_workers=n_workers,
+            max_rate=max_rate,
+            connections=connections,
+        )
+    for mission_id, filename_map in plan.uploads.items():
+        kleinkram.api.file_transfer.upload_files(
+            client,
+            filename_map,
+            mission_id,
+            verbose=verbose,
+            n_workers=n_workers,
+            max_rate=max_rate,
+        )
 
-    return file_status
+    record_sync(manifest, plan, changed)
+    manifest.save()
+    return plan
 
 
 def update_file(*, client: AuthenticatedClient, file_id: UUID) -> None:
@@ -66,3 +66,6 @@ class UpdateCLIVersion(Exception):
 
 
 class RunNotFound(Exception): ...
+
+
+class InsufficientDiskSpace(Exception): ...
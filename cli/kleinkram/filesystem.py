@@ -0,0 +1,441 @@
+"""\
+an fsspec filesystem for kleinkram files, `kleinkram://<project>/<mission>/<file>`
+
+files are not downloaded, reads are served with range requests against the
+presigned download url of the file, fetched blocks are kept in a least
+recently used cache in memory or on disk, a read that misses the cache also
+fetches the blocks after it (read ahead), so tools like `mcap`, `rosbags` or
+`pyarrow` can seek around a remote file and only download what they read
+
+requires `pip install kleinkram[fsspec]`, the filesystem is registered with
+fsspec on install:
+
+    with fsspec.open("kleinkram://project/mission/run.mcap", block_size=4 * 2**20) as f:
+        ...
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import kleinkram.api.routes
+from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.partial_download import RangeReader
+from kleinkram.api.partial_download import file_reader
+from kleinkram.api.query import FileQuery
+from kleinkram.api.query import MissionQuery
+from kleinkram.api.query import ProjectQuery
+from kleinkram.api.transport import S3DownloadPool
+from kleinkram.errors import FileNotFound
+from kleinkram.errors import MissionNotFound
+from kleinkram.errors import ProjectNotFound
+from kleinkram.models import File
+from kleinkram.types import PathLike
+from kleinkram.utils import parse_size
+
+try:
+    from fsspec.spec import AbstractBufferedFile  # type: ignore[import-untyped]
+    from fsspec.spec import AbstractFileSystem  # type: ignore[import-untyped]
+except ImportError as e:
+    raise ImportError("the kleinkram filesystem requires `pip install kleinkram[fsspec]`") from e
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL = "kleinkram"
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# a read that misses the cache fetches this many bytes after it too
+DEFAULT_READ_AHEAD = 4 * 1024 * 1024
+DEFAULT_MEMORY_CACHE_SIZE = 256 * 1024 * 1024
+DEFAULT_DISK_CACHE_SIZE = 10 * 1024**3
+
+TMP_SUFFIX = ".tmp"
+
+Size = Union[int, str]
+
+
+def _size(size: Size) -> int:
+    return parse_size(size) if isinstance(size, str) else size
+
+
+def _version(file: File) -> str:
+    """\
+    changes when the content of a file does, the hash is missing until the backend computed it
+    """
+    if file.hash is not None:
+        return file.hash
+    return f"{file.id}:{file.updated_at.isoformat()}"
+
+
+def _cache_key(file: File) -> str:
+    # the version changes when a file is replaced, cached blocks of the old content are never used
+    return hashlib.md5(f"{file.id}/{_version(file)}".encode()).hexdigest()
+
+
+class BlockCache:
+    """\
+    the least recently used blocks of remote files, keyed by file and block
+    index, kept in memory or, with `directory`, on disk
+
+    `max_size` caps the total size of the cached blocks in bytes, blocks on
+    disk survive the process, several processes may share a directory but
+    each one only evicts the blocks it knows of
+    """
+
+    def __init__(self, max_size: int, *, directory: Optional[Path] = None) -> None:
+        self.max_size = max_size
+        self.directory = directory
+        self.size = 0
+        self._lock = Lock()
+        # block sizes on disk, blocks themselves in memory
+        self._blocks: OrderedDict[Tuple[str, int], Union[int, bytes]] = OrderedDict()
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._load()
+
+    def _path(self, key: str, index: int) -> Path:
+        assert self.directory is not None
+        return self.directory / key / str(index)
+
+    def _load(self) -> None:
+        assert self.directory is not None
+        found = []
+        for path in self.directory.glob("*/*"):
+            if path.name.endswith(TMP_SUFFIX) or not path.name.isdigit():
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            found.append((stat.st_mtime_ns, path.parent.name, int(path.name), stat.st_size))
+        for _, key, index, size in sorted(found):
+            self._blocks[(key, index)] = size
+            self.size += size
+        self._evict()
+
+    def _evict(self) -> None:
+        # requires `self._lock`
+        while self.size > self.max_size and self._blocks:
+            (key, index), block = self._blocks.popitem(last=False)
+            self.size -= block if isinstance(block, int) else len(block)
+            if self.directory is not None:
+                self._path(key, index).unlink(missing_ok=True)
+
+    def get(self, key: str, index: int) -> Optional[bytes]:
+        with self._lock:
+            block = self._blocks.get((key, index))
+            if block is None:
+                return None
+            self._blocks.move_to_end((key, index))
+            if isinstance(block, bytes):
+                return block
+            path = self._path(key, index)
+            try:
+                data = path.read_bytes()
+                os.utime(path)
+            except FileNotFoundError:
+                # evicted by another process
+                del self._blocks[(key, index)]
+                self.size -= block
+                return None
+            return data
+
+    def put(self, key: str, index: int, data: bytes) -> None:
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            previous = self._blocks.pop((key, index), None)
+            if previous is not None:
+                self.size -= previous if isinstance(previous, int) else len(previous)
+            if self.directory is None:
+                self._blocks[(key, index)] = data
+            else:
+                path = self._path(key, index)
+                path.parent.mkdir(exist_ok=True)
+                tmp = path.with_name(f"{path.name}.{os.getpid()}{TMP_SUFFIX}")
+                tmp.write_bytes(data)
+                os.replace(tmp, path)
+                self._blocks[(key, index)] = len(data)
+            self.size += len(data)
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            if self.directory is not None:
+                for key, index in self._blocks:
+                    self._path(key, index).unlink(missing_ok=True)
+            self._blocks.clear()
+            self.size = 0
+
+
+class KleinkramFile(AbstractBufferedFile):
+    """\
+    a remote file opened for reading, reads are served from the block cache
+    and missing blocks are fetched with a range request per run of blocks
+    """
+
+    def __init__(
+        self,
+        fs: KleinkramFileSystem,
+        path: str,
+        *,
+        file: File,
+        reader: RangeReader,
+        cache: BlockCache,
+        block_size: int,
+        read_ahead: int,
+        **kwargs: Any,
+    ) -> None:
+        self.file = file
+        self._reader = reader
+        self._cache = cache
+        # blocks of different sizes must not mix
+        self._key = f"{_cache_key(file)}-{block_size}"
+        self._read_ahead = read_ahead
+        # our block cache replaces the caches of fsspec
+        super().__init__(fs, path, mode="rb", block_size=block_size, cache_type="none", size=file.size, **kwargs)
+
+    @property
+    def fetched(self) -> int:
+        """\
+        bytes read from the storage
+        """
+        return self._reader.fetched
+
+    def _fetch_range(self, start: int, end: int) -> bytes:
+        end = min(end, self.size)
+        if start >= end:
+            return b""
+        block_size = self.blocksize
+        first, last = start // block_size, (end - 1) // block_size
+
+        blocks: Dict[int, bytes] = {}
+        missing: List[int] = []
+        for index in range(first, last + 1):
+            block = self._cache.get(self._key, index)
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+
+        if missing:
+            # read ahead up to the next cached block
+            last_block = (self.size - 1) // block_size
+            for index in range(last + 1, min(last + self._read_ahead // block_size, last_block) + 1):
+                if self._cache.get(self._key, index) is not None:
+                    break
+                missing.append(index)
+            blocks.update(self._fetch_blocks(missing))
+
+        data = b"".join(blocks[index] for index in range(first, last + 1))
+        offset = start - first * block_size
+        length = end - start
+        return data[offset : offset + length]  # noqa: E203
+
+    def _fetch_blocks(self, indices: List[int]) -> Dict[int, bytes]:
+        """\
+        fetches the blocks with a request per run of consecutive blocks and caches them
+        """
+        block_size = self.blocksize
+        runs: List[List[int]] = []
+        for index in indices:
+            if runs and runs[-1][-1] + 1 == index:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+
+        ret = {}
+        for run in runs:
+            offset = run[0] * block_size
+            data = self._reader.read(offset, min((run[-1] + 1) * block_size, self.size) - offset)
+            for i, index in enumerate(run):
+                block_start = i * block_size
+                block = data[block_start : block_start + block_size]  # noqa: E203
+                self._cache.put(self._key, index, block)
+                ret[index] = block
+        return ret
+
+
+def _split(path: str) -> List[str]:
+    return [part for part in path.split("/") if part]
+
+
+def _directory_info(name: str, **kwargs: Any) -> Dict[str, Any]:
+    return {"name": name, "size": 0, "type": "directory", **kwargs}
+
+
+def _file_info(file: File) -> Dict[str, Any]:
+    return {
+        "name": f"{file.project_name}/{file.mission_name}/{file.name}",
+        "size": file.size,
+        "type": "file",
+        "id": str(file.id),
+        "hash": file.hash,
+        "created": file.created_at,
+        "mtime": file.updated_at,
+        "state": file.state.value,
+    }
+
+
+class KleinkramFileSystem(AbstractFileSystem):
+    """\
+    projects and missions are directories, files are read only
+
+    blocks are cached in memory, or on disk in `cache_dir`, up to `cache_size`
+    bytes (e.g. `2GB`), a read that misses the cache fetches `read_ahead` bytes
+    after it too
+    """
+
+    protocol = PROTOCOL
+    root_marker = ""
+
+    def __init__(
+        self,
+        *,
+        block_size: Size = DEFAULT_BLOCK_SIZE,
+        read_ahead: Size = DEFAULT_READ_AHEAD,
+        cache_dir: Optional[PathLike] = None,
+        cache_size: Optional[Size] = None,
+        client: Optional[AuthenticatedClient] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.block_size = _size(block_size)
+        self.read_ahead = _size(read_ahead)
+        if self.block_size <= 0 or self.read_ahead < 0:
+            raise ValueError("block_size must be positive and read_ahead not negative")
+        directory = Path(cache_dir).expanduser() if cache_dir is not None else None
+        if cache_size is None:
+            cache_size = DEFAULT_MEMORY_CACHE_SIZE if directory is None else DEFAULT_DISK_CACHE_SIZE
+        self.cache = BlockCache(_size(cache_size), directory=directory)
+        self._client = client
+        self._pool = S3DownloadPool()
+        self._files: Dict[str, File] = {}
+
+    @property
+    def client(self) -> AuthenticatedClient:
+        if self._client is None:
+            self._client = AuthenticatedClient()
+        return self._client
+
+    def _remember(self, file: File) -> Dict[str, Any]:
+        info = _file_info(file)
+        self._files[info["name"]] = file
+        return info
+
+    def _list(self, parts: List[str]) -> List[Dict[str, Any]]:
+        if not parts:
+            projects = kleinkram.api.routes.get_projects(self.client, ProjectQuery())
+            return [_directory_info(project.name, id=str(project.id), created=project.created_at) for project in projects]
+
+        project_query = ProjectQuery(patterns=[parts[0]])
+        if len(parts) == 1:
+            missions = kleinkram.api.routes.get_missions(self.client, MissionQuery(project_query=project_query))
+            ret = [
+                _directory_info(f"{mission.project_name}/{mission.name}", id=str(mission.id), created=mission.created_at)
+                for mission in missions
+                if mission.project_name == parts[0]
+            ]
+            if not ret:
+                # empty or missing
+                kleinkram.api.routes.get_project(self.client, project_query, exact_match=True)
+            return ret
+
+        mission_query = MissionQuery(patterns=[parts[1]], project_query=project_query)
+        files = kleinkram.api.routes.get_files(self.client, FileQuery(mission_query=mission_query))
+        ret = [self._remember(file) for file in files if (file.project_name, file.mission_name) == tuple(parts)]
+        if not ret:
+            kleinkram.api.routes.get_mission(self.client, mission_query)
+        return ret
+
+    def ls(self, path: str, detail: bool = True, **kwargs: Any) -> Union[List[str], List[Dict[str, Any]]]:
+        path = self._strip_protocol(path)
+        parts = _split(path)
+        if len(parts) >= 3:
+            entries = [self.info(path)]
+        else:
+            # not `_ls_from_cache`, it returns the entry of a directory if only its parent was listed
+            cached = self.dircache.get(path)
+            if cached is not None:
+                entries = cached
+            else:
+                try:
+                    entries = self._list(parts)
+                except (ProjectNotFound, MissionNotFound) as e:
+                    raise FileNotFoundError(path) from e
+                self.dircache[path] = entries
+        return entries if detail else [entry["name"] for entry in entries]
+
+    def _get_file(self, path: str) -> File:
+        path = self._strip_protocol(path)
+        file = self._files.get(path)
+        if file is not None:
+            return file
+        parts = _split(path)
+        if len(parts) != 3:
+            raise FileNotFoundError(path)
+        project, mission, name = parts
+        query = FileQuery(
+            patterns=[name],
+            mission_query=MissionQuery(patterns=[mission], project_query=ProjectQuery(patterns=[project])),
+        )
+        try:
+            file = kleinkram.api.routes.get_file(self.client, query)
+        except FileNotFound as e:
+            raise FileNotFoundError(path) from e
+        if file.name != name:
+            raise FileNotFoundError(path)
+        self._remember(file)
+        return file
+
+    def info(self, path: str, **kwargs: Any) -> Dict[str, Any]:
+        path = self._strip_protocol(path)
+        parts = _split(path)
+        if not parts:
+            return _directory_info("")
+        if len(parts) >= 3:
+            return _file_info(self._get_file(path))
+        info: Dict[str, Any] = super().info(path, **kwargs)
+        return info
+
+    def ukey(self, path: str) -> str:
+        return _version(self._get_file(path))
+
+    def _open(
+        self,
+        path: str,
+        mode: str = "rb",
+        block_size: Optional[int] = None,
+        autocommit: bool = True,
+        cache_options: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> KleinkramFile:
+        if mode != "rb":
+            raise NotImplementedError("kleinkram files can only be opened for reading")
+        path = self._strip_protocol(path)
+        file = self._get_file(path)
+        return KleinkramFile(
+            self,
+            path,
+            file=file,
+            reader=file_reader(self.client, file, self._pool),
+            cache=self.cache,
+            block_size=block_size or self.block_size,
+            read_ahead=self.read_ahead,
+        )
+
+    def invalidate_cache(self, path: Optional[str] = None) -> None:
+        """\
+        forgets listed projects, missions and files, cached blocks stay valid
+        """
+        self.dircache.clear()
+        self._files.clear()
@@ -0,0 +1,149 @@
+"""\
+a persistent cache of local file hashes
+
+hashing large bags is slow, we remember the hash of every file we hash
+together with its size, mtime and inode, an entry is only used as long
+as all of them still match the file on disk
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from kleinkram.config import STATE_DIR
+from kleinkram.utils import b64_md5
+
+logger = logging.getLogger(__name__)
+
+HASH_CACHE_PATH = STATE_DIR / "hashes.sqlite"
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hash TEXT NOT NULL
+)
+"""
+
+
+def _key(path: Path) -> str:
+    return str(path.resolve())
+
+
+def _same_file(a: os.stat_result, b: os.stat_result) -> bool:
+    return (a.st_size, a.st_mtime_ns, a.st_ino) == (b.st_size, b.st_mtime_ns, b.st_ino)
+
+
+class HashCache:
+    """\
+    sqlite backed map from (path, size, mtime_ns, inode) to b64 md5 hash
+    """
+
+    def __init__(self, db_path: Path = HASH_CACHE_PATH) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(_SCHEMA)
+
+    def get(self, path: Path) -> Optional[str]:
+        """\
+        returns the cached hash if the file did not change since it was hashed
+        """
+        stat = path.stat()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, hash FROM hashes WHERE path = ?",
+                (_key(path),),
+            ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, inode, file_hash = row
+        if (size, mtime_ns, inode) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return None
+        return str(file_hash)
+
+    def put(self, path: Path, file_hash: str, *, stat: os.stat_result) -> None:
+        """\
+        stores the hash of a file, `stat` must be taken before the file was hashed,
+        if the file changed in the meantime nothing is stored
+        """
+        if not _same_file(stat, path.stat()):
+            logger.info(f"file changed while hashing, not caching hash of {path}")
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, inode, hash) VALUES (?, ?, ?, ?, ?)",
+                (_key(path), stat.st_size, stat.st_mtime_ns, stat.st_ino, file_hash),
+            )
+
+    def b64_md5(self, path: Path, *, rehash: bool = False) -> str:
+        if not rehash:
+            file_hash = self.get(path)
+            if file_hash is not None:
+                return file_hash
+
+        stat = path.stat()
+        file_hash = b64_md5(path)
+        self.put(path, file_hash, stat=stat)
+        return file_hash
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_HASH_CACHE: Optional[HashCache] = None
+_HASH_CACHE_DISABLED = False
+_HASH_CACHE_LOCK = Lock()
+
+
+def get_hash_cache() -> Optional[HashCache]:
+    """\
+    returns the shared hash cache, `None` if it can not be opened
+    """
+    global _HASH_CACHE, _HASH_CACHE_DISABLED
+
+    with _HASH_CACHE_LOCK:
+        if _HASH_CACHE is None and not _HASH_CACHE_DISABLED:
+            try:
+                _HASH_CACHE = HashCache()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"could not open hash cache {HASH_CACHE_PATH}, hashing without cache: {e}")
+                _HASH_CACHE_DISABLED = True
+        return _HASH_CACHE
+
+
+def cached_b64_md5(path: Path, *, rehash: bool = False) -> str:
+    """\
+    like `kleinkram.utils.b64_md5` but consults the hash cache first,
+    `rehash` ignores cached entries and refreshes them
+    """
+    cache = get_hash_cache()
+    if cache is None:
+        return b64_md5(path)
+    try:
+        return cache.b64_md5(path, rehash=rehash)
+    except sqlite3.Error as e:
+        logger.warning(f"hash cache error, hashing without cache: {e}")
+        return b64_md5(path)
+
+
+def remember_b64_md5(path: Path, file_hash: str, *, stat: os.stat_result) -> None:
+    """\
+    stores a hash that was computed elsewhere, e.g. while uploading
+    """
+    cache = get_hash_cache()
+    if cache is None:
+        return
+    try:
+        cache.put(path, file_hash, stat=stat)
+    except sqlite3.Error as e:
+        logger.warning(f"hash cache error, not caching hash of {path}: {e}")
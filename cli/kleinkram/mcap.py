@@ -0,0 +1,315 @@
+"""\
+reads the index of a remote mcap file and copies a subset of its messages
+into a new file, records are read and written with the `mcap` package
+
+a file with a summary section lists its schemas, channels and chunks at the
+end, so the chunks holding some topics in some time window can be found
+with a few small range reads, only these chunks are then downloaded,
+see https://mcap.dev/spec
+
+requires `pip install kleinkram[mcap]`, attachments and metadata records are not copied
+"""
+
+from __future__ import annotations
+
+import io
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import datetime
+from fnmatch import fnmatchcase
+from typing import IO
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Union
+
+try:
+    import mcap.exceptions
+    from mcap.reader import FOOTER_SIZE
+    from mcap.records import Channel
+    from mcap.records import Chunk
+    from mcap.records import ChunkIndex
+    from mcap.records import Footer
+    from mcap.records import Header
+    from mcap.records import McapRecord
+    from mcap.records import Message
+    from mcap.records import Schema
+    from mcap.records import Statistics
+    from mcap.stream_reader import MAGIC_SIZE
+    from mcap.stream_reader import StreamReader
+    from mcap.stream_reader import breakup_chunk
+    from mcap.writer import Writer
+except ImportError:
+    HAS_MCAP = False
+else:
+    HAS_MCAP = True
+
+LIBRARY = "kleinkram"
+
+# the end of a file is read at once, this usually covers the whole summary
+TAIL_READ_SIZE = 1024 * 1024
+HEADER_READ_SIZE = 4096
+# messages are written in chunks of about this size
+WRITER_CHUNK_SIZE = 4 * 1024 * 1024
+
+NS_PER_S = 1_000_000_000
+
+
+class McapError(Exception): ...
+
+
+class McapIndexMissing(McapError):
+    """\
+    the file has no summary or no chunk index, it can only be read as a whole
+    """
+
+
+def _require_mcap() -> None:
+    if not HAS_MCAP:
+        raise McapError("reading mcap files requires `pip install kleinkram[mcap]`")
+
+
+def _records(data: bytes) -> List[McapRecord]:
+    """\
+    the records in `data` up to and including the footer, chunks are not broken up
+    """
+    fp = io.BytesIO(data)
+    ret: List[McapRecord] = []
+    end = 0
+    try:
+        for record in StreamReader(fp, skip_magic=True, emit_chunks=True).records:
+            ret.append(record)
+            end = fp.tell()
+    except mcap.exceptions.EndOfFile as e:
+        # the reader expects a footer, records without one end at a record boundary
+        if not ret or end != len(data):
+            raise McapError("mcap records are truncated") from e
+    except (mcap.exceptions.McapError, ValueError) as e:
+        raise McapError(f"invalid mcap records: {e}") from e
+    return ret
+
+
+@dataclass
+class McapSummary:
+    """\
+    what a reader needs to find messages without reading the data section
+    """
+
+    header: Header
+    schemas: Dict[int, Schema] = field(default_factory=dict)
+    channels: Dict[int, Channel] = field(default_factory=dict)
+    chunk_indexes: List[ChunkIndex] = field(default_factory=list)
+    statistics: Optional[Statistics] = None
+
+    @property
+    def start_time(self) -> Optional[int]:
+        if self.statistics is not None and self.statistics.message_count:
+            return self.statistics.message_start_time
+        return min((idx.message_start_time for idx in self.chunk_indexes), default=None)
+
+    @property
+    def end_time(self) -> Optional[int]:
+        if self.statistics is not None and self.statistics.message_count:
+            return self.statistics.message_end_time
+        return max((idx.message_end_time for idx in self.chunk_indexes), default=None)
+
+
+def _read_header(read: Callable[[int, int], bytes], head: bytes) -> Header:
+    # `head` usually holds the whole header record, a larger one is read again
+    header_start = MAGIC_SIZE + 1 + 8
+    header_end = header_start + int.from_bytes(head[MAGIC_SIZE + 1 : header_start], "little")  # noqa: E203
+    if header_end > len(head):
+        head = read(0, header_end)
+    try:
+        header = next(StreamReader(io.BytesIO(head)).records)
+    except (mcap.exceptions.McapError, ValueError) as e:
+        raise McapError(f"not an mcap file: {e}") from e
+    if not isinstance(header, Header):
+        raise McapError("mcap header not found")
+    return header
+
+
+def read_summary(read: Callable[[int, int], bytes], size: int) -> McapSummary:
+    """\
+    reads the header and the summary section of a file, `read(offset, length)`
+    returns `length` bytes of the file starting at `offset`
+
+    raises `McapIndexMissing` if the file has no summary or no chunk index
+    """
+    _require_mcap()
+    if size < 2 * MAGIC_SIZE + FOOTER_SIZE:
+        raise McapError("file is too small to be an mcap file")
+
+    tail_offset = max(0, size - TAIL_READ_SIZE)
+    tail = read(tail_offset, size - tail_offset)
+    footer_start = size - MAGIC_SIZE - FOOTER_SIZE - tail_offset
+    records = _records(tail[footer_start:])
+    footer = records[0] if len(records) == 1 else None
+    if not isinstance(footer, Footer):
+        raise McapError("not an mcap file or the file is incomplete")
+    if footer.summary_start == 0:
+        raise McapIndexMissing("mcap file has no summary section")
+
+    if footer.summary_start >= tail_offset:
+        summary = tail[footer.summary_start - tail_offset :]  # noqa: E203
+    else:
+        summary = read(footer.summary_start, tail_offset - footer.summary_start) + tail
+
+    head = tail if tail_offset == 0 else read(0, min(size, HEADER_READ_SIZE))
+    ret = McapSummary(header=_read_header(read, head))
+    for record in _records(summary):
+        if isinstance(record, Schema):
+            ret.schemas[record.id] = record
+        elif isinstance(record, Channel):
+            ret.channels[record.id] = record
+        elif isinstance(record, ChunkIndex):
+            ret.chunk_indexes.append(record)
+        elif isinstance(record, Statistics):
+            ret.statistics = record
+
+    if not ret.chunk_indexes and (ret.statistics is None or ret.statistics.message_count > 0):
+        raise McapIndexMissing("mcap file has no chunk index")
+    ret.chunk_indexes.sort(key=lambda idx: idx.chunk_start_offset)
+    return ret
+
+
+def read_chunk(data: bytes) -> List[McapRecord]:
+    """\
+    the schemas, channels and messages of the chunk record in `data`,
+    decompressed and checked against the chunk's crc
+    """
+    _require_mcap()
+    records = _records(data)
+    if len(records) != 1 or not isinstance(records[0], Chunk):
+        raise McapError("expected a single chunk record")
+    try:
+        return breakup_chunk(records[0], validate_crc=True)
+    except (mcap.exceptions.McapError, ValueError) as e:
+        raise McapError(f"invalid mcap chunk: {e}") from e
+
+
+# seconds relative to the first message of a file or an absolute time
+TimeBound = Union[float, datetime]
+
+
+def resolve_time(bound: Optional[TimeBound], start_time: Optional[int]) -> Optional[int]:
+    """\
+    converts `bound` to nanoseconds since the epoch, `start_time` is the time
+    of the first message of the file in nanoseconds
+    """
+    if bound is None:
+        return None
+    if isinstance(bound, datetime):
+        return int(bound.timestamp() * NS_PER_S)
+    return (start_time or 0) + int(bound * NS_PER_S)
+
+
+def topic_matcher(topics: Optional[Sequence[str]]) -> Callable[[str], bool]:
+    """\
+    matches topic names or glob patterns, `None` matches all topics
+    """
+    if topics is None:
+        return lambda topic: True
+    patterns = list(topics)
+    return lambda topic: any(fnmatchcase(topic, pattern) for pattern in patterns)
+
+
+def select_chunks(
+    summary: McapSummary,
+    *,
+    matches: Callable[[str], bool],
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> List[ChunkIndex]:
+    """\
+    the chunks that may contain messages on matching topics between `start` and `end`,
+    chunks without message indexes can not be excluded by topic
+    """
+    wanted = {id for id, channel in summary.channels.items() if matches(channel.topic)}
+    ret = []
+    for idx in summary.chunk_indexes:
+        if start is not None and idx.message_end_time < start:
+            continue
+        if end is not None and idx.message_start_time > end:
+            continue
+        if summary.channels and idx.message_index_offsets and not wanted & idx.message_index_offsets.keys():
+            continue
+        ret.append(idx)
+    return ret
+
+
+class McapWriter:
+    """\
+    writes messages of another file to a new indexed mcap file, the schemas and
+    channels of the source file are registered before the first message that uses them
+    """
+
+    def __init__(self, fp: IO[Any], *, profile: str = "", chunk_size: int = WRITER_CHUNK_SIZE) -> None:
+        _require_mcap()
+        self._writer = Writer(fp, chunk_size=chunk_size)
+        self._writer.start(profile=profile, library=LIBRARY)
+        # source ids to ids in the new file
+        self._schema_ids: Dict[int, int] = {}
+        self._channel_ids: Dict[int, int] = {}
+        self.message_count = 0
+
+    def add_message(self, message: Message, channel: Channel, schema: Optional[Schema]) -> None:
+        schema_id = 0
+        if schema is not None:
+            if schema.id not in self._schema_ids:
+                self._schema_ids[schema.id] = self._writer.register_schema(schema.name, schema.encoding, schema.data)
+            schema_id = self._schema_ids[schema.id]
+        if channel.id not in self._channel_ids:
+            self._channel_ids[channel.id] = self._writer.register_channel(
+                channel.topic, channel.message_encoding, schema_id, channel.metadata
+            )
+        self._writer.add_message(
+            self._channel_ids[channel.id],
+            log_time=message.log_time,
+            data=message.data,
+            publish_time=message.publish_time,
+            sequence=message.sequence,
+        )
+        self.message_count += 1
+
+    def finish(self) -> None:
+        """\
+        writes the summary and the footer, the file is complete afterwards
+        """
+        self._writer.finish()
+
+
+def copy_messages(
+    records: Sequence[McapRecord],
+    writer: McapWriter,
+    summary: McapSummary,
+    *,
+    matches: Callable[[str], bool],
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> int:
+    """\
+    copies the messages on matching topics between `start` and `end` from the
+    records of a chunk to `writer`, returns the number of messages, schemas
+    and channels that are only defined in the chunk are added to `summary`
+    """
+    n = 0
+    for record in records:
+        if isinstance(record, Schema):
+            summary.schemas.setdefault(record.id, record)
+        elif isinstance(record, Channel):
+            summary.channels.setdefault(record.id, record)
+        elif isinstance(record, Message):
+            if (start is not None and record.log_time < start) or (end is not None and record.log_time > end):
+                continue
+            channel = summary.channels.get(record.channel_id)
+            if channel is None:
+                raise McapError(f"message on unknown channel {record.channel_id}")
+            if not matches(channel.topic):
+                continue
+            writer.add_message(record, channel, summary.schemas.get(channel.schema_id))
+            n += 1
+    return n
@@ -0,0 +1,201 @@
+"""\
+a persistent cache of project, mission and file listings
+
+opt in with `metadata_cache` in the config, a listing is reused for `ttl`
+seconds, after that it is refreshed (see `cached_paginated_request`),
+listings are kept per endpoint and user, every write request of the client
+expires the listings of its user so the next use refreshes them
+
+refreshes only merge the changed entries, entries deleted on the server may
+linger until the listing is fetched completely, this happens at the latest
+`max_age` seconds after the last complete fetch, older listings are dropped
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Mapping
+from typing import NamedTuple
+from typing import Optional
+
+from kleinkram.config import STATE_DIR
+from kleinkram.config import Config
+from kleinkram.config import MetadataCacheConfig
+
+logger = logging.getLogger(__name__)
+
+METADATA_CACHE_PATH = STATE_DIR / "metadata.sqlite"
+
+# sqlite waits this long for other processes sharing the cache
+DB_TIMEOUT = 30.0  # seconds
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS listings (
+    key TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    entries TEXT NOT NULL,
+    etag TEXT,
+    synced_at REAL NOT NULL,
+    full_synced_at REAL NOT NULL
+)
+"""
+
+
+class Listing(NamedTuple):
+    entries: List[Dict[str, Any]]
+    etag: Optional[str]  # of the first page of the refresh request
+    synced_at: float
+
+
+def metadata_scope(config: Config) -> str:
+    """\
+    listings differ per endpoint and user
+    """
+    credentials = config.credentials
+    user = ""
+    if credentials is not None:
+        user = credentials.api_key or credentials.refresh_token or ""
+    return hashlib.sha256(f"{config.endpoint.api}\0{user}".encode()).hexdigest()
+
+
+def _key(scope: str, endpoint: str, params: Mapping[str, Any]) -> str:
+    query = json.dumps([scope, endpoint, params], sort_keys=True, default=str)
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class MetadataCache:
+    """\
+    sqlite backed map from (scope, endpoint, query params) to the listed entries,
+    several processes can share the cache
+    """
+
+    def __init__(
+        self,
+        db_path: Path = METADATA_CACHE_PATH,
+        *,
+        max_age: float = MetadataCacheConfig().max_age,
+        clock: Callable[[], float] = time,
+    ) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._clock = clock
+        self._max_age = max_age
+        self._lock = Lock()
+        self._conn = sqlite3.connect(str(db_path), timeout=DB_TIMEOUT, check_same_thread=False)
+        # the listings may name private projects and files
+        os.chmod(db_path, 0o600)
+        with self._lock, self._conn:
+            self._conn.execute(_SCHEMA)
+            self._conn.execute("DELETE FROM listings WHERE full_synced_at < ?", (self._clock() - self._max_age,))
+
+    def get(self, scope: str, endpoint: str, params: Mapping[str, Any]) -> Optional[Listing]:
+        """`None` if the listing is not cached or was not fetched completely for `max_age`"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT entries, etag, synced_at FROM listings WHERE key = ? AND full_synced_at >= ?",
+                (_key(scope, endpoint, params), self._clock() - self._max_age),
+            ).fetchone()
+        if row is None:
+            return None
+        entries, etag, synced_at = row
+        return Listing(json.loads(entries), etag, synced_at)
+
+    def is_fresh(self, listing: Listing, ttl: float) -> bool:
+        return self._clock() - listing.synced_at < ttl
+
+    def put(
+        self,
+        scope: str,
+        endpoint: str,
+        params: Mapping[str, Any],
+        entries: List[Dict[str, Any]],
+        etag: Optional[str] = None,
+        *,
+        complete: bool = True,
+    ) -> None:
+        """`complete` is false if `entries` were merged into the cached listing"""
+        key = _key(scope, endpoint, params)
+        now = self._clock()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT full_synced_at FROM listings WHERE key = ?", (key,)).fetchone()
+            full_synced_at = row[0] if row is not None and not complete else now
+            self._conn.execute(
+                "INSERT OR REPLACE INTO listings (key, scope, entries, etag, synced_at, full_synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, json.dumps(entries), etag, now, full_synced_at),
+            )
+
+    def expire(self, scope: str) -> None:
+        """\
+        the listings of `scope` are refreshed on their next use
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE listings SET synced_at = 0 WHERE scope = ?", (scope,))
+
+    def retain(self, scope: str) -> None:
+        """deletes the listings of all other scopes"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM listings WHERE scope != ?", (scope,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_METADATA_CACHE: Optional[MetadataCache] = None
+_METADATA_CACHE_DISABLED = False
+_METADATA_CACHE_LOCK = Lock()
+
+
+def get_metadata_cache(config: Config) -> Optional[MetadataCache]:
+    """\
+    returns the shared metadata cache, `None` if it is not enabled in `config` or can not be opened
+    """
+    global _METADATA_CACHE, _METADATA_CACHE_DISABLED
+
+    if config.metadata_cache is None:
+        return None
+    with _METADATA_CACHE_LOCK:
+        if _METADATA_CACHE is None and not _METADATA_CACHE_DISABLED:
+            try:
+                _METADATA_CACHE = MetadataCache(max_age=config.metadata_cache.max_age)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"could not open metadata cache {METADATA_CACHE_PATH}, listing without cache: {e}")
+                _METADATA_CACHE_DISABLED = True
+        return _METADATA_CACHE
+
+
+def expire_metadata_cache(config: Config) -> None:
+    """\
+    called after every write request, the listings of the user are refreshed on their next use
+    """
+    cache = get_metadata_cache(config)
+    if cache is None:
+        return
+    try:
+        cache.expire(metadata_scope(config))
+    except sqlite3.Error as e:
+        logger.warning(f"could not expire metadata cache: {e}")
+
+
+def prune_metadata_cache(config: Config) -> None:
+    """\
+    called after a login, the listings of other users and endpoints are deleted
+    """
+    cache = get_metadata_cache(config)
+    if cache is None:
+        return
+    try:
+        cache.retain(metadata_scope(config))
+    except sqlite3.Error as e:
+        logger.warning(f"could not prune metadata cache: {e}")
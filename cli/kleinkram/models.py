@@ -6,6 +6,7 @@ from datetime import datetime
 from enum import Enum
 from typing import Dict
 from typing import List
+from typing import Optional
 from uuid import UUID
 
 
@@ -77,6 +78,31 @@ class File:
     state: FileState = FileState.OK
 
 
+@dataclass(frozen=True)
+class TopicInfo:
+    name: str
+    type_: str
+    message_count: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class RecordingInfo:
+    """\
+    what a recording holds, read from its index
+    """
+
+    topics: List[TopicInfo] = field(default_factory=list)
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+
+    @property
+    def message_count(self) -> Optional[int]:
+        counts = [topic.message_count for topic in self.topics]
+        if any(count is None for count in counts):
+            return None
+        return sum(count for count in counts if count is not None)
+
+
 class RunStatus(str, Enum):
     QUEUED = "Queued"
     IN_PROGRESS = "In Progress"
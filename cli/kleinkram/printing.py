@@ -37,6 +37,7 @@ from kleinkram.models import MetadataValue
 from kleinkram.models import MetadataValueType
 from kleinkram.models import Mission
 from kleinkram.models import Project
+from kleinkram.models import RecordingInfo
 from kleinkram.models import Run
 
 FILE_STATE_COLOR = {
@@ -244,6 +245,20 @@ def file_info_table(file: File) -> Table:
     return table
 
 
+def recording_info_table(info: RecordingInfo, *, title: str = "topics") -> Table:
+    table = Table(title=title)
+    table.add_column("topic", style="cyan")
+    table.add_column("type")
+    table.add_column("messages", justify="right")
+    for topic in info.topics:
+        table.add_row(topic.name, topic.type_, "" if topic.message_count is None else str(topic.message_count))
+
+    if info.start_time is not None and info.end_time is not None:
+        duration = (info.end_time - info.start_time).total_seconds()
+        table.caption = f"{info.start_time} - {info.end_time} ({duration:.1f}s)"
+    return table
+
+
 def mission_info_table(mission: Mission, print_metadata: bool = True) -> Tuple[Table, ...]:
     table = Table("k", "v", title=f"mission info: {mission.name}", show_header=False)
 
@@ -362,6 +377,18 @@ def print_file_info(file: File, *, pprint: bool) -> None:
         print(json.dumps(file_dct))
 
 
+def print_recording_info(file: File, info: RecordingInfo, *, pprint: bool) -> None:
+    """\
+    prints the topics of a recording to stdout
+    either using pprint or as a list for piping
+    """
+    if pprint:
+        Console().print(recording_info_table(info, title=f"topics: {file.name}"))
+    else:
+        for topic in info.topics:
+            print(topic.name, flush=True)
+
+
 def print_mission_info(mission: Mission, *, pprint: bool) -> None:
     """\
     prints the mission info to stdout
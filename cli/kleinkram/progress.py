@@ -0,0 +1,131 @@
+"""\
+a single progress bar for all bytes moved by a transfer
+
+transfer workers only add to a counter, a background thread turns the
+counter into progress bar updates a few times per second
+"""
+
+from __future__ import annotations
+
+from threading import Event
+from threading import Thread
+from threading import get_ident
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Sequence
+
+from tqdm import tqdm
+
+REFRESH_INTERVAL = 0.5  # seconds
+
+
+class ByteCounter:
+    """\
+    a counter that many threads can add to without taking a lock
+
+    every thread only ever writes its own slot, reads sum up all slots
+    """
+
+    def __init__(self) -> None:
+        self._slots: Dict[int, int] = {}
+
+    def add(self, n: int) -> None:
+        ident = get_ident()
+        self._slots[ident] = self._slots.get(ident, 0) + n
+
+    @property
+    def value(self) -> int:
+        return sum(list(self._slots.values()))
+
+
+class TransferProgress:
+    """\
+    aggregate progress of a transfer: bytes done, rate and eta
+
+    `update` is meant to be used as the byte callback of all transfers,
+    `listeners` are called with the bytes moved since the last refresh,
+    they are called even if the progress bar is disabled
+    """
+
+    def __init__(
+        self,
+        total_bytes: int,
+        *,
+        total_files: Optional[int] = None,
+        desc: Optional[str] = None,
+        disable: bool = False,
+        listeners: Sequence[Callable[[int], Any]] = (),
+        interval: float = REFRESH_INTERVAL,
+    ) -> None:
+        self._total_bytes = total_bytes
+        self._total_files = total_files
+        self._listeners = list(listeners)
+        self._interval = interval
+
+        self._bytes = ByteCounter()
+        self._skipped_bytes = ByteCounter()
+        self._files = ByteCounter()
+        self._shown_bytes = 0
+
+        self._pbar = tqdm(
+            total=total_bytes,
+            desc=desc,
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+            leave=True,
+            disable=disable,
+        )
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def bytes_done(self) -> int:
+        return self._bytes.value
+
+    def update(self, nbytes: int) -> None:
+        self._bytes.add(nbytes)
+
+    def skip(self, nbytes: int) -> None:
+        """\
+        removes bytes that will not be transferred from the total
+        """
+        self._skipped_bytes.add(nbytes)
+
+    def file_done(self) -> None:
+        self._files.add(1)
+
+    def write(self, msg: str) -> None:
+        tqdm.write(msg)
+
+    def _refresh(self) -> None:
+        done = self._bytes.value
+        delta, self._shown_bytes = done - self._shown_bytes, done
+
+        for listener in self._listeners:
+            listener(delta)
+
+        self._pbar.total = self._total_bytes - self._skipped_bytes.value
+        if self._total_files is not None:
+            self._pbar.set_postfix_str(f"{self._files.value}/{self._total_files} files", refresh=False)
+        self._pbar.update(delta)
+        self._pbar.refresh()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            self._refresh()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._refresh()
+        self._pbar.close()
+
+    def __enter__(self) -> TransferProgress:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
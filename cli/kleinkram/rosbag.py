@@ -0,0 +1,127 @@
+"""\
+reads the index of a ros1 bag file (format 2.0)
+
+the bag header at the start points to the index section at the end of the
+file, it holds a record per connection (topic and type) and per chunk the
+time span and number of messages per connection, so topics, message counts
+and the time span of a bag are known without reading its messages,
+see http://wiki.ros.org/Bags/Format/2.0
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import Callable
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+BAG_MAGIC = b"#ROSBAG V2.0\n"
+# the bag header record is padded to 4096 bytes
+BAG_HEADER_READ_SIZE = len(BAG_MAGIC) + 4096
+
+OP_BAG_HEADER = 0x03
+OP_CHUNK_INFO = 0x06
+OP_CONNECTION = 0x07
+
+NS_PER_S = 1_000_000_000
+
+
+class BagError(Exception): ...
+
+
+class BagIndexMissing(BagError):
+    """\
+    the bag was not closed properly and has no index
+    """
+
+
+class BagConnection(NamedTuple):
+    id: int
+    topic: str
+    type: str
+
+
+class BagIndex(NamedTuple):
+    connections: Dict[int, BagConnection]
+    message_counts: Dict[int, int]  # by connection id
+    start_time: Optional[int]  # nanoseconds since the epoch
+    end_time: Optional[int]
+
+
+def _parse_fields(data: bytes) -> Dict[str, bytes]:
+    ret = {}
+    offset = 0
+    while offset < len(data):
+        if offset + 4 > len(data):
+            raise BagError("invalid record header")
+        (length,) = struct.unpack_from("<I", data, offset)
+        start, offset = offset + 4, offset + 4 + length
+        name, sep, value = data[start:offset].partition(b"=")
+        if not sep or offset > len(data):
+            raise BagError("invalid record header")
+        ret[name.decode()] = value
+    return ret
+
+
+def _read_record(data: bytes, offset: int) -> Tuple[Dict[str, bytes], bytes, int]:
+    """\
+    returns the header fields and data of the record at `offset` and the offset of the next record
+    """
+    try:
+        (header_length,) = struct.unpack_from("<I", data, offset)
+        header_start = offset + 4
+        header_end = header_start + header_length
+        (data_length,) = struct.unpack_from("<I", data, header_end)
+    except struct.error:
+        raise BagError(f"truncated record at {offset}")
+    data_start = header_end + 4
+    data_end = data_start + data_length
+    if data_end > len(data):
+        raise BagError(f"truncated record at {offset}")
+    return _parse_fields(data[header_start:header_end]), data[data_start:data_end], data_end
+
+
+def _time(value: bytes) -> int:
+    secs, nsecs = struct.unpack("<II", value)
+    return int(secs * NS_PER_S + nsecs)
+
+
+def read_bag_index(read: Callable[[int, int], bytes], size: int) -> BagIndex:
+    """\
+    reads the bag header and the index section, `read(offset, length)` returns
+    `length` bytes of the file starting at `offset`
+    """
+    head = read(0, min(size, BAG_HEADER_READ_SIZE))
+    if not head.startswith(BAG_MAGIC):
+        raise BagError("not a ros1 bag file (format 2.0)")
+    fields, _, _ = _read_record(head, len(BAG_MAGIC))
+    if fields.get("op") != bytes([OP_BAG_HEADER]):
+        raise BagError("bag header not found")
+    (index_pos,) = struct.unpack("<Q", fields["index_pos"])
+    if index_pos == 0 or index_pos >= size:
+        raise BagIndexMissing("bag file has no index, it was probably not closed properly")
+
+    index = read(index_pos, size - index_pos)
+    connections: Dict[int, BagConnection] = {}
+    counts: Dict[int, int] = {}
+    start_time: Optional[int] = None
+    end_time: Optional[int] = None
+    offset = 0
+    while offset < len(index):
+        fields, data, offset = _read_record(index, offset)
+        op = fields.get("op")
+        if op == bytes([OP_CONNECTION]):
+            (conn,) = struct.unpack("<I", fields["conn"])
+            connection_fields = _parse_fields(data)
+            msg_type = connection_fields.get("type", b"").decode()
+            connections[conn] = BagConnection(conn, fields["topic"].decode(), msg_type)
+        elif op == bytes([OP_CHUNK_INFO]):
+            chunk_start, chunk_end = _time(fields["start_time"]), _time(fields["end_time"])
+            start_time = chunk_start if start_time is None else min(start_time, chunk_start)
+            end_time = chunk_end if end_time is None else max(end_time, chunk_end)
+            for conn, count in struct.iter_unpack("<II", data):
+                counts[conn] = counts.get(conn, 0) + count
+
+    return BagIndex(connections=connections, message_counts=counts, start_time=start_time, end_time=end_time)
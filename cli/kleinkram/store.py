@@ -0,0 +1,238 @@
+"""\
+a content addressed store of downloaded files shared by all destinations
+
+files are keyed by their remote md5 hash, before downloading a file we look
+for its hash in the store and link the stored copy into place, only misses
+are downloaded, the store is capped in size and evicts the least recently
+used files first
+
+stored files are linked into their destinations (reflink, else hardlink,
+else copy), a hardlinked destination that is modified in place changes
+the stored file too, such files are detected by their size and mtime and
+dropped from the store
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import logging
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Callable
+from typing import Optional
+
+from kleinkram.config import Config
+from kleinkram.utils import parse_size
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "index.sqlite"
+OBJECTS_DIR = "objects"
+TMP_SUFFIX = ".store-tmp"
+
+# linux ioctl that clones a whole file copy-on-write (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# sqlite waits this long for other processes sharing the store
+DB_TIMEOUT = 30.0  # seconds
+
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+COPY = "copy"
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS objects (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            dst.unlink()
+            raise
+
+
+def link_or_copy(src: Path, dst: Path) -> str:
+    """\
+    makes `dst` a copy of `src` as cheaply as possible, returns the method used,
+    `dst` must not exist
+    """
+    try:
+        _reflink(src, dst)
+        return REFLINK
+    except OSError:
+        pass
+    try:
+        os.link(src, dst)
+        return HARDLINK
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return COPY
+
+
+def _replace_with(src: Path, dst: Path) -> str:
+    """\
+    like `link_or_copy` but atomically replaces an existing `dst`
+    """
+    tmp = dst.with_name(dst.name + TMP_SUFFIX)
+    tmp.unlink(missing_ok=True)
+    try:
+        method = link_or_copy(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return method
+
+
+class LocalStore:
+    """\
+    a directory of files named by their md5 hash with a sqlite index,
+    several processes can share the same store
+
+    `max_size` caps the total size of the stored files in bytes
+    """
+
+    def __init__(self, root: Path, *, max_size: Optional[int] = None, clock: Callable[[], float] = time) -> None:
+        self.root = root
+        self.max_size = max_size
+        self._clock = clock
+        (root / OBJECTS_DIR).mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(str(root / INDEX_NAME), timeout=DB_TIMEOUT, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(_SCHEMA)
+
+    def _object_path(self, file_hash: str) -> Path:
+        digest = base64.b64decode(file_hash, validate=True).hex()
+        return self.root / OBJECTS_DIR / digest[:2] / digest
+
+    def _drop(self, file_hash: str) -> None:
+        # requires `self._lock`
+        with self._conn:
+            self._conn.execute("DELETE FROM objects WHERE hash = ?", (file_hash,))
+        self._object_path(file_hash).unlink(missing_ok=True)
+
+    def get(self, file_hash: str) -> Optional[Path]:
+        """\
+        returns the stored file with the hash, `None` if there is none
+        """
+        try:
+            path = self._object_path(file_hash)
+        except (binascii.Error, ValueError):
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns FROM objects WHERE hash = ?", (file_hash,)).fetchone()
+            if row is None:
+                return None
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                stat = None
+            if stat is None or (stat.st_size, stat.st_mtime_ns) != tuple(row):
+                logger.info(f"dropping modified or missing file {path} from the local store")
+                self._drop(file_hash)
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE objects SET last_used = ? WHERE hash = ?", (self._clock(), file_hash))
+        return path
+
+    def __contains__(self, file_hash: str) -> bool:
+        return self.get(file_hash) is not None
+
+    def materialize(self, file_hash: str, dst: Path) -> Optional[str]:
+        """\
+        places the stored file with the hash at `dst`, replacing it if it exists,
+        returns the method used or `None` if the hash is not in the store
+        """
+        src = self.get(file_hash)
+        if src is None:
+            return None
+        try:
+            return _replace_with(src, dst)
+        except FileNotFoundError:
+            if not dst.parent.exists():
+                raise
+            # evicted by another process in the meantime
+            return None
+
+    def add(self, path: Path, file_hash: str) -> None:
+        """\
+        adds a downloaded file, `file_hash` must be the hash of its content
+        """
+        size = path.stat().st_size
+        if self.max_size is not None and size > self.max_size:
+            return
+        dst = self._object_path(file_hash)
+        dst.parent.mkdir(exist_ok=True)
+        _replace_with(path, dst)
+        stat = dst.stat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO objects (hash, size, mtime_ns, last_used) VALUES (?, ?, ?, ?)",
+                (file_hash, stat.st_size, stat.st_mtime_ns, self._clock()),
+            )
+        self.evict()
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()
+        return int(size)
+
+    def evict(self) -> None:
+        """\
+        removes the least recently used files until the store fits `max_size`
+        """
+        if self.max_size is None:
+            return
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()
+            if size <= self.max_size:
+                return
+            rows = self._conn.execute("SELECT hash, size FROM objects ORDER BY last_used").fetchall()
+            for file_hash, file_size in rows:
+                if size <= self.max_size:
+                    break
+                self._drop(file_hash)
+                size -= file_size
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_local_store(config: Config) -> Optional[LocalStore]:
+    """\
+    opens the store configured in `config`, `None` if there is none or it can not be opened
+    """
+    if config.local_store is None:
+        return None
+    root = Path(config.local_store.path).expanduser()
+    try:
+        max_size = parse_size(config.local_store.max_size) if config.local_store.max_size is not None else None
+        return LocalStore(root, max_size=max_size)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        logger.warning(f"could not open local store {root}, downloading without it: {e}")
+        return None
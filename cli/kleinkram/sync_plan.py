@@ -0,0 +1,320 @@
+"""\
+incremental sync between a local directory and missions
+
+the local directory has the nested layout of `klein download --nested`,
+i.e. `<root>/<project>/<mission>/<file>`, a manifest in the root remembers
+what the last sync saw on both sides:
+
+- files whose local size and mtime did not change since the last sync are
+  compared with the remote file by id, `updated_at` and hash, without
+  hashing the local file
+- missions whose remote file count, size and `updated_at` and whose local
+  directory did not change since the last complete sync are skipped
+  entirely, neither listed nor stat'ed
+
+files are never deleted, files that changed on both sides or only locally
+are reported as conflicts and left alone, uploads only add new files
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+from dataclasses import dataclass
+from dataclasses import field
+from enum import Enum
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from uuid import UUID
+
+from rich.console import Console
+
+from kleinkram.api.file_transfer import PART_STATE_SUFFIX
+from kleinkram.api.file_transfer import PART_SUFFIX
+from kleinkram.hash_cache import cached_b64_md5
+from kleinkram.models import File
+from kleinkram.models import FileState
+from kleinkram.models import Mission
+from kleinkram.utils import SUPPORT_FILE_TYPES
+from kleinkram.utils import file_paths_from_files
+from kleinkram.utils import get_filename
+from kleinkram.utils import sanitize_path_component
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".kleinkram-sync.json"
+MANIFEST_VERSION = 1
+
+
+class SyncDirection(str, Enum):
+    DOWNLOAD = "download"
+    UPLOAD = "upload"
+    BOTH = "both"
+
+
+class ManifestEntry(NamedTuple):
+    """\
+    a file as it was after the last sync, `mtime_ns` and `size` are local
+    """
+
+    file_id: str
+    hash: Optional[str]
+    size: int
+    mtime_ns: int
+    updated_at: str
+
+
+class MissionEntry(NamedTuple):
+    """\
+    a mission after its last complete sync
+    """
+
+    number_of_files: int
+    size: int
+    updated_at: str
+    dir_mtime_ns: int
+
+
+class SyncManifest:
+    """\
+    what the last sync saw, stored as json in the synced directory,
+    paths are relative to the directory
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.path = root / MANIFEST_NAME
+        self.files: Dict[str, ManifestEntry] = {}
+        self.missions: Dict[str, MissionEntry] = {}
+
+    @classmethod
+    def load(cls, root: Path) -> SyncManifest:
+        manifest = cls(root)
+        if not manifest.path.exists():
+            return manifest
+        try:
+            dct = json.loads(manifest.path.read_text())
+            if dct.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"unsupported version {dct.get('version')}")
+            manifest.files = {key: ManifestEntry(**value) for key, value in dct["files"].items()}
+            manifest.missions = {key: MissionEntry(**value) for key, value in dct["missions"].items()}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"ignoring invalid sync manifest {manifest.path}: {e}")
+            manifest.files, manifest.missions = {}, {}
+        return manifest
+
+    def save(self) -> None:
+        dct = {
+            "version": MANIFEST_VERSION,
+            "files": {key: value._asdict() for key, value in sorted(self.files.items())},
+            "missions": {key: value._asdict() for key, value in sorted(self.missions.items())},
+        }
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(dct, indent=1))
+        os.replace(tmp, self.path)
+
+    def key(self, path: Path) -> str:
+        return path.relative_to(self.root).as_posix()
+
+
+@dataclass
+class SyncPlan:
+    """\
+    what a sync does, `uploads` are file names and paths by mission id
+    """
+
+    downloads: Dict[Path, File] = field(default_factory=dict)
+    uploads: Dict[UUID, Dict[str, Path]] = field(default_factory=dict)
+    in_sync: Dict[Path, File] = field(default_factory=dict)
+    conflicts: Dict[Path, str] = field(default_factory=dict)
+    ignored: Dict[Path, str] = field(default_factory=dict)
+    skipped_missions: List[Mission] = field(default_factory=list)
+    # missions that can not be marked as complete after this sync
+    pending_missions: Set[UUID] = field(default_factory=set)
+
+    @property
+    def n_uploads(self) -> int:
+        return sum(len(files) for files in self.uploads.values())
+
+
+def mission_dir(root: Path, mission: Mission) -> Path:
+    return root / sanitize_path_component(mission.project_name) / sanitize_path_component(mission.name)
+
+
+def _dir_mtime_ns(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _mission_entry(root: Path, mission: Mission) -> Optional[MissionEntry]:
+    dir_mtime_ns = _dir_mtime_ns(mission_dir(root, mission))
+    if dir_mtime_ns is None:
+        return None
+    return MissionEntry(mission.number_of_files, mission.size, mission.updated_at.isoformat(), dir_mtime_ns)
+
+
+def unchanged_missions(root: Path, missions: Sequence[Mission], manifest: SyncManifest) -> Set[UUID]:
+    """\
+    the missions that did not change on either side since their last complete sync
+    """
+    ret = set()
+    for mission in missions:
+        entry = manifest.missions.get(str(mission.id))
+        if entry is not None and entry == _mission_entry(root, mission):
+            ret.add(mission.id)
+    return ret
+
+
+def _is_sync_file(path: Path) -> bool:
+    name = path.name
+    return path.is_file() and not name.startswith(".") and not name.endswith((PART_SUFFIX, PART_STATE_SUFFIX))
+
+
+def _local_file_matches(path: Path, file: File, *, rehash: bool) -> bool:
+    if path.stat().st_size != file.size:
+        return False
+    return file.hash is not None and cached_b64_md5(path, rehash=rehash) == file.hash
+
+
+def plan_sync(
+    root: Path,
+    missions: Sequence[Mission],
+    files: Sequence[File],
+    manifest: SyncManifest,
+    *,
+    direction: SyncDirection = SyncDirection.BOTH,
+    overwrite: bool = False,
+    rehash: bool = False,
+) -> SyncPlan:
+    """\
+    compares the files of `missions` with their local directories
+
+    `files` are the remote files of the missions, with `overwrite` local files
+    that changed are replaced by the remote files instead of being reported
+    """
+    plan = SyncPlan()
+    download = direction in (SyncDirection.DOWNLOAD, SyncDirection.BOTH)
+    upload = direction in (SyncDirection.UPLOAD, SyncDirection.BOTH)
+
+    remote = file_paths_from_files(files, dest=root, allow_nested=True)
+    for path, file in remote.items():
+        if file.state != FileState.OK:
+            plan.pending_missions.add(file.mission_id)
+            continue
+        entry = manifest.files.get(manifest.key(path))
+
+        if not path.exists():
+            if download:
+                plan.downloads[path] = file
+            continue
+
+        stat = path.stat()
+        if entry is not None and (entry.size, entry.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            # the local file did not change since the last sync
+            remote_unchanged = entry.file_id == str(file.id) and entry.updated_at == file.updated_at.isoformat()
+            if remote_unchanged or (file.hash is not None and entry.hash == file.hash):
+                plan.in_sync[path] = file
+            elif download:
+                plan.downloads[path] = file
+        elif _local_file_matches(path, file, rehash=rehash):
+            plan.in_sync[path] = file
+        elif download and overwrite:
+            plan.downloads[path] = file
+        else:
+            plan.conflicts[path] = "changed locally" if entry is not None else "differs from the remote file"
+
+    mission_dirs = {mission_dir(root, mission): mission.id for mission in missions}
+    for directory, mission_id in mission_dirs.items():
+        if not directory.is_dir():
+            continue
+        for path in sorted(filter(_is_sync_file, directory.iterdir())):
+            if path in remote:
+                continue
+            entry = manifest.files.get(manifest.key(path))
+            if entry is not None:
+                plan.conflicts[path] = "deleted remotely"
+            elif path.suffix not in SUPPORT_FILE_TYPES:
+                plan.ignored[path] = "unsupported file type"
+            elif get_filename(path) != path.name:
+                plan.ignored[path] = "file name is not supported, rename it to upload it"
+            elif upload:
+                plan.uploads.setdefault(mission_id, {})[path.name] = path
+
+    # conflicts stay until they are resolved, uploaded files change the mission
+    plan.pending_missions.update(mission_dirs[path.parent] for path in plan.conflicts if path.parent in mission_dirs)
+    plan.pending_missions.update(plan.uploads)
+    # one way syncs leave work for the other direction
+    if direction != SyncDirection.BOTH:
+        plan.pending_missions.update(mission_dirs.values())
+    return plan
+
+
+def record_sync(manifest: SyncManifest, plan: SyncPlan, missions: Sequence[Mission]) -> None:
+    """\
+    updates the manifest after the transfers of `plan` ran, files that failed
+    to download are left out, their missions are not marked as complete
+    """
+    synced = dict(plan.in_sync)
+    for path, file in plan.downloads.items():
+        if path.exists() and _local_file_matches(path, file, rehash=False):
+            synced[path] = file
+        else:
+            plan.pending_missions.add(file.mission_id)
+
+    for path, file in synced.items():
+        stat = path.stat()
+        manifest.files[manifest.key(path)] = ManifestEntry(
+            file_id=str(file.id),
+            hash=file.hash,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            updated_at=file.updated_at.isoformat(),
+        )
+
+    # forget files that are gone on both sides
+    for mission in missions:
+        prefix = manifest.key(mission_dir(manifest.root, mission)) + "/"
+        for key in [key for key in manifest.files if key.startswith(prefix)]:
+            path = manifest.root / key
+            if path not in synced and not path.exists():
+                del manifest.files[key]
+
+    for mission in missions:
+        entry = _mission_entry(manifest.root, mission)
+        if mission.id in plan.pending_missions or entry is None:
+            manifest.missions.pop(str(mission.id), None)
+        else:
+            manifest.missions[str(mission.id)] = entry
+
+
+def print_sync_plan(plan: SyncPlan, *, verbose: bool = False) -> None:
+    console = Console(file=sys.stderr)
+    if verbose:
+        for path in plan.downloads:
+            console.print(f"download {path}")
+        for files in plan.uploads.values():
+            for path in files.values():
+                console.print(f"upload {path}")
+        for path, reason in plan.ignored.items():
+            console.print(f"ignoring {path}, {reason}")
+    for path, reason in plan.conflicts.items():
+        console.print(f"[yellow]not syncing {path}, {reason}[/yellow]")
+
+    counts = {
+        "to download": len(plan.downloads),
+        "to upload": plan.n_uploads,
+        "in sync": len(plan.in_sync),
+        "conflicts": len(plan.conflicts),
+        "ignored": len(plan.ignored),
+    }
+    summary = ", ".join(f"{n} {what}" for what, n in counts.items())
+    console.print(f"Sync: {summary}, {len(plan.skipped_missions)} unchanged mission(s) skipped")
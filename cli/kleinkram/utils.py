@@ -9,6 +9,7 @@ import traceback
 from hashlib import md5
 from pathlib import Path
 from typing import Any
+from typing import BinaryIO
 from typing import Dict
 from typing import List
 from typing import Optional
@@ -127,12 +128,20 @@ def format_traceback(exc: Exception) -> str:
     return "".join(traceback.format_exception(type(exc), value=exc, tb=exc.__traceback__))
 
 
+_STYLED_STRING_CONSOLE: Optional[Console] = None
+
+
 def styled_string(*objects: Any, **kwargs: Any) -> str:
     """\
     accepts any object that Console.print can print
     returns the raw string output
     """
-    console = Console()
+    global _STYLED_STRING_CONSOLE
+
+    # creating a console is expensive, captures are per thread so it can be shared
+    if _STYLED_STRING_CONSOLE is None:
+        _STYLED_STRING_CONSOLE = Console()
+    console = _STYLED_STRING_CONSOLE
     with console.capture() as capture:
         console.print(*objects, **kwargs, end="")
     return capture.get()
@@ -205,6 +214,50 @@ def b64_md5(file: Path) -> str:
     return base64.b64encode(binary_digest).decode("utf-8")
 
 
+class HashingReader:
+    """\
+    wraps a binary file and computes its md5 hash while it is read
+
+    bytes are hashed the first time they are read, re-reads after seeking
+    back (e.g. when a request is retried) do not change the hash
+    """
+
+    def __init__(self, f: BinaryIO) -> None:
+        self._f = f
+        self._md5 = hashlib.md5()
+        self._hashed = 0
+
+    def read(self, size: int = -1) -> bytes:
+        start = self._f.tell()
+        data = self._f.read(size)
+        end = start + len(data)
+        if start <= self._hashed < end:
+            offset = self._hashed - start
+            self._md5.update(data[offset:])
+            self._hashed = end
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._f.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def b64_md5(self, size: int) -> Optional[str]:
+        """\
+        returns the hash if exactly the first `size` bytes were hashed
+        """
+        if self._hashed != size:
+            return None
+        return base64.b64encode(self._md5.digest()).decode("utf-8")
+
+
 def load_metadata(path: Path) -> Dict[str, str]:
     if not path.exists():
         raise FileNotFoundError(f"metadata file not found: {path}")
@@ -248,3 +301,43 @@ def format_bytes(size_bytes: int | float, speed: bool = False) -> str:
 
     unit_suffix = "/s" if speed else ""
     return f"{value:.2f} {units[unit_index]}{unit_suffix}"
+
+
+SIZE_UNITS = {
+    "": 1,
+    "B": 1,
+    "KB": 1000,
+    "MB": 1000**2,
+    "GB": 1000**3,
+    "TB": 1000**4,
+    "KIB": 1024,
+    "MIB": 1024**2,
+    "GIB": 1024**3,
+    "TIB": 1024**4,
+}
+
+
+def parse_size(s: str) -> int:
+    """\
+    parses a human-readable size like `64MB`, `1.5 GiB` or `1024` into bytes
+
+    decimal units (KB, MB, ...) use powers of 1000 like `format_bytes`,
+    binary units (KiB, MiB, ...) use powers of 1024
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d*)?)\s*([a-zA-Z]*)\s*", s)
+    if match is None or match.group(2).upper() not in SIZE_UNITS:
+        raise ValueError(f"invalid size: {s!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def parse_rate(s: str) -> int:
+    """\
+    parses a human-readable rate like `50MB/s` or `50MB` into bytes per second
+    """
+    size = s.strip()
+    if size.lower().endswith("/s"):
+        size = size[:-2]
+    try:
+        return parse_size(size)
+    except ValueError:
+        raise ValueError(f"invalid rate: {s!r}")
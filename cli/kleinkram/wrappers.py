@@ -16,19 +16,30 @@ from typing import List
 from typing import Literal
 from typing import Optional
 from typing import Sequence
+from typing import Union
 from typing import overload
 
+import kleinkram.api.inspection
 import kleinkram.api.routes
 import kleinkram.core
 import kleinkram.utils
 from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.file_transfer import DEFAULT_DOWNLOAD_CONNECTIONS
+from kleinkram.api.file_transfer import MultipartConfig
+from kleinkram.api.partial_download import McapFilter
 from kleinkram.api.query import FileQuery
 from kleinkram.api.query import MissionQuery
 from kleinkram.api.query import ProjectQuery
+from kleinkram.api.scheduling import DEFAULT_SCHEDULE
+from kleinkram.api.scheduling import TransferSchedule
 from kleinkram.errors import FileNameNotSupported
+from kleinkram.mcap import TimeBound
 from kleinkram.models import File
 from kleinkram.models import Mission
 from kleinkram.models import Project
+from kleinkram.models import RecordingInfo
+from kleinkram.sync_plan import SyncDirection
+from kleinkram.sync_plan import SyncPlan
 from kleinkram.types import IdLike
 from kleinkram.types import PathLike
 from kleinkram.utils import parse_path_like
@@ -132,7 +143,35 @@ def download(
     overwrite: bool = False,
     allow_corrupt_files: bool = False,
     verbose: bool = False,
+    rehash: bool = False,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+    schedule: Union[TransferSchedule, str] = DEFAULT_SCHEDULE,
+    check_disk_space: bool = True,
+    local_store: bool = True,
+    topics: Optional[Sequence[str]] = None,
+    start: Optional[TimeBound] = None,
+    end: Optional[TimeBound] = None,
 ) -> None:
+    """\
+    download files, `n_workers` files are downloaded in parallel,
+    by default this adapts to the throughput,
+    `max_rate` limits the bandwidth in bytes per second,
+    large files are downloaded over up to `connections` connections each,
+    `schedule` is one of `largest-first`, `mixed` or `in-order`,
+    `check_disk_space` fails early if the files do not fit on the disk,
+    `local_store` reuses files from the local store in the config, if any
+
+    if `topics` (names or glob patterns), `start` or `end` are given, only
+    the matching messages of mcap files are downloaded to `<name>.filtered.mcap`,
+    `start` and `end` are seconds since the first message or datetimes
+    """
+    _verify_string_sequence("topics", topics)
+    mcap_filter = None
+    if topics is not None or start is not None or end is not None:
+        mcap_filter = McapFilter(topics=topics, start=start, end=end)
+
     query = _args_to_file_query(
         file_names=file_names,
         file_ids=file_ids,
@@ -150,6 +189,64 @@ def download(
         overwrite=overwrite,
         verbose=verbose,
         allow_corrupt_files=allow_corrupt_files,
+        rehash=rehash,
+        n_workers=n_workers,
+        max_rate=max_rate,
+        connections=connections,
+        schedule=TransferSchedule(schedule),
+        check_disk_space=check_disk_space,
+        local_store=local_store,
+        mcap_filter=mcap_filter,
+    )
+
+
+def sync(
+    *,
+    dest: PathLike,
+    mission_ids: Optional[Sequence[IdLike]] = None,
+    mission_names: Optional[Sequence[str]] = None,
+    project_ids: Optional[Sequence[IdLike]] = None,
+    project_names: Optional[Sequence[str]] = None,
+    direction: Union[SyncDirection, str] = SyncDirection.BOTH,
+    overwrite: bool = False,
+    full: bool = False,
+    dry_run: bool = False,
+    verbose: bool = False,
+    rehash: bool = False,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    connections: int = DEFAULT_DOWNLOAD_CONNECTIONS,
+) -> SyncPlan:
+    """\
+    sync a local directory with missions, the directory has the layout of
+    `download(..., nested=True)`, returns what was transferred
+
+    `direction` is one of `download`, `upload` or `both`, missions that did
+    not change since the last sync are skipped unless `full` is set,
+    with `dry_run` nothing is transferred
+    """
+    if not (project_ids or project_names):
+        raise ValueError("a project is required to sync")
+    query = _args_to_mission_query(
+        mission_names=mission_names,
+        mission_ids=mission_ids,
+        project_names=project_names,
+        project_ids=project_ids,
+    )
+    client = AuthenticatedClient()
+    return kleinkram.core.sync(
+        client=client,
+        query=query,
+        root=parse_path_like(dest),
+        direction=SyncDirection(direction),
+        overwrite=overwrite,
+        full=full,
+        dry_run=dry_run,
+        verbose=verbose,
+        rehash=rehash,
+        n_workers=n_workers,
+        max_rate=max_rate,
+        connections=connections,
     )
 
 
@@ -215,6 +312,12 @@ def upload(
     metadata: Optional[Dict[str, str]] = None,
     ignore_missing_metadata: bool = False,
     verbose: bool = False,
+    part_size: Optional[int] = None,
+    part_concurrency: Optional[int] = None,
+    multipart_threshold: Optional[int] = None,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    schedule: Union[TransferSchedule, str] = DEFAULT_SCHEDULE,
 ) -> None: ...
 
 
@@ -226,6 +329,12 @@ def upload(
     create: Literal[False] = False,
     fix_filenames: bool = False,
     verbose: bool = False,
+    part_size: Optional[int] = None,
+    part_concurrency: Optional[int] = None,
+    multipart_threshold: Optional[int] = None,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    schedule: Union[TransferSchedule, str] = DEFAULT_SCHEDULE,
 ) -> None: ...
 
 
@@ -240,6 +349,12 @@ def upload(
     metadata: Optional[Dict[str, str]] = None,
     ignore_missing_metadata: bool = False,
     verbose: bool = False,
+    part_size: Optional[int] = None,
+    part_concurrency: Optional[int] = None,
+    multipart_threshold: Optional[int] = None,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    schedule: Union[TransferSchedule, str] = DEFAULT_SCHEDULE,
 ) -> None: ...
 
 
@@ -255,7 +370,24 @@ def upload(
     metadata: Optional[Dict[str, str]] = None,
     ignore_missing_metadata: bool = False,
     verbose: bool = False,
+    part_size: Optional[int] = None,
+    part_concurrency: Optional[int] = None,
+    multipart_threshold: Optional[int] = None,
+    n_workers: Optional[int] = None,
+    max_rate: Optional[int] = None,
+    schedule: Union[TransferSchedule, str] = DEFAULT_SCHEDULE,
 ) -> None:
+    """\
+    upload files to a mission
+
+    `part_size`, `part_concurrency` and `multipart_threshold` tune multipart
+    uploads of large files, sizes are in bytes, by default they are derived
+    from the size of each file
+
+    `n_workers` files are uploaded in parallel, by default this adapts to the throughput,
+    `max_rate` limits the bandwidth in bytes per second,
+    `schedule` is one of `largest-first`, `mixed` or `in-order`
+    """
     parsed_file_paths = [parse_path_like(f) for f in files]
     if not fix_filenames:
         for file in parsed_file_paths:
@@ -281,6 +413,14 @@ def upload(
         metadata=metadata,
         ignore_missing_metadata=ignore_missing_metadata,
         verbose=verbose,
+        multipart=MultipartConfig(
+            part_size=part_size,
+            concurrency=part_concurrency,
+            threshold=multipart_threshold,
+        ),
+        n_workers=n_workers,
+        max_rate=max_rate,
+        schedule=TransferSchedule(schedule),
     )
 
 
@@ -291,6 +431,7 @@ def verify(
     project_name: str,
     files: Sequence[PathLike],
     verbose: bool = False,
+    rehash: bool = False,
 ) -> Dict[Path, kleinkram.core.FileVerificationStatus]: ...
 
 
@@ -301,6 +442,7 @@ def verify(
     project_id: IdLike,
     files: Sequence[PathLike],
     verbose: bool = False,
+    rehash: bool = False,
 ) -> Dict[Path, kleinkram.core.FileVerificationStatus]: ...
 
 
@@ -310,6 +452,7 @@ def verify(
     mission_id: IdLike,
     files: Sequence[PathLike],
     verbose: bool = False,
+    rehash: bool = False,
 ) -> Dict[Path, kleinkram.core.FileVerificationStatus]: ...
 
 
@@ -322,6 +465,7 @@ def verify(
     files: Sequence[PathLike],
     skip_hash: bool = False,
     verbose: bool = False,
+    rehash: bool = False,
 ) -> Dict[Path, kleinkram.core.FileVerificationStatus]:
     query = _args_to_mission_query(
         mission_names=singleton_list(mission_name),
@@ -338,6 +482,7 @@ def verify(
         file_paths=[parse_path_like(f) for f in files],
         skip_hash=skip_hash,
         verbose=verbose,
+        rehash=rehash,
     )
 
 
@@ -406,11 +551,26 @@ def delete_project(project_id: IdLike) -> None:
     kleinkram.core.delete_project(client=AuthenticatedClient(), project_id=parse_uuid_like(project_id))
 
 
-def get_file(file_id: IdLike) -> File:
+def get_file(file_id: IdLike, *, inspect: bool = False) -> File:
     """\
-    get a file by its id
+    get a file by its id, with `inspect` the topics of mcap and ros1 bag files
+    are read from the index of the file
     """
-    return kleinkram.api.routes.get_file(AuthenticatedClient(), FileQuery(ids=[parse_uuid_like(file_id)]))
+    client = AuthenticatedClient()
+    file = kleinkram.api.routes.get_file(client, FileQuery(ids=[parse_uuid_like(file_id)]))
+    if inspect:
+        file = kleinkram.api.inspection.with_topics(file, kleinkram.api.inspection.inspect_file(client, file))
+    return file
+
+
+def get_recording_info(file_id: IdLike) -> RecordingInfo:
+    """\
+    get the topics, message counts and time span of a mcap or ros1 bag file,
+    only the index of the file is downloaded
+    """
+    client = AuthenticatedClient()
+    file = kleinkram.api.routes.get_file(client, FileQuery(ids=[parse_uuid_like(file_id)]))
+    return kleinkram.api.inspection.inspect_file(client, file)
 
 
 def get_mission(mission_id: IdLike) -> Mission:
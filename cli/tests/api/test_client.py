@@ -6,9 +6,12 @@ from tempfile import TemporaryDirectory
 import httpx
 import pytest
 
+import kleinkram.api.client
 import kleinkram.errors
 from kleinkram._version import __version__
 from kleinkram.api.client import CLI_VERSION_HEADER
+from kleinkram.api.client import UPLOAD_CONFIRM
+from kleinkram.api.client import UPLOAD_CREDS
 from kleinkram.api.client import AuthenticatedClient
 from kleinkram.api.client import _convert_list_data_query_params_values
 from kleinkram.api.client import _convert_nested_data_query_params_values
@@ -62,6 +65,22 @@ def test_client_response_on_426_status_code(empty_config):
             client.get("/example")
 
 
+def test_client_expires_metadata_cache_on_writes(empty_config, monkeypatch):
+    expired = []
+    monkeypatch.setattr(kleinkram.api.client, "expire_metadata_cache", expired.append)
+
+    with AuthenticatedClient(config_path=empty_config, transport=httpx.MockTransport(mock_transport)) as client:
+        client.get("/files")
+        assert expired == []
+        client.post("/files/delete")
+        assert expired == [client.config]
+
+        # the handshakes of single uploads do not
+        client.post(UPLOAD_CREDS)
+        client.post(UPLOAD_CONFIRM)
+        assert expired == [client.config]
+
+
 def test_convert_query_params_httpx_format():
     params = {
         "foo": ["foo1", "foo2"],
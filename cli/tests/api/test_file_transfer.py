@@ -0,0 +1,861 @@
+from __future__ import annotations
+
+import base64
+import errno
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import Future
+from dataclasses import replace
+from threading import Lock
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from uuid import uuid4
+
+import httpx
+import pytest
+
+import kleinkram.api.client
+import kleinkram.api.file_transfer
+import kleinkram.api.journal
+import kleinkram.hash_cache
+from kleinkram.api.client import AuthenticatedClient
+from kleinkram.api.file_transfer import DEFAULT_MAX_BUFFERED_BYTES
+from kleinkram.api.file_transfer import DEFAULT_MAX_PART_CONCURRENCY
+from kleinkram.api.file_transfer import DEFAULT_MIN_PART_SIZE
+from kleinkram.api.file_transfer import DOWNLOAD_URL
+from kleinkram.api.file_transfer import DOWNLOAD_URL_REFRESH_MARGIN
+from kleinkram.api.file_transfer import MB
+from kleinkram.api.file_transfer import S3_MAX_PARTS
+from kleinkram.api.file_transfer import S3_MIN_PART_SIZE
+from kleinkram.api.file_transfer import UPLOAD_CANCEL
+from kleinkram.api.file_transfer import UPLOAD_CONFIRM
+from kleinkram.api.file_transfer import UPLOAD_CREDS
+from kleinkram.api.file_transfer import DownloadState
+from kleinkram.api.file_transfer import DownloadUrls
+from kleinkram.api.file_transfer import MultipartConfig
+from kleinkram.api.file_transfer import UploadHandshake
+from kleinkram.api.file_transfer import _check_disk_space
+from kleinkram.api.file_transfer import _download_handler
+from kleinkram.api.file_transfer import _DownloadHasher
+from kleinkram.api.file_transfer import _get_transfer_config
+from kleinkram.api.file_transfer import _RangesNotSupported
+from kleinkram.api.file_transfer import _remember_workers
+from kleinkram.api.file_transfer import _url_download
+from kleinkram.api.file_transfer import download_file
+from kleinkram.api.file_transfer import download_files
+from kleinkram.api.file_transfer import upload_files
+from kleinkram.api.journal import UploadJournal
+from kleinkram.api.rate_limit import RateLimiter
+from kleinkram.api.transport import S3DownloadPool
+from kleinkram.api.transport import S3Transport
+from kleinkram.api.workers import AdaptiveWorkers
+from kleinkram.config import Config
+from kleinkram.config import Credentials
+from kleinkram.config import get_config
+from kleinkram.config import get_transfer_workers
+from kleinkram.config import save_config
+from kleinkram.errors import InsufficientDiskSpace
+from kleinkram.hash_cache import HashCache
+from kleinkram.store import LocalStore
+from kleinkram.utils import b64_md5
+from tests.helpers import FakeClock
+from tests.helpers import make_file
+
+GB = 1024 * MB
+
+
+def test_get_transfer_config_small_file() -> None:
+    config = _get_transfer_config(1 * MB)
+    assert config.multipart_chunksize == DEFAULT_MIN_PART_SIZE
+    assert config.max_request_concurrency == 1
+    assert not config.use_threads
+
+
+@pytest.mark.parametrize("size", [1 * GB, 100 * GB, 5000 * GB])
+def test_get_transfer_config_large_file(size: int) -> None:
+    config = _get_transfer_config(size)
+    assert config.multipart_chunksize * S3_MAX_PARTS >= size
+    assert 1 <= config.max_request_concurrency <= DEFAULT_MAX_PART_CONCURRENCY
+    assert config.max_in_memory_upload_chunks == config.max_request_concurrency
+
+    if config.max_request_concurrency > 1:
+        assert config.max_request_concurrency * config.multipart_chunksize <= DEFAULT_MAX_BUFFERED_BYTES
+
+
+def test_get_transfer_config_overrides() -> None:
+    multipart = MultipartConfig(part_size=64 * MB, concurrency=32, threshold=1 * MB)
+    config = _get_transfer_config(100 * GB, multipart)
+    assert config.multipart_chunksize == 64 * MB
+    assert config.max_request_concurrency == 32
+    assert config.multipart_threshold == 1 * MB
+
+
+def test_get_transfer_config_respects_s3_limits() -> None:
+    config = _get_transfer_config(10 * MB, MultipartConfig(part_size=1))
+    assert config.multipart_chunksize == S3_MIN_PART_SIZE
+
+    config = _get_transfer_config(1000 * GB, MultipartConfig(part_size=S3_MIN_PART_SIZE))
+    assert config.multipart_chunksize * S3_MAX_PARTS >= 1000 * GB
+
+
+class FakeBackend:
+    """\
+    mimics the upload handshake endpoints of the backend
+    """
+
+    def __init__(self, existing: Set[str]) -> None:
+        self.existing = set(existing)
+        self.requests: List[Tuple[str, Dict[str, Any]]] = []
+        self.file_names: Dict[str, str] = {}
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append((request.url.path, body))
+
+        if request.url.path == UPLOAD_CREDS:
+            conflicts = [
+                {"filename": name, "error": "File already exists"} for name in body["filenames"] if name in self.existing
+            ]
+            if conflicts:
+                return httpx.Response(409, json={"message": "Files already exist", "errors": conflicts})
+            data = []
+            for name in body["filenames"]:
+                file_id = str(uuid4())
+                self.file_names[file_id] = name
+                self.existing.add(name)
+                data.append(
+                    {
+                        "bucket": "bucket",
+                        "fileUUID": file_id,
+                        "fileName": name,
+                        "accessCredentials": {"accessKey": "a", "secretKey": "s", "sessionToken": "t"},
+                    }
+                )
+            return httpx.Response(200, json={"data": data, "count": len(data), "skip": 0, "take": len(data)})
+        if request.url.path == UPLOAD_CANCEL:
+            for file_id in body["uuids"]:
+                self.existing.discard(self.file_names[file_id])
+        return httpx.Response(200, json={"success": True})
+
+    def paths(self) -> List[str]:
+        return [path for path, _ in self.requests]
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / ".kleinkram.json"
+    config = Config(endpoint_credentials={"local": Credentials(api_key="test")}, selected_endpoint="local")
+    save_config(config, path)
+    return path
+
+
+@pytest.fixture
+def files(tmp_path):
+    ret = {}
+    for idx in range(5):
+        path = tmp_path / f"file_{idx}.yaml"
+        path.write_text(f"file: {idx}")
+        ret[path.name] = path
+    return ret
+
+
+def test_upload_handshake_batches_credentials(config_path, files):
+    backend = FakeBackend(existing={"file_1.yaml"})
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+
+    handshake = UploadHandshake(client, uuid4(), files, batch_size=3)
+    creds = {name: handshake.credentials(name) for name in ["file_0.yaml", "file_1.yaml", "file_2.yaml"]}
+    assert creds["file_1.yaml"] is None
+    assert creds["file_0.yaml"] is not None and creds["file_2.yaml"] is not None
+
+    handshake.confirm("file_0.yaml", creds["file_0.yaml"].file_id, "hash")
+    handshake.confirm("file_2.yaml", creds["file_2.yaml"].file_id, "hash")
+    assert handshake.close() == {}
+
+    # one conflict + retry for the first window, the second window is prefetched
+    assert backend.paths().count(UPLOAD_CREDS) == 3
+    assert backend.paths().count(UPLOAD_CONFIRM) == 2
+
+    # the prefetched but unused credentials are canceled in a single request
+    cancels = [body for path, body in backend.requests if path == UPLOAD_CANCEL]
+    assert len(cancels) == 1
+    assert {backend.file_names[file_id] for file_id in cancels[0]["uuids"]} == {"file_3.yaml", "file_4.yaml"}
+
+
+def test_upload_handshake_reports_confirm_failures(config_path, files):
+    backend = FakeBackend(existing=set())
+
+    def failing_confirm(request: httpx.Request) -> httpx.Response:
+        if request.url.path == UPLOAD_CONFIRM:
+            return httpx.Response(500)
+        return backend(request)
+
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(failing_confirm))
+    handshake = UploadHandshake(client, uuid4(), {"file_0.yaml": files["file_0.yaml"]})
+    creds = handshake.credentials("file_0.yaml")
+    assert creds is not None
+    handshake.confirm("file_0.yaml", creds.file_id, "hash")
+
+    failures = handshake.close()
+    assert isinstance(failures["file_0.yaml"], httpx.HTTPStatusError)
+
+
+def test_upload_handshake_renew_asks_once(config_path, files, monkeypatch):
+    backend = FakeBackend(existing={"file_0.yaml"})
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+    monkeypatch.setattr(kleinkram.api.file_transfer, "sleep", lambda delay: pytest.fail("renew must not back off"))
+
+    handshake = UploadHandshake(client, uuid4(), {})
+    assert handshake.renew("file_0.yaml") is None
+    assert backend.paths() == [UPLOAD_CREDS]
+    assert handshake.renew("file_1.yaml") is not None
+    assert handshake.close() == {}
+
+
+@pytest.fixture
+def hash_cache(tmp_path, monkeypatch):
+    cache = HashCache(tmp_path / "hashes.sqlite")
+    monkeypatch.setattr(kleinkram.hash_cache, "_HASH_CACHE", cache)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    journal = UploadJournal(tmp_path / "uploads.sqlite")
+    monkeypatch.setattr(kleinkram.api.journal, "_UPLOAD_JOURNAL", journal)
+    yield journal
+    journal.close()
+
+
+def test_upload_files(config_path, files, hash_cache, journal, monkeypatch):
+    backend = FakeBackend(existing={"file_1.yaml"})
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+
+    uploaded: List[bytes] = []
+
+    def upload_fileobj(self, fileobj, **kwargs):
+        # read twice to mimic a retried request
+        fileobj.read(3)
+        fileobj.seek(0)
+        uploaded.append(fileobj.read())
+
+    monkeypatch.setattr(S3Transport, "upload_fileobj", upload_fileobj)
+    expired = []
+    monkeypatch.setattr(kleinkram.api.client, "expire_metadata_cache", expired.append)
+    monkeypatch.setattr(kleinkram.api.file_transfer, "expire_metadata_cache", expired.append)
+
+    upload_files(client, files, uuid4(), s3_endpoint="http://localhost:9000")
+
+    # the metadata cache is expired once for the whole upload
+    assert expired == [client.config]
+    expected = {name for name in files if name != "file_1.yaml"}
+    assert sorted(uploaded) == sorted(files[name].read_bytes() for name in expected)
+    assert UPLOAD_CANCEL not in backend.paths()
+
+    confirms = {backend.file_names[body["uuid"]]: body["md5"] for path, body in backend.requests if path == UPLOAD_CONFIRM}
+    assert confirms == {name: b64_md5(files[name]) for name in expected}
+
+    # hashes computed during the upload end up in the hash cache
+    assert {name: hash_cache.get(files[name]) for name in expected} == confirms
+
+
+class FakeMultipartS3:
+    """\
+    mimics the multipart calls of `S3Transport`, `fail_part` fails on every attempt
+    """
+
+    def __init__(self, fail_part: Optional[int] = None) -> None:
+        self.fail_part = fail_part
+        self.uploads: Dict[str, Dict[int, bytes]] = {}
+        self.completed: Dict[str, bytes] = {}
+        self.sent_parts: List[int] = []
+
+    def create_multipart_upload(self, credentials):
+        upload_id = str(uuid4())
+        self.uploads[upload_id] = {}
+        return upload_id
+
+    def upload_part(self, credentials, upload_id, part_number, body, *, callbacks=()):
+        if part_number == self.fail_part:
+            raise ConnectionError("uplink lost")
+        for callback in callbacks:
+            callback(len(body))
+        self.sent_parts.append(part_number)
+        self.uploads[upload_id][part_number] = body
+        return f'"{part_number}"'
+
+    def list_parts(self, credentials, upload_id):
+        return {n: f'"{n}"' for n in self.uploads[upload_id]}
+
+    def complete_multipart_upload(self, credentials, upload_id, parts):
+        uploaded = self.uploads.pop(upload_id)
+        assert sorted(parts) == sorted(uploaded)
+        self.completed[str(credentials.file_id)] = b"".join(uploaded[n] for n in sorted(uploaded))
+
+    def patch(self, monkeypatch) -> None:
+        for name in ["create_multipart_upload", "upload_part", "list_parts", "complete_multipart_upload"]:
+            method = getattr(self, name)
+            monkeypatch.setattr(S3Transport, name, lambda _, *args, _method=method, **kwargs: _method(*args, **kwargs))
+
+
+def test_remember_workers_ignores_sessions_with_errors(config_path):
+    client = AuthenticatedClient(config_path=config_path)
+
+    workers = AdaptiveWorkers(8)
+    workers.record_error()
+    _remember_workers(client, workers, None)
+    assert get_transfer_workers(get_config(path=config_path)) is None
+
+    _remember_workers(client, AdaptiveWorkers(8), None)
+    assert get_transfer_workers(get_config(path=config_path)) == 8
+
+
+def test_upload_files_largest_first(config_path, tmp_path, hash_cache, journal, monkeypatch):
+    files = {}
+    for name, size in [("small.yaml", 10), ("large.yaml", 1000), ("medium.yaml", 100)]:
+        files[name] = tmp_path / name
+        files[name].write_bytes(os.urandom(size))
+    backend = FakeBackend(existing=set())
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+
+    uploaded: List[int] = []
+    monkeypatch.setattr(S3Transport, "upload_fileobj", lambda self, fileobj, **_: uploaded.append(len(fileobj.read())))
+
+    upload_files(client, files, uuid4(), n_workers=1, s3_endpoint="http://localhost:9000")
+    assert uploaded == [1000, 100, 10]
+
+
+def test_upload_files_resumes_interrupted_multipart_upload(config_path, tmp_path, hash_cache, journal, monkeypatch):
+    path = tmp_path / "large.bag"
+    path.write_bytes(os.urandom(4 * S3_MIN_PART_SIZE + 123))
+    files = {path.name: path}
+    mission_id = uuid4()
+    multipart = MultipartConfig(part_size=S3_MIN_PART_SIZE, concurrency=2)
+
+    backend = FakeBackend(existing=set())
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+
+    s3 = FakeMultipartS3(fail_part=3)
+    s3.patch(monkeypatch)
+
+    # every attempt fails on the same part, the upload is kept for later
+    upload_files(client, files, mission_id, multipart=multipart, s3_endpoint="http://localhost:9000")
+    entry = journal.get(mission_id, path.name)
+    assert entry is not None and entry.is_resumable(path)
+    assert sorted(entry.parts) == [1, 2, 4, 5]
+    assert UPLOAD_CANCEL not in backend.paths()
+    assert UPLOAD_CONFIRM not in backend.paths()
+
+    # a rerun only sends the missing part
+    s3.fail_part = None
+    s3.sent_parts.clear()
+    upload_files(client, files, mission_id, multipart=multipart, s3_endpoint="http://localhost:9000")
+    assert s3.sent_parts == [3]
+    assert journal.get(mission_id, path.name) is None
+    assert backend.paths().count(UPLOAD_CREDS) == 1
+
+    file_id = str(entry.credentials.file_id)
+    assert s3.completed == {file_id: path.read_bytes()}
+    confirms = [body for path_, body in backend.requests if path_ == UPLOAD_CONFIRM]
+    assert confirms == [{"uuid": file_id, "md5": b64_md5(path), "source": "CLI"}]
+
+
+def test_upload_files_restarts_changed_file(config_path, tmp_path, journal, monkeypatch):
+    path = tmp_path / "large.bag"
+    path.write_bytes(os.urandom(2 * S3_MIN_PART_SIZE + 1))
+    files = {path.name: path}
+    mission_id = uuid4()
+    multipart = MultipartConfig(part_size=S3_MIN_PART_SIZE)
+
+    backend = FakeBackend(existing=set())
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+
+    s3 = FakeMultipartS3(fail_part=2)
+    s3.patch(monkeypatch)
+
+    upload_files(client, files, mission_id, multipart=multipart, s3_endpoint="http://localhost:9000")
+    entry = journal.get(mission_id, path.name)
+    assert entry is not None
+
+    # the file changed, the old upload is canceled and the file is uploaded again
+    path.write_bytes(os.urandom(2 * S3_MIN_PART_SIZE + 1))
+    s3.fail_part = None
+    upload_files(client, files, mission_id, multipart=multipart, s3_endpoint="http://localhost:9000")
+
+    cancels = [body["uuids"] for path_, body in backend.requests if path_ == UPLOAD_CANCEL]
+    assert cancels == [[str(entry.credentials.file_id)]]
+    assert list(s3.completed.values()) == [path.read_bytes()]
+
+
+def test_upload_files_max_rate_throttles_parts(config_path, tmp_path, journal, monkeypatch):
+    path = tmp_path / "large.bag"
+    path.write_bytes(os.urandom(2 * S3_MIN_PART_SIZE + 1))
+    mission_id = uuid4()
+
+    backend = FakeBackend(existing=set())
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+    FakeMultipartS3().patch(monkeypatch)
+
+    consumed = []
+    monkeypatch.setattr(RateLimiter, "consume", lambda self, nbytes: consumed.append((self.rate(), nbytes)))
+
+    upload_files(
+        client,
+        {path.name: path},
+        mission_id,
+        multipart=MultipartConfig(part_size=S3_MIN_PART_SIZE),
+        s3_endpoint="http://localhost:9000",
+        max_rate=1000,
+    )
+    assert {rate for rate, _ in consumed} == {1000}
+    assert sum(nbytes for _, nbytes in consumed) == path.stat().st_size
+
+
+class FakeObjectStore:
+    """\
+    serves `data` with range requests, `fail_at` breaks the connection after
+    sending the byte at that offset
+    """
+
+    def __init__(self, data: bytes, *, fail_at: Optional[int] = None, ranges: bool = True) -> None:
+        self.data = data
+        self.fail_at = fail_at
+        self.ranges = ranges
+        self.requested: List[Tuple[int, int]] = []
+
+    def _body(self, start: int, end: int):
+        if self.fail_at is not None and start <= self.fail_at < end:
+            yield self.data[start : self.fail_at + 1]  # noqa: E203
+            raise httpx.ReadError("connection reset")
+        yield self.data[start:end]
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if not self.ranges:
+            return httpx.Response(200, content=self.data)
+        first, last = request.headers["Range"].removeprefix("bytes=").split("-")
+        start, end = int(first), int(last) + 1 if last else len(self.data)
+        self.requested.append((start, end))
+        return httpx.Response(206, stream=httpx.ByteStream(b"") if start >= end else _IterStream(self._body(start, end)))
+
+
+class _IterStream(httpx.SyncByteStream):
+    def __init__(self, it) -> None:
+        self._it = it
+
+    def __iter__(self):
+        yield from self._it
+
+
+@pytest.fixture
+def small_segments(monkeypatch):
+    monkeypatch.setattr(kleinkram.api.file_transfer, "SEGMENTED_DOWNLOAD_THRESHOLD", 2000)
+    monkeypatch.setattr(kleinkram.api.file_transfer, "DOWNLOAD_SEGMENT_SIZE", 1000)
+    monkeypatch.setattr(kleinkram.api.file_transfer, "DOWNLOAD_CHUNK_SIZE", 100)
+    monkeypatch.setattr(kleinkram.api.file_transfer, "sleep", lambda _: None)
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """\
+    routes the storage requests of downloads to a handler, `serve.clients`
+    are the http clients created since
+    """
+    client_cls = httpx.Client
+
+    def serve(handler) -> None:
+        serve.clients = []
+
+        def client(**kwargs: Any) -> httpx.Client:
+            serve.clients.append(client_cls(transport=httpx.MockTransport(handler), **kwargs))
+            return serve.clients[-1]
+
+        monkeypatch.setattr(httpx, "Client", client)
+
+    return serve
+
+
+def _download(path, data, **kwargs) -> str:
+    kwargs.setdefault("progress", lambda _: None)
+    return _url_download("http://s3/file", path=path, size=len(data), file_id=FILE_ID, remote_hash="hash", **kwargs)
+
+
+FILE_ID = uuid4()
+
+
+def _broken_after(store: FakeObjectStore, offset: int):
+    """\
+    the connection breaks at `offset` and the storage keeps failing after that
+    """
+    store.fail_at = offset - 1
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if int(request.headers["Range"].removeprefix("bytes=").split("-")[0]) >= offset:
+            return httpx.Response(500)
+        return store(request)
+
+    return handler
+
+
+def _leftovers(path) -> List[str]:
+    return sorted(p.name for p in path.parent.iterdir() if p != path)
+
+
+def test_segmented_download(tmp_path, small_segments, serve):
+    data = os.urandom(10_500)
+    store = FakeObjectStore(data)
+    serve(store)
+    path = tmp_path / "file.bag"
+
+    progress: List[int] = []
+    observed_hash = _download(path, data, connections=4, progress=progress.append)
+
+    assert path.read_bytes() == data
+    assert observed_hash == b64_md5(path)
+    assert sum(progress) == len(data)
+    assert sorted(store.requested) == [(start, min(start + 1000, len(data))) for start in range(0, len(data), 1000)]
+    assert _leftovers(path) == []
+
+
+def test_segmented_download_retries_failed_segment(tmp_path, small_segments, serve):
+    data = os.urandom(5000)
+    store = FakeObjectStore(data, fail_at=2499)
+    serve(store)
+    path = tmp_path / "file.bag"
+
+    observed_hash = _download(path, data, connections=2)
+
+    assert path.read_bytes() == data
+    assert observed_hash == b64_md5(path)
+    # only the failed segment is requested again, starting where it broke off
+    assert sorted(store.requested) == [(0, 1000), (1000, 2000), (2000, 3000), (2500, 3000), (3000, 4000), (4000, 5000)]
+
+
+def test_segmented_download_without_range_support(tmp_path, small_segments, serve):
+    data = os.urandom(5000)
+    serve(FakeObjectStore(data, ranges=False))
+    path = tmp_path / "file.bag"
+
+    # falls back to a single connection
+    progress: List[int] = []
+    observed_hash = _download(path, data, connections=2, progress=progress.append)
+    assert path.read_bytes() == data
+    assert observed_hash == b64_md5(path)
+    assert sum(progress) == len(data)
+
+
+def test_download_hasher_out_of_order(tmp_path):
+    data = os.urandom(1000)
+    path = tmp_path / "file.bin"
+    path.write_bytes(data)
+    chunks = [(offset, data[offset:][:100]) for offset in range(0, 1000, 100)]
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # everything fits into the buffer
+        hasher = _DownloadHasher(fd)
+        for offset, chunk in reversed(chunks):
+            hasher.update(offset, chunk)
+        assert hasher.hashed == 1000
+        assert hasher.b64_md5() == b64_md5(path)
+
+        # chunks that do not fit are read back from the file
+        hasher = _DownloadHasher(fd, max_buffered=200)
+        for offset, chunk in reversed(chunks):
+            hasher.update(offset, chunk)
+        assert hasher.hashed < 1000
+        hasher.catch_up(1000)
+        assert hasher.b64_md5() == b64_md5(path)
+    finally:
+        os.close(fd)
+
+
+def test_segmented_download_hash_with_small_buffer(tmp_path, small_segments, serve, monkeypatch):
+    monkeypatch.setattr(kleinkram.api.file_transfer, "DOWNLOAD_HASH_BUFFER_SIZE", 0)
+    data = os.urandom(10_500)
+    serve(FakeObjectStore(data))
+    path = tmp_path / "file.bag"
+
+    assert _download(path, data, connections=4) == b64_md5(path)
+
+
+@pytest.mark.parametrize("connections", [1, 4])
+def test_download_resumes_part_file(tmp_path, small_segments, serve, connections):
+    data = os.urandom(5000)
+    path = tmp_path / "file.bag"
+
+    # the download keeps failing in the middle, the written bytes are kept
+    serve(_broken_after(FakeObjectStore(data), 2500))
+    with pytest.raises(RuntimeError):
+        _download(path, data, connections=connections)
+    assert not path.exists()
+    assert _leftovers(path) == ["file.bag.part", "file.bag.part.json"]
+
+    # the next run only downloads the missing bytes
+    store = FakeObjectStore(data)
+    serve(store)
+    progress: List[int] = []
+    observed_hash = _download(path, data, connections=connections, progress=progress.append)
+
+    assert path.read_bytes() == data
+    assert observed_hash == b64_md5(path)
+    assert sum(progress) == len(data)
+    # the resumed bytes are reported first and not downloaded again, segments
+    # that were cancelled when another one failed continue where they stopped
+    resumed = progress[0]
+    assert resumed > 0
+    assert sum(end - start for start, end in store.requested) == len(data) - resumed
+    assert _leftovers(path) == []
+
+
+@pytest.mark.parametrize("change", [{"file_id": uuid4()}, {"remote_hash": "other"}, {"file_id": None}])
+def test_download_restarts_foreign_part_file(tmp_path, small_segments, serve, change):
+    data = os.urandom(5000)
+    path = tmp_path / "file.bag"
+
+    serve(_broken_after(FakeObjectStore(data), 2500))
+    with pytest.raises(RuntimeError):
+        _download(path, data, connections=1)
+
+    store = FakeObjectStore(data)
+    serve(store)
+    kwargs = {"file_id": FILE_ID, "remote_hash": "hash", **change}
+    _url_download("http://s3/file", path=path, size=len(data), progress=lambda _: None, connections=1, **kwargs)
+    assert store.requested == [(0, 5000)]
+    assert path.read_bytes() == data
+
+
+def test_download_does_not_touch_existing_file(tmp_path, small_segments, serve):
+    data = os.urandom(5000)
+    serve(FakeObjectStore(data))
+    path = tmp_path / "file.bag"
+    path.write_bytes(b"old")
+
+    with pytest.raises(FileExistsError):
+        _download(path, data)
+    assert path.read_bytes() == b"old"
+
+    _download(path, data, overwrite=True)
+    assert path.read_bytes() == data
+
+
+class FakeDownloadBackend:
+    """\
+    issues presigned urls that are valid for `lifetime` seconds
+    """
+
+    def __init__(self, lifetime: int = 900) -> None:
+        self.lifetime = lifetime
+        self.issued: List[str] = []
+        self._lock = Lock()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        assert request.url.path == DOWNLOAD_URL
+        with self._lock:
+            file_id = request.url.params["uuid"]
+            url = f"http://s3/{file_id}?X-Amz-Expires={self.lifetime}&n={len(self.issued)}"
+            self.issued.append(file_id)
+        return httpx.Response(200, json={"url": url})
+
+
+def test_download_file_uses_local_store(config_path, tmp_path, small_segments, serve):
+    data = os.urandom(5000)
+    file = replace(make_file("a", len(data)), hash=base64.b64encode(hashlib.md5(data).digest()).decode())
+    backend = FakeDownloadBackend()
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+    serve(FakeObjectStore(data))
+    store = LocalStore(tmp_path / "store")
+
+    try:
+        # the first download fills the store
+        first = tmp_path / "first" / "a.bag"
+        state, _ = download_file(client, file=file, path=first, create_parents=True, store=store)
+        assert state == DownloadState.DOWNLOADED_OK
+        assert store.get(file.hash) is not None
+
+        # later ones do not touch the storage
+        serve(lambda request: httpx.Response(500))
+        second = tmp_path / "second" / "a.bag"
+        state, size = download_file(client, file=file, path=second, create_parents=True, store=store)
+        assert state == DownloadState.LINKED_FROM_STORE
+        assert size == len(data)
+        assert second.read_bytes() == data
+        assert backend.issued == [str(file.id)]
+    finally:
+        store.close()
+
+
+def test_download_handler_store_hit(tmp_path, capsys):
+    file = make_file("a.bag", 5000)
+    future: Future[Tuple[DownloadState, int]] = Future()
+    future.set_result((DownloadState.LINKED_FROM_STORE, file.size))
+
+    assert _download_handler(future, file, tmp_path / "a.bag", verbose=False) == 5000
+    assert capsys.readouterr().err == ""
+
+
+def test_download_urls_prefetch(config_path):
+    backend = FakeDownloadBackend()
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+    file_ids = [uuid4() for _ in range(10)]
+
+    urls = DownloadUrls(client, file_ids, prefetch=3)
+    try:
+        first = urls.get(file_ids[0])
+        assert first.startswith(f"http://s3/{file_ids[0]}")
+
+        # every url is requested exactly once, also for files outside of the prefetched ones
+        other = uuid4()
+        for file_id in file_ids + [other, other]:
+            urls.get(file_id)
+        assert urls.get(file_ids[0]) == first
+        assert sorted(backend.issued) == sorted(map(str, file_ids + [other]))
+    finally:
+        urls.close()
+
+
+def test_download_urls_expiry_and_refresh(config_path):
+    backend = FakeDownloadBackend(lifetime=DOWNLOAD_URL_REFRESH_MARGIN + 60)
+    client = AuthenticatedClient(config_path=config_path, transport=httpx.MockTransport(backend))
+    clock = FakeClock()
+    file_id = uuid4()
+
+    urls = DownloadUrls(client, clock=clock)
+    try:
+        url = urls.get(file_id)
+        clock.now += 30
+        assert urls.get(file_id) == url
+
+        # urls are not handed out shortly before they expire
+        clock.now += 60
+        expired = url
+        url = urls.get(file_id)
+        assert url != expired
+
+        # rejected urls are replaced once, even if several transfers report them
+        refreshed = urls.refresh(file_id, url)
+        assert refreshed != url
+        assert urls.refresh(file_id, url) == refreshed
+        assert len(backend.issued) == 3
+    finally:
+        urls.close()
+
+
+def test_download_preallocates_part_file(tmp_path, small_segments, serve, monkeypatch):
+    data = os.urandom(5000)
+    serve(FakeObjectStore(data))
+    allocated: List[Tuple[int, int]] = []
+
+    def posix_fallocate(fd: int, offset: int, length: int) -> None:
+        allocated.append((offset, length))
+        os.ftruncate(fd, offset + length)
+
+    monkeypatch.setattr(os, "posix_fallocate", posix_fallocate, raising=False)
+    _download(tmp_path / "file.bag", data)
+    assert allocated == [(0, 5000)]
+
+
+def test_download_without_preallocation_support(tmp_path, small_segments, serve, monkeypatch):
+    data = os.urandom(5000)
+    serve(FakeObjectStore(data))
+
+    def posix_fallocate(fd: int, offset: int, length: int) -> None:
+        raise OSError(errno.EOPNOTSUPP, "not supported")
+
+    monkeypatch.setattr(os, "posix_fallocate", posix_fallocate, raising=False)
+    path = tmp_path / "file.bag"
+    assert _download(path, data) == b64_md5(path)
+    assert path.read_bytes() == data
+
+
+def test_check_disk_space(tmp_path, monkeypatch):
+    files = {tmp_path / "nested" / f"{name}.bag": make_file(name, 1000) for name in "abc"}
+    ids = [file.id for file in files.values()]
+    free = 2500
+    monkeypatch.setattr(shutil, "disk_usage", lambda path: shutil._ntuple_diskusage(10**6, 10**6 - free, free))
+
+    with pytest.raises(InsufficientDiskSpace):
+        _check_disk_space(files, ids)
+    # only the files that are downloaded count
+    _check_disk_space(files, ids[:2])
+
+    # part files of interrupted downloads are already allocated
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "a.bag.part").write_bytes(b"\0" * 600)
+    _check_disk_space(files, ids)
+
+
+def test_download_files_prefetches_urls_in_schedule_order(config_path, tmp_path, monkeypatch):
+    files = {tmp_path / f"{name}.bag": make_file(name, size) for name, size in [("a", 10), ("b", 1000), ("c", 100)]}
+    prefetched: List[Any] = []
+    started: List[Any] = []
+
+    class RecordingUrls(DownloadUrls):
+        def __init__(self, client, file_ids=(), **kwargs) -> None:
+            prefetched.extend(file_ids)
+            super().__init__(client, file_ids, **kwargs)
+
+    def download_file(*, file, **kwargs):
+        started.append(file.id)
+        return DownloadState.DOWNLOADED_OK, file.size
+
+    monkeypatch.setattr(kleinkram.api.file_transfer, "DownloadUrls", RecordingUrls)
+    monkeypatch.setattr(kleinkram.api.file_transfer, "download_file", download_file)
+    client = AuthenticatedClient(config_path=config_path)
+    download_files(client, files, n_workers=1, check_disk_space=False, local_store=False)
+
+    largest_first = [files[tmp_path / f"{name}.bag"].id for name in "bca"]
+    assert prefetched == largest_first
+    assert started == largest_first
+
+
+def test_downloads_share_pooled_client(tmp_path, small_segments, serve):
+    data = os.urandom(5000)
+    serve(FakeObjectStore(data))
+
+    with S3DownloadPool(max_connections=4) as pool:
+        for name in ["a.bag", "b.bag", "c.bag"]:
+            path = tmp_path / name
+            assert _download(path, data, connections=4, pool=pool) == b64_md5(path)
+        assert len(serve.clients) == 1
+        assert not serve.clients[0].is_closed
+    assert serve.clients[0].is_closed
+
+
+def test_url_download_refreshes_rejected_url(tmp_path, small_segments, serve):
+    data = os.urandom(5000)
+    path = tmp_path / "file.bag"
+    store = FakeObjectStore(data)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.params.get("expired"):
+            return httpx.Response(403)
+        return store(request)
+
+    serve(handler)
+    rejected: List[str] = []
+
+    def refresh_url(url: str) -> str:
+        rejected.append(url)
+        return "http://s3/file"
+
+    for connections in [1, 4]:
+        rejected.clear()
+        observed_hash = _url_download(
+            "http://s3/file?expired=1",
+            path=path,
+            size=len(data),
+            overwrite=True,
+            progress=lambda _: None,
+            connections=connections,
+            refresh_url=refresh_url,
+        )
+        # concurrent segments refresh the url only once
+        assert rejected == ["http://s3/file?expired=1"]
+        assert observed_hash == b64_md5(path)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from datetime import datetime
+from datetime import timezone
+from typing import Any
+
+import httpx
+import pytest
+
+import kleinkram.api.partial_download
+import kleinkram.mcap
+from kleinkram.api.inspection import inspect_file
+from kleinkram.api.inspection import with_topics
+from kleinkram.errors import FileTypeNotSupported
+from kleinkram.models import TopicInfo
+from tests.helpers import make_file
+from tests.test_mcap import START
+from tests.test_mcap import TOPICS
+from tests.test_mcap import make_mcap
+from tests.test_rosbag import make_bag
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """\
+    serves `data` with range requests, `serve.requests` are the requested ranges
+    """
+    client_cls = httpx.Client
+    monkeypatch.setattr(kleinkram.api.partial_download, "_get_file_download", lambda client, id: "http://s3/file")
+    monkeypatch.setattr(kleinkram.mcap, "TAIL_READ_SIZE", 1024)
+
+    def serve(data: bytes) -> None:
+        serve.requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            first, last = request.headers["Range"].removeprefix("bytes=").split("-")
+            start, end = int(first), int(last) + 1
+            serve.requests.append((start, end))
+            return httpx.Response(206, content=data[start:end])
+
+        def client(**kwargs: Any) -> httpx.Client:
+            return client_cls(transport=httpx.MockTransport(handler), **kwargs)
+
+        monkeypatch.setattr(httpx, "Client", client)
+
+    return serve
+
+
+def _utc(ns: int) -> datetime:
+    return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc)
+
+
+def test_inspect_mcap(serve):
+    data = make_mcap(seconds=1000)
+    serve(data)
+    file = make_file("recording.mcap", len(data))
+
+    info = inspect_file(None, file)
+
+    assert info.topics == [TopicInfo(topic, "std_msgs/String", 1000) for topic in sorted(TOPICS)]
+    assert info.message_count == 4000
+    assert info.start_time == _utc(START)
+    assert info.end_time == _utc(START + 999 * 10**9)
+    assert sum(end - start for start, end in serve.requests) < len(data) / 10
+    assert with_topics(file, info).topics == sorted(TOPICS)
+
+
+def test_inspect_bag(serve, tmp_path):
+    data = make_bag(tmp_path / "test.bag")
+    serve(data)
+
+    info = inspect_file(None, make_file("recording.bag", len(data)))
+
+    assert info.topics == [TopicInfo("/chatter", "std_msgs/String", 100), TopicInfo("/count", "std_msgs/Int32", 50)]
+    assert info.start_time == _utc(START)
+    assert len(serve.requests) == 2
+
+
+def test_inspect_other_files():
+    with pytest.raises(FileTypeNotSupported):
+        inspect_file(None, make_file("recording.db3", 100))
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import stat
+from uuid import uuid4
+
+import pytest
+
+import kleinkram.api.journal
+from kleinkram.api.journal import UploadJournal
+from kleinkram.api.transport import UploadCredentials
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = UploadJournal(tmp_path / "uploads.sqlite")
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def file(tmp_path):
+    path = tmp_path / "file.bag"
+    path.write_bytes(b"some bytes")
+    return path
+
+
+def _start(journal: UploadJournal, file, mission_id) -> UploadCredentials:
+    credentials = UploadCredentials("a", "s", "t", uuid4(), "bucket")
+    journal.start(mission_id, file.name, file, stat=file.stat(), credentials=credentials, upload_id="upload", part_size=5)
+    return credentials
+
+
+def test_upload_journal_round_trip(journal, file):
+    mission_id = uuid4()
+    credentials = _start(journal, file, mission_id)
+    journal.add_part(credentials.file_id, 1, '"1"')
+    journal.add_part(credentials.file_id, 2, '"2"')
+
+    entry = journal.get(mission_id, file.name)
+    assert entry is not None
+    assert entry.credentials == credentials
+    assert entry.upload_id == "upload"
+    assert entry.parts == {1: '"1"', 2: '"2"'}
+    assert entry.is_resumable(file)
+    assert journal.get(uuid4(), file.name) is None
+
+    journal.remove(credentials.file_id)
+    assert journal.get(mission_id, file.name) is None
+
+
+def test_upload_journal_is_private(tmp_path, journal):
+    mode = stat.S_IMODE((tmp_path / "uploads.sqlite").stat().st_mode)
+    assert mode == 0o600
+
+
+def test_journal_entry_not_resumable(journal, file, monkeypatch):
+    mission_id = uuid4()
+    _start(journal, file, mission_id)
+    entry = journal.get(mission_id, file.name)
+    assert entry is not None and entry.is_resumable(file)
+
+    monkeypatch.setattr(kleinkram.api.journal, "CREDENTIALS_MAX_AGE", 0)
+    assert not entry.is_resumable(file)
+    monkeypatch.undo()
+
+    file.write_bytes(b"other bytes")
+    assert not entry.is_resumable(file)
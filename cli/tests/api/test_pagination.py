@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from threading import Lock
+from time import sleep
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Mapping
+from typing import Optional
+
+import httpx
+import pytest
+
+import kleinkram.api.pagination
+from kleinkram.api.pagination import CURSOR
+from kleinkram.api.pagination import NEXT_CURSOR
+from kleinkram.api.pagination import SKIP
+from kleinkram.api.pagination import SORT_BY
+from kleinkram.api.pagination import SORT_ORDER
+from kleinkram.api.pagination import TAKE
+from kleinkram.api.pagination import UPDATED_AT
+from kleinkram.api.pagination import cached_paginated_request
+from kleinkram.api.pagination import paginated_request
+from kleinkram.config import Config
+from kleinkram.config import Credentials
+from kleinkram.config import MetadataCacheConfig
+from kleinkram.metadata_cache import MetadataCache
+from tests.helpers import FakeClock
+
+
+class FakeClient:
+    """\
+    serves `count` entries, at most `max_take` per page
+    """
+
+    def __init__(self, count: int, *, max_take: int = 1000) -> None:
+        self.entries = [{"id": i} for i in range(count)]
+        self.max_take = max_take
+        self.skips: List[int] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = Lock()
+
+    def get(self, endpoint: str, params: Mapping[str, Any]) -> httpx.Response:
+        skip, take = params[SKIP], min(params[TAKE], self.max_take)
+        with self._lock:
+            self.skips.append(skip)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # slow enough for concurrent requests to overlap
+        sleep(0.001)
+        with self._lock:
+            self.in_flight -= 1
+        data = self.entries[skip : skip + take]  # noqa: E203
+        return httpx.Response(
+            200,
+            json={"data": data, "count": len(self.entries), "skip": skip, "take": take},
+            request=httpx.Request("GET", endpoint),
+        )
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_paginated_request(concurrency):
+    client = FakeClient(1000)
+    entries = list(paginated_request(client, "/files", page_size=128, concurrency=concurrency))
+
+    assert entries == client.entries
+    assert sorted(client.skips) == list(range(0, 1000, 128))
+    assert client.max_in_flight <= concurrency
+
+
+def test_paginated_request_fetches_pages_concurrently():
+    client = FakeClient(1000)
+    entries = list(paginated_request(client, "/files", page_size=10, concurrency=4))
+
+    assert entries == client.entries
+    assert client.max_in_flight > 1
+    assert client.max_in_flight <= 4
+
+
+def test_paginated_request_max_entries():
+    client = FakeClient(1000)
+    entries = list(paginated_request(client, "/files", page_size=128, max_entries=300))
+
+    assert entries == client.entries[:300]
+    assert sorted(client.skips) == [0, 128, 256]
+
+
+def test_paginated_request_smaller_pages():
+    # the server returns less entries than asked for
+    client = FakeClient(1000, max_take=100)
+    entries = list(paginated_request(client, "/files", page_size=128, concurrency=4))
+
+    assert entries == client.entries
+    assert sorted(client.skips) == list(range(0, 1000, 100))
+
+
+def test_paginated_request_stops_early():
+    client = FakeClient(1000)
+    pages = paginated_request(client, "/files", page_size=10, concurrency=4)
+    assert [next(pages) for _ in range(15)] == client.entries[:15]
+    pages.close()
+
+    # only the pages in flight were requested
+    assert len(client.skips) <= 2 + 4
+
+
+class CursorClient:
+    """\
+    pages by cursor, `cursor` is the id of the last entry of the previous page
+    """
+
+    def __init__(self, count: int) -> None:
+        self.entries = [{"id": i} for i in range(count)]
+        self.params: List[Mapping[str, Any]] = []
+
+    def get(self, endpoint: str, params: Mapping[str, Any]) -> httpx.Response:
+        self.params.append(dict(params))
+        if CURSOR in params:
+            after = int(params[CURSOR])
+            start = next((i for i, entry in enumerate(self.entries) if entry["id"] > after), len(self.entries))
+        else:
+            start = params[SKIP]
+        data = self.entries[start : start + params[TAKE]]  # noqa: E203
+        last = start + len(data) >= len(self.entries)
+        next_cursor = None if last else str(data[-1]["id"])
+        # an entry is added in front while listing
+        self.entries.insert(0, {"id": -len(self.params)})
+        return httpx.Response(
+            200,
+            json={"data": data, "count": len(self.entries), "skip": start, "take": params[TAKE], NEXT_CURSOR: next_cursor},
+            request=httpx.Request("GET", endpoint),
+        )
+
+
+def test_paginated_request_by_cursor():
+    client = CursorClient(1000)
+    entries = list(paginated_request(client, "/files", page_size=128))
+
+    # no entry is listed twice although entries were added in front
+    assert entries == [{"id": i} for i in range(1000)]
+    assert len(client.params) == 8
+    assert all(SKIP not in params and params[TAKE] == 128 for params in client.params[1:])
+
+    client = CursorClient(1000)
+    assert len(list(paginated_request(client, "/files", page_size=128, max_entries=200))) == 200
+    assert len(client.params) == 2
+
+
+class ListingServer:
+    """\
+    serves entries sorted by `updatedAt` with weak etags like the backend
+    """
+
+    def __init__(self, count: int) -> None:
+        self.config = Config(metadata_cache=MetadataCacheConfig(ttl=60))
+        self.config.credentials = Credentials(api_key="key")
+        self.entries = [self._entry(i, i) for i in range(count)]
+        self.requests: List[Mapping[str, Any]] = []
+
+    @staticmethod
+    def _entry(id: int, second: int) -> Dict[str, Any]:
+        return {"uuid": str(id), "updatedAt": f"2024-01-01T00:{second // 60:02}:{second % 60:02}.000Z"}
+
+    def update(self, id: int, second: int) -> None:
+        self.entries = [entry for entry in self.entries if entry["uuid"] != str(id)] + [self._entry(id, second)]
+
+    def get(self, endpoint: str, params: Mapping[str, Any], headers: Optional[Mapping[str, str]] = None) -> httpx.Response:
+        self.requests.append(dict(params))
+        entries = self.entries
+        if params.get(SORT_BY) == UPDATED_AT:
+            entries = sorted(entries, key=lambda entry: entry["updatedAt"], reverse=params[SORT_ORDER] == "DESC")
+        skip, take = params[SKIP], params[TAKE]
+        body = {"data": entries[skip : skip + take], "count": len(entries), "skip": skip, "take": take}  # noqa: E203
+        etag = 'W/"' + hashlib.md5(json.dumps(body).encode()).hexdigest() + '"'
+        request = httpx.Request("GET", endpoint)
+        if headers and headers.get("If-None-Match") == etag:
+            return httpx.Response(304, request=request)
+        return httpx.Response(200, json=body, headers={"ETag": etag}, request=request)
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    clock = FakeClock(1000.0)
+    cache = MetadataCache(tmp_path / "metadata.sqlite", clock=clock)
+    monkeypatch.setattr(kleinkram.api.pagination, "get_metadata_cache", lambda config: cache)
+    yield clock
+    cache.close()
+
+
+def _ids(entries) -> List[str]:
+    return sorted(entry["uuid"] for entry in entries)
+
+
+def test_cached_paginated_request(clock):
+    server = ListingServer(300)
+    assert _ids(cached_paginated_request(server, "/files")) == _ids(server.entries)
+    assert len(server.requests) == 1 + 3
+
+    # fresh listings are not requested again
+    server.requests.clear()
+    assert _ids(cached_paginated_request(server, "/files")) == _ids(server.entries)
+    assert server.requests == []
+
+    # other queries are cached separately, `max_entries` bypasses the cache
+    assert len(list(cached_paginated_request(server, "/files", params={"fileUuids": ["1"]}))) == 300
+    assert len(server.requests) == 1 + 3
+    assert len(list(cached_paginated_request(server, "/files", max_entries=10))) == 10
+
+
+def test_cached_paginated_request_refresh(clock):
+    server = ListingServer(300)
+    list(cached_paginated_request(server, "/files"))
+
+    # nothing changed, the server answers the first page with 304
+    clock.now += 60
+    server.requests.clear()
+    assert _ids(cached_paginated_request(server, "/files")) == _ids(server.entries)
+    assert len(server.requests) == 1
+
+    # only the changed entries are fetched
+    clock.now += 60
+    server.requests.clear()
+    server.update(5, 1000)
+    server.update(300, 1001)
+    entries = list(cached_paginated_request(server, "/files"))
+    assert _ids(entries) == _ids(server.entries)
+    assert entries[:2] == [server._entry(300, 1001), server._entry(5, 1000)]
+    assert len(server.requests) == 1
+
+    # a deleted entry changes the count, everything is fetched again
+    clock.now += 60
+    server.requests.clear()
+    server.entries = server.entries[1:]
+    assert _ids(cached_paginated_request(server, "/files")) == _ids(server.entries)
+    assert len(server.requests) == 1 + 3
+
+
+def test_cached_paginated_request_max_age(clock):
+    server = ListingServer(10)
+    list(cached_paginated_request(server, "/files"))
+
+    # an entry is deleted and an older one moved in, the count does not change
+    clock.now += 60
+    server.entries = server.entries[1:] + [server._entry(10, 5)]
+    assert _ids(cached_paginated_request(server, "/files")) == [str(i) for i in range(10)]
+
+    # the merged listing is fetched completely once it is older than `max_age`
+    clock.now += MetadataCacheConfig().max_age
+    server.requests.clear()
+    assert _ids(cached_paginated_request(server, "/files")) == _ids(server.entries)
+    assert len(server.requests) == 1 + 1
+
+
+def test_cached_paginated_request_not_incremental(clock):
+    server = ListingServer(10)
+    list(cached_paginated_request(server, "/missions", incremental=False))
+
+    clock.now += 60
+    server.requests.clear()
+    server.update(5, 1000)
+    assert _ids(cached_paginated_request(server, "/missions", incremental=False)) == _ids(server.entries)
+    assert len(server.requests) == 1 + 1
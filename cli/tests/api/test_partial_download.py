@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import List
+from typing import Tuple
+
+import httpx
+import pytest
+
+import kleinkram.api.partial_download
+import kleinkram.mcap
+from kleinkram.api.partial_download import McapFilter
+from kleinkram.api.partial_download import _merge_ranges
+from kleinkram.api.partial_download import download_filtered_mcap
+from kleinkram.api.partial_download import download_filtered_mcaps
+from kleinkram.api.partial_download import filtered_path
+from kleinkram.config import Config
+from kleinkram.mcap import NS_PER_S
+from kleinkram.mcap import ChunkIndex
+from kleinkram.mcap import McapError
+from kleinkram.models import FileState
+from tests.helpers import make_file
+from tests.test_mcap import START
+from tests.test_mcap import make_mcap
+from tests.test_mcap import read_messages
+
+
+class RangeServer:
+    def __init__(self, data: bytes, *, ranges: bool = True) -> None:
+        self.data = data
+        self.ranges = ranges
+        self.requested: List[Tuple[int, int]] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if not self.ranges:
+            return httpx.Response(200, content=self.data)
+        first, last = request.headers["Range"].removeprefix("bytes=").split("-")
+        start, end = int(first), int(last) + 1
+        self.requested.append((start, end))
+        return httpx.Response(206, content=self.data[start:end])
+
+    @property
+    def fetched(self) -> int:
+        return sum(end - start for start, end in self.requested)
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    client_cls = httpx.Client
+    monkeypatch.setattr(kleinkram.api.partial_download, "_get_file_download", lambda client, id: "http://s3/file")
+    monkeypatch.setattr(kleinkram.mcap, "TAIL_READ_SIZE", 1024)
+
+    def serve(handler) -> None:
+        def client(**kwargs: Any) -> httpx.Client:
+            return client_cls(transport=httpx.MockTransport(handler), **kwargs)
+
+        monkeypatch.setattr(httpx, "Client", client)
+
+    return serve
+
+
+def test_download_filtered_mcap(tmp_path, serve):
+    data = make_mcap(seconds=1000)
+    server = RangeServer(data)
+    serve(server)
+
+    path = tmp_path / "out.mcap"
+    result = download_filtered_mcap(
+        None,
+        file=make_file("recording.mcap", len(data)),
+        path=path,
+        mcap_filter=McapFilter(topics=["/tf"], start=100, end=129),
+    )
+
+    assert read_messages(path.read_bytes()) == [("/tf", START + second * NS_PER_S) for second in range(100, 130)]
+    assert result.messages == 30
+    assert result.fetched == server.fetched
+    assert server.fetched < len(data) / 10
+    assert list(tmp_path.iterdir()) == [path]
+
+    with pytest.raises(FileExistsError):
+        download_filtered_mcap(
+            None, file=make_file("recording.mcap", len(data)), path=path, mcap_filter=McapFilter(topics=["/tf"])
+        )
+
+
+def test_download_filtered_mcap_needs_ranges(tmp_path, serve):
+    data = make_mcap()
+    serve(RangeServer(data, ranges=False))
+    with pytest.raises(McapError, match="range requests"):
+        download_filtered_mcap(
+            None, file=make_file("recording.mcap", len(data)), path=tmp_path / "out.mcap", mcap_filter=McapFilter()
+        )
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_download_filtered_mcaps(tmp_path, serve, capsys):
+    data = make_mcap()
+    serve(RangeServer(data))
+    files = {
+        tmp_path / "a.mcap": make_file("a.mcap", len(data)),
+        tmp_path / "b.bag": make_file("b.bag", len(data)),
+        tmp_path / "c.mcap": make_file("c.mcap", len(data), state=FileState.UPLOADING),
+    }
+
+    class Client:
+        config = Config()
+
+    download_filtered_mcaps(Client(), files, McapFilter(end=9))
+
+    assert sorted(tmp_path.iterdir()) == [tmp_path / "a.filtered.mcap"]
+    assert len(read_messages((tmp_path / "a.filtered.mcap").read_bytes())) == 40
+    assert "1 downloaded, 2 skipped, 0 failed" in capsys.readouterr().err
+
+
+def test_filtered_path(tmp_path):
+    assert filtered_path(tmp_path / "run.mcap") == tmp_path / "run.filtered.mcap"
+
+
+def _chunk(offset: int, length: int) -> ChunkIndex:
+    return ChunkIndex(
+        message_start_time=0,
+        message_end_time=0,
+        chunk_start_offset=offset,
+        chunk_length=length,
+        message_index_offsets={},
+        message_index_length=0,
+        compression="",
+        compressed_size=length,
+        uncompressed_size=length,
+    )
+
+
+def test_merge_ranges():
+    chunks = [_chunk(0, 10), _chunk(10, 10), _chunk(25, 10), _chunk(100, 10), _chunk(110, 50)]
+    ranges = _merge_ranges(chunks, gap=5, max_size=40)
+    assert [(rng.offset, rng.length, len(rng.chunks)) for rng in ranges] == [(0, 35, 3), (100, 10, 1), (110, 50, 1)]
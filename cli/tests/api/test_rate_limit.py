@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from datetime import time
+from typing import List
+
+import pytest
+
+from kleinkram.api.rate_limit import BURST_SECONDS
+from kleinkram.api.rate_limit import DOWNLOAD
+from kleinkram.api.rate_limit import SCHEDULE_CHECK_INTERVAL
+from kleinkram.api.rate_limit import UPLOAD
+from kleinkram.api.rate_limit import RateLimiter
+from kleinkram.config import RateWindow
+
+
+class FakeTime:
+    """\
+    a clock that only advances when someone sleeps
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: List[float] = []
+        self.time_of_day = time(12, 0)
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _limiter(fake: FakeTime, max_rate=None, **kwargs) -> RateLimiter:
+    return RateLimiter(
+        max_rate,
+        clock=fake.clock,
+        time_of_day=lambda: fake.time_of_day,
+        sleep=fake.sleep,
+        **kwargs,
+    )
+
+
+def test_rate_limiter_disabled_by_default():
+    fake = FakeTime()
+    limiter = _limiter(fake)
+    assert not limiter.enabled
+    assert limiter.rate() is None
+
+    limiter.consume(10**9)
+    assert fake.sleeps == []
+
+
+def test_rate_limiter_limits_rate():
+    fake = FakeTime()
+    limiter = _limiter(fake, 1000)
+
+    for _ in range(100):
+        limiter.consume(100)
+
+    # 10000 bytes at 1000 B/s take 10 seconds
+    assert fake.now == pytest.approx(10.0)
+
+
+def test_rate_limiter_allows_burst_after_idle():
+    fake = FakeTime()
+    limiter = _limiter(fake, 1000)
+
+    # idle time only accumulates up to the burst size
+    fake.now += 60
+    limiter.consume(int(1000 * BURST_SECONDS))
+    assert fake.sleeps == []
+
+    limiter.consume(1000)
+    assert fake.sleeps == [pytest.approx(1.0)]
+
+
+def test_rate_limiter_schedule():
+    fake = FakeTime()
+    schedule = [
+        RateWindow(start="08:00", end="18:00", upload="1KB/s"),
+        RateWindow(start="22:00", end="06:00", download="2KB/s"),
+    ]
+    upload = _limiter(fake, schedule=schedule, direction=UPLOAD)
+    download = _limiter(fake, schedule=schedule, direction=DOWNLOAD)
+
+    assert upload.rate() == 1000
+    assert download.rate() is None
+
+    fake.time_of_day = time(19, 0)
+    assert upload.rate() is None
+    assert download.rate() is None
+
+    # windows wrap around midnight
+    for t in [time(23, 0), time(0, 0), time(5, 59)]:
+        fake.time_of_day = t
+        assert upload.rate() is None
+        assert download.rate() == 2000
+    fake.time_of_day = time(6, 0)
+    assert download.rate() is None
+
+
+def test_rate_limiter_max_rate_overrides_schedule():
+    fake = FakeTime()
+    schedule = [RateWindow(start="00:00", end="23:59", upload="1KB/s")]
+    limiter = _limiter(fake, 5000, schedule=schedule)
+    assert limiter.rate() == 5000
+
+
+def test_rate_limiter_follows_schedule_changes():
+    fake = FakeTime()
+    fake.time_of_day = time(17, 59)
+    limiter = _limiter(fake, schedule=[RateWindow(start="08:00", end="18:00", upload="1KB/s")])
+
+    limiter.consume(1000)
+    assert fake.sleeps
+
+    # the window ends, after the next check the transfer is unlimited
+    fake.time_of_day = time(18, 0)
+    fake.now += SCHEDULE_CHECK_INTERVAL
+    fake.sleeps.clear()
+    limiter.consume(10**9)
+    assert fake.sleeps == []
+
+
+@pytest.mark.parametrize(
+    "window",
+    [
+        RateWindow(start="8am", end="18:00", upload="1KB/s"),
+        RateWindow(start="08:00", end="18:00", upload="fast"),
+        RateWindow(start="08:00", end="18:00", upload="0MB/s"),
+    ],
+)
+def test_rate_limiter_invalid_schedule(window):
+    with pytest.raises(ValueError):
+        RateLimiter(schedule=[window])
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import pytest
+
+from kleinkram.api.scheduling import TransferSchedule
+from kleinkram.api.scheduling import schedule_transfers
+
+SIZES = {"a": 5, "b": 120, "c": 1, "d": 40, "e": 5, "f": 0}
+
+
+def _schedule(policy) -> str:
+    return "".join(schedule_transfers(list(SIZES), SIZES.__getitem__, policy))
+
+
+def test_schedule_largest_first():
+    # files of the same size keep their order
+    assert _schedule(TransferSchedule.LARGEST_FIRST) == "bdaecf"
+
+
+def test_schedule_mixed():
+    assert _schedule(TransferSchedule.MIXED) == "bfdcae"
+
+
+def test_schedule_in_order():
+    assert _schedule(TransferSchedule.IN_ORDER) == "abcdef"
+
+
+def test_schedule_accepts_names():
+    assert _schedule("mixed") == _schedule(TransferSchedule.MIXED)
+    with pytest.raises(ValueError):
+        _schedule("smallest-first")
+
+
+@pytest.mark.parametrize("policy", list(TransferSchedule))
+@pytest.mark.parametrize("n", [0, 1, 2, 3])
+def test_schedule_keeps_all_items(policy, n):
+    items = list(range(n))
+    assert sorted(schedule_transfers(items, lambda x: x, policy)) == items
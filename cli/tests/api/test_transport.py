@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import Dict
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import pytest
+from botocore.awsrequest import AWSResponse
+
+from kleinkram.api.transport import S3DownloadPool
+from kleinkram.api.transport import S3Transport
+from kleinkram.api.transport import UploadCredentials
+
+
+class _EmptyRaw:
+    def stream(self, **kwargs: Any):
+        _ = kwargs
+        yield b""
+
+
+class _Raw:
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+
+    def stream(self, **kwargs: Any):
+        _ = kwargs
+        yield self.body
+
+
+def _credentials(name: str) -> UploadCredentials:
+    return UploadCredentials(
+        access_key=f"access-{name}",
+        secret_key=f"secret-{name}",
+        session_token=f"token-{name}",
+        file_id=uuid4(),
+        bucket="bucket",
+    )
+
+
+@pytest.fixture
+def transport():
+    with S3Transport("http://localhost:9000") as transport:
+        yield transport
+
+
+def _capture_auth(transport: S3Transport) -> Dict[str, str]:
+    captured: Dict[str, str] = {}
+
+    def send(request: Any, **kwargs: Any) -> AWSResponse:
+        _ = kwargs
+        key = request.url.rsplit("/", 1)[-1]
+        captured[key] = request.headers["X-Amz-Security-Token"].decode()
+        return AWSResponse(request.url, 200, {}, _EmptyRaw())
+
+    transport.client.meta.events.register("before-send.s3.*", send)
+    return captured
+
+
+def test_s3_transport_signs_with_registered_credentials(transport):
+    captured = _capture_auth(transport)
+    a, b = _credentials("a"), _credentials("b")
+
+    transport.register(a)
+    transport.register(b)
+    transport.client.put_object(Bucket="bucket", Key=str(a.file_id), Body=b"")
+    transport.client.put_object(Bucket="bucket", Key=str(b.file_id), Body=b"")
+
+    assert captured == {str(a.file_id): "token-a", str(b.file_id): "token-b"}
+
+
+def test_s3_transport_refuses_unregistered_keys(transport):
+    _capture_auth(transport)
+    a = _credentials("a")
+
+    transport.register(a)
+    transport.unregister(a)
+    with pytest.raises(RuntimeError):
+        transport.client.put_object(Bucket="bucket", Key=str(a.file_id), Body=b"")
+
+
+LIST_PARTS_PAGE = """\
+<ListPartsResult>
+  <Bucket>bucket</Bucket><Key>{key}</Key><UploadId>upload</UploadId>
+  <NextPartNumberMarker>{marker}</NextPartNumberMarker><IsTruncated>{truncated}</IsTruncated>
+  {parts}
+</ListPartsResult>
+"""
+
+
+def test_s3_transport_list_parts_paginates(transport):
+    a = _credentials("a")
+    markers = []
+
+    def send(request: Any, **kwargs: Any) -> AWSResponse:
+        _ = kwargs
+        marker = int(parse_qs(urlsplit(request.url).query).get("part-number-marker", ["0"])[0])
+        markers.append(marker)
+        parts = "".join(
+            f"<Part><PartNumber>{n}</PartNumber><ETag>&quot;{n}&quot;</ETag><Size>1</Size></Part>"
+            for n in range(marker + 1, marker + 3)
+        )
+        body = LIST_PARTS_PAGE.format(key=a.file_id, marker=marker + 2, truncated=str(marker == 0).lower(), parts=parts)
+        return AWSResponse(request.url, 200, {}, _Raw(body.encode()))
+
+    transport.client.meta.events.register("before-send.s3.*", send)
+    with transport.registered(a):
+        parts = transport.list_parts(a, "upload")
+
+    assert markers == [0, 2]
+    assert parts == {1: '"1"', 2: '"2"', 3: '"3"', 4: '"4"'}
+
+
+def test_s3_download_pool_shares_clients_per_host():
+    with S3DownloadPool(max_connections=4) as pool:
+        client = pool.client("http://localhost:9000/bucket/a?X-Amz-Expires=60")
+        assert pool.client("http://localhost:9000/bucket/b") is client
+        assert pool.client("http://other:9000/bucket/a") is not client
+        assert pool.client("https://localhost:9000/bucket/a") is not client
+
+    assert client.is_closed
+    # a closed pool starts over
+    assert pool.client("http://localhost:9000/bucket/a") is not client
+    pool.close()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from threading import Thread
+from time import sleep
+from typing import List
+
+import pytest
+
+from kleinkram.api.workers import ADJUST_INTERVAL
+from kleinkram.api.workers import AdaptiveWorkers
+from tests.helpers import FakeClock
+
+
+def _measure(workers: AdaptiveWorkers, clock: FakeClock, nbytes: int) -> None:
+    """\
+    simulates a window in which all slots are busy and `nbytes` were transferred
+    """
+    slots = [workers.slot() for _ in range(workers.limit)]
+    for slot in slots:
+        slot.__enter__()
+    clock.now += ADJUST_INTERVAL
+    workers.record(nbytes)
+    for slot in slots:
+        slot.__exit__(None, None, None)
+
+
+def test_adaptive_workers_ramp_up_while_throughput_improves():
+    clock = FakeClock()
+    workers = AdaptiveWorkers(2, clock=clock)
+
+    # throughput scales with the workers until the link is full at 6 workers
+    limits: List[int] = []
+    for _ in range(6):
+        limits.append(workers.limit)
+        _measure(workers, clock, min(workers.limit, 6) * 1000)
+
+    assert limits[:4] == [2, 3, 4, 6]
+    assert workers.best == 6
+    assert workers.limit == 6
+
+
+def test_adaptive_workers_back_off_on_errors():
+    clock = FakeClock()
+    workers = AdaptiveWorkers(8, clock=clock)
+
+    with pytest.raises(RuntimeError):
+        workers.run(_raise)
+    assert workers.limit == 4
+    assert workers.errors == 1
+    # the best limit is only ever measured
+    assert workers.best == 8
+
+    workers.record_error()
+    workers.record_error()
+    workers.record_error()
+    assert workers.limit == 1
+
+
+def test_adaptive_workers_back_off_on_falling_throughput():
+    clock = FakeClock()
+    workers = AdaptiveWorkers(4, max_workers=4, clock=clock)
+
+    _measure(workers, clock, 4000)
+    _measure(workers, clock, 4000)
+    assert workers.limit == 4
+
+    _measure(workers, clock, 1000)
+    assert workers.limit == 3
+
+
+def test_adaptive_workers_ignore_unsaturated_windows():
+    clock = FakeClock()
+    workers = AdaptiveWorkers(4, clock=clock)
+
+    clock.now += ADJUST_INTERVAL
+    workers.record(1000)
+    assert workers.limit == 4
+
+
+def test_fixed_workers():
+    clock = FakeClock()
+    workers = AdaptiveWorkers.fixed(3)
+
+    workers.record_error()
+    _measure(workers, clock, 1000)
+    assert workers.limit == 3
+
+
+def test_adaptive_workers_limit_concurrency():
+    workers = AdaptiveWorkers.fixed(2)
+    active: List[int] = []
+    running = [0]
+
+    def work() -> None:
+        running[0] += 1
+        active.append(running[0])
+        sleep(0.01)
+        running[0] -= 1
+
+    threads = [Thread(target=workers.run, args=(work,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(active) == 8
+    assert max(active) <= 2
+
+
+def _raise() -> None:
+    raise RuntimeError("transfer failed")
@@ -0,0 +1,57 @@
+"""\
+fakes shared by the unit tests
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from uuid import uuid4
+
+from kleinkram.models import File
+from kleinkram.models import FileState
+from kleinkram.models import Mission
+
+
+class FakeClock:
+    """\
+    a clock that only moves when a test sets `now`, or by `step` on every call
+    """
+
+    def __init__(self, now: float = 0.0, *, step: float = 0.0) -> None:
+        self.now = now
+        self.step = step
+
+    def __call__(self) -> float:
+        self.now += self.step
+        return self.now
+
+
+def make_file(
+    name: str = "file.bag",
+    size: int = 0,
+    *,
+    hash: str = "hash",
+    state: FileState = FileState.OK,
+    mission: Optional[Mission] = None,
+) -> File:
+    """\
+    a remote file in `mission` or in a mission of its own
+    """
+    now = datetime.now()
+    return File(
+        id=uuid4(),
+        name=name,
+        hash=hash,
+        size=size,
+        type_=Path(name).suffix.lstrip(".").upper(),
+        date=now,
+        created_at=now,
+        updated_at=now,
+        mission_id=mission.id if mission is not None else uuid4(),
+        mission_name=mission.name if mission is not None else "mission",
+        project_id=mission.project_id if mission is not None else uuid4(),
+        project_name=mission.project_name if mission is not None else "project",
+        state=state,
+    )
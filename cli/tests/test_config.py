@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 import os
 from pathlib import Path
 from tempfile import TemporaryDirectory
@@ -12,7 +13,12 @@ from kleinkram.config import ACTION_API
 from kleinkram.config import ACTION_API_KEY
 from kleinkram.config import ACTION_S3
 from kleinkram.config import Config
+from kleinkram.config import Credentials
 from kleinkram.config import Endpoint
+from kleinkram.config import LocalStoreConfig
+from kleinkram.config import MetadataCacheConfig
+from kleinkram.config import RateWindow
+from kleinkram.config import _config_to_dict
 from kleinkram.config import _load_config
 from kleinkram.config import _load_config_if_compatible
 from kleinkram.config import add_endpoint
@@ -21,7 +27,9 @@ from kleinkram.config import endpoint_table
 from kleinkram.config import get_config
 from kleinkram.config import get_env
 from kleinkram.config import get_shared_state
+from kleinkram.config import get_transfer_workers
 from kleinkram.config import save_config
+from kleinkram.config import save_transfer_workers
 from kleinkram.config import select_endpoint
 
 CONFIG_FILENAME = ".kleinkram.json"
@@ -191,3 +199,95 @@ def test_check_config_compatiblity(config_path):
     with open(config_path, "w") as f:
         f.write("foo")  # invalid config
     assert not check_config_compatibility(path=config_path)
+
+
+def test_save_transfer_workers(config_path):
+    config = get_config(path=config_path)
+    assert get_transfer_workers(config) is None
+
+    save_transfer_workers(config, 8, path=config_path)
+    assert get_transfer_workers(config) == 8
+    assert config == _load_config(path=config_path)
+
+    # workers are remembered per endpoint
+    select_endpoint(config, "prod", path=config_path)
+    assert get_transfer_workers(config) is None
+
+
+def test_load_config_without_transfer_workers(config_path):
+    config = Config()
+    dct = _config_to_dict(config)
+    del dct["transfer_workers"]
+    with open(config_path, "w") as f:
+        json.dump(dct, f)
+
+    assert _load_config(path=config_path) == config
+
+
+def test_rate_schedule_round_trip(config_path):
+    config = Config(rate_schedule=[RateWindow(start="08:00", end="18:00", upload="10MB/s", download=None)])
+    save_config(config, path=config_path)
+    assert _load_config(path=config_path) == config
+
+
+def test_load_config_with_invalid_rate_schedule(config_path):
+    config = Config(endpoint_credentials={"local": Credentials(api_key="key")})
+    dct = _config_to_dict(config)
+    dct["rate_schedule"] = [{"start": "08:00", "end": "18:00", "uplaod": "10MB/s"}]
+    with open(config_path, "w") as f:
+        json.dump(dct, f)
+
+    # the broken section is dropped, the credentials are kept
+    assert _load_config(path=config_path) == config
+
+
+def test_load_config_with_invalid_transfer_workers(config_path):
+    config = Config(endpoint_credentials={"local": Credentials(api_key="key")})
+    dct = _config_to_dict(config)
+    dct["transfer_workers"] = {"local": None}
+    with open(config_path, "w") as f:
+        json.dump(dct, f)
+
+    assert _load_config(path=config_path) == config
+
+
+def test_local_store_round_trip(config_path):
+    config = Config(local_store=LocalStoreConfig(path="/scratch/kleinkram", max_size="500GB"))
+    save_config(config, path=config_path)
+    assert _load_config(path=config_path) == config
+
+
+def test_load_config_with_invalid_local_store(config_path):
+    config = Config(endpoint_credentials={"local": Credentials(api_key="key")})
+    dct = _config_to_dict(config)
+    dct["local_store"] = {"dir": "/scratch/kleinkram"}
+    with open(config_path, "w") as f:
+        json.dump(dct, f)
+
+    assert _load_config(path=config_path) == config
+
+
+def test_load_config_with_invalid_metadata_cache(config_path):
+    config = Config(endpoint_credentials={"local": Credentials(api_key="key")})
+    dct = _config_to_dict(config)
+    dct["metadata_cache"] = {"ttl": 60, "refresh": True}
+    with open(config_path, "w") as f:
+        json.dump(dct, f)
+
+    assert _load_config(path=config_path) == config
+
+
+def test_metadata_cache_round_trip(config_path):
+    config = Config(metadata_cache=MetadataCacheConfig(ttl=60))
+    save_config(config, path=config_path)
+    assert _load_config(path=config_path) == config
+
+
+def test_load_config_without_rate_schedule(config_path):
+    config = Config()
+    dct = _config_to_dict(config)
+    del dct["rate_schedule"]
+    with open(config_path, "w") as f:
+        json.dump(dct, f)
+
+    assert _load_config(path=config_path) == config
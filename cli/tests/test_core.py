@@ -16,8 +16,11 @@ from kleinkram.api.query import FileQuery
 from kleinkram.api.query import MissionQuery
 from kleinkram.api.query import ProjectQuery
 from kleinkram.errors import MissionNotFound
+from kleinkram.models import FileState
 from kleinkram.models import FileVerificationStatus
+from kleinkram.utils import b64_md5
 from tests.backend_fixtures import DATA_FILES
+from tests.helpers import make_file
 
 
 @pytest.mark.slow
@@ -57,6 +60,53 @@ def test_upload_to_existing_mission(empty_mission):
     assert set([file.name for file in files if file.name.endswith(".bag")]) == set([file.name for file in DATA_FILES])
 
 
+@pytest.mark.slow
+def test_upload_skips_existing_files(mission):
+    client = AuthenticatedClient()
+    skipped = kleinkram.core.upload(client=client, query=MissionQuery(ids=[mission.id]), file_paths=DATA_FILES)
+    assert skipped == {file: FileVerificationStatus.UPLOADED for file in DATA_FILES}
+
+
+def test_remote_diff(tmp_path):
+    local = {}
+    for name in ["new.bag", "same.bag", "other_size.bag", "uploading.bag"]:
+        local[name] = tmp_path / name
+        local[name].write_bytes(b"data")
+
+    remote = {
+        "same.bag": make_file("same.bag", 4),
+        "other_size.bag": make_file("other_size.bag", 5),
+        "uploading.bag": make_file("uploading.bag", 4, state=FileState.UPLOADING),
+        "unrelated.bag": make_file("unrelated.bag", 1),
+    }
+
+    missing, skipped = kleinkram.core._remote_diff(local, remote, check_file_size=True, check_file_hash=False)
+    # interrupted uploads are resumed
+    assert set(missing) == {"new.bag", "uploading.bag"}
+    assert skipped == {
+        local["same.bag"]: FileVerificationStatus.UPLOADED,
+        local["other_size.bag"]: FileVerificationStatus.MISMATCHED_SIZE,
+    }
+
+    # by name only
+    _, skipped = kleinkram.core._remote_diff(local, remote, check_file_size=False, check_file_hash=False)
+    assert set(skipped.values()) == {FileVerificationStatus.UPLOADED}
+
+
+def test_remote_diff_hash(tmp_path, monkeypatch):
+    path = tmp_path / "file.bag"
+    path.write_bytes(b"data")
+    monkeypatch.setattr(kleinkram.core, "cached_b64_md5", lambda path, rehash=False: b64_md5(path))
+
+    for remote_hash, status in [
+        (b64_md5(path), FileVerificationStatus.UPLOADED),
+        ("something else", FileVerificationStatus.MISMATCHED_HASH),
+    ]:
+        remote = {path.name: make_file(path.name, 4, hash=remote_hash)}
+        _, skipped = kleinkram.core._remote_diff({path.name: path}, remote, check_file_size=True, check_file_hash=True)
+        assert skipped == {path: status}
+
+
 @pytest.mark.slow
 def test_delete_existing_files(mission):
     client = AuthenticatedClient()
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import os
+from dataclasses import replace
+from datetime import datetime
+from typing import Any
+from uuid import uuid4
+
+import httpx
+import pytest
+
+pytest.importorskip("fsspec")
+
+import kleinkram.api.partial_download  # noqa: E402
+import kleinkram.api.routes  # noqa: E402
+from kleinkram.errors import FileNotFound  # noqa: E402
+from kleinkram.errors import MissionNotFound  # noqa: E402
+from kleinkram.filesystem import BlockCache  # noqa: E402
+from kleinkram.filesystem import KleinkramFileSystem  # noqa: E402
+from kleinkram.models import Mission  # noqa: E402
+from kleinkram.models import Project  # noqa: E402
+from tests.helpers import make_file  # noqa: E402
+
+KB = 1024
+
+NOW = datetime.now()
+PROJECT = Project(id=uuid4(), name="project", description="", created_at=NOW, updated_at=NOW, required_tags=[])
+MISSION = Mission(id=uuid4(), name="mission", created_at=NOW, updated_at=NOW, project_id=PROJECT.id, project_name=PROJECT.name)
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    """\
+    a project with a mission holding `remote.files`, their content is `remote.data`,
+    `remote.requests` are the requested byte ranges
+    """
+
+    class Remote:
+        data = os.urandom(100 * KB)
+        files = [make_file("a.bag", len(data), mission=MISSION), make_file("b.bag", len(data), mission=MISSION)]
+        requests: list = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        first, last = request.headers["Range"].removeprefix("bytes=").split("-")
+        start, end = int(first), int(last) + 1
+        Remote.requests.append((start, end))
+        return httpx.Response(206, content=Remote.data[start:end])
+
+    def get_file(client, query):
+        for file in Remote.files:
+            if file.name == query.patterns[0] and file.mission_name == query.mission_query.patterns[0]:
+                return file
+        raise FileNotFound
+
+    def get_mission(client, query):
+        if query.patterns != [MISSION.name]:
+            raise MissionNotFound
+        return MISSION
+
+    client_cls = httpx.Client
+    monkeypatch.setattr(httpx, "Client", lambda **kwargs: client_cls(transport=httpx.MockTransport(handler), **kwargs))
+    monkeypatch.setattr(kleinkram.api.partial_download, "_get_file_download", lambda client, id: "http://s3/file")
+    monkeypatch.setattr(kleinkram.api.routes, "get_projects", lambda client, query: iter([PROJECT]))
+    monkeypatch.setattr(kleinkram.api.routes, "get_missions", lambda client, query: iter([MISSION]))
+    monkeypatch.setattr(kleinkram.api.routes, "get_files", lambda client, query: iter(Remote.files))
+    monkeypatch.setattr(kleinkram.api.routes, "get_file", get_file)
+    monkeypatch.setattr(kleinkram.api.routes, "get_mission", get_mission)
+    return Remote
+
+
+def _fs(**kwargs: Any) -> KleinkramFileSystem:
+    # no instance caching, every test gets its own cache
+    return KleinkramFileSystem(client=object(), skip_instance_cache=True, **kwargs)
+
+
+def test_filesystem_listing(remote):
+    fs = _fs()
+    assert fs.ls("kleinkram://", detail=False) == ["project"]
+    assert fs.ls("project", detail=False) == ["project/mission"]
+    assert fs.ls("kleinkram://project/mission", detail=False) == ["project/mission/a.bag", "project/mission/b.bag"]
+
+    info = fs.info("project/mission/a.bag")
+    assert info["type"] == "file"
+    assert info["size"] == len(remote.data)
+    assert info["id"] == str(remote.files[0].id)
+    assert fs.isdir("project/mission")
+    assert fs.ukey("project/mission/b.bag") == "hash"
+
+    # files without a hash yet are told apart by id and modification time
+    b = replace(remote.files[1], hash=None)
+    remote.files[1] = b
+    fs.invalidate_cache()
+    assert fs.ukey("project/mission/b.bag") == f"{b.id}:{b.updated_at.isoformat()}"
+
+    assert not fs.exists("project/mission/c.bag")
+    with pytest.raises(FileNotFoundError):
+        fs.ls("project/other")
+    with pytest.raises(NotImplementedError):
+        fs.open("project/mission/a.bag", "wb")
+
+
+def test_filesystem_reads_blocks(remote):
+    fs = _fs(block_size=4 * KB, read_ahead=8 * KB)
+    data = remote.data
+
+    with fs.open("kleinkram://project/mission/a.bag") as f:
+        f.seek(10 * KB)
+        assert f.read(100) == data[10 * KB : 10 * KB + 100]  # noqa: E203
+        # the block of the read and two blocks of read ahead
+        assert remote.requests == [(8 * KB, 20 * KB)]
+
+        # served from the cache
+        assert f.read(5 * KB) == data[10 * KB + 100 : 15 * KB + 100]  # noqa: E203
+        assert len(remote.requests) == 1
+
+        # reads past the end are cut off
+        f.seek(-100, os.SEEK_END)
+        assert f.read(1000) == data[-100:]
+        assert remote.requests[-1] == (96 * KB, 100 * KB)
+        assert f.fetched == 16 * KB
+
+    # cached blocks are not fetched again, missing runs are fetched with a request each
+    remote.requests.clear()
+    assert fs.cat_file("project/mission/a.bag", start=0, end=30 * KB) == data[: 30 * KB]
+    assert remote.requests == [(0, 8 * KB), (20 * KB, 40 * KB)]
+
+    # blocks of other files are not shared
+    remote.requests.clear()
+    assert fs.cat_file("project/mission/b.bag", start=0, end=KB) == data[:KB]
+    assert remote.requests == [(0, 12 * KB)]
+
+
+def test_block_cache_evicts_least_recently_used():
+    cache = BlockCache(3 * KB)
+    for index in range(3):
+        cache.put("file", index, bytes(KB))
+    assert cache.get("file", 0) is not None
+
+    cache.put("file", 3, bytes(KB))
+    assert cache.get("file", 1) is None
+    assert [index for index in range(4) if cache.get("file", index) is not None] == [0, 2, 3]
+    assert cache.size == 3 * KB
+
+    # larger than the whole cache
+    cache.put("file", 4, bytes(4 * KB))
+    assert cache.get("file", 4) is None
+
+
+def test_block_cache_on_disk(tmp_path, remote):
+    fs = _fs(block_size=4 * KB, read_ahead=0, cache_dir=tmp_path / "blocks", cache_size="16KiB")
+    assert fs.cat_file("project/mission/a.bag", start=0, end=30 * KB) == remote.data[: 30 * KB]
+    assert fs.cache.size == 16 * KB
+
+    # blocks survive the process, the least recently used are evicted first
+    remote.requests.clear()
+    fs = _fs(block_size=4 * KB, read_ahead=0, cache_dir=tmp_path / "blocks", cache_size="16KiB")
+    assert fs.cache.size == 16 * KB
+    assert fs.cat_file("project/mission/a.bag", start=16 * KB, end=32 * KB) == remote.data[16 * KB : 32 * KB]  # noqa: E203
+    assert remote.requests == []
+    assert fs.cat_file("project/mission/a.bag", start=0, end=KB) == remote.data[:KB]
+    assert remote.requests == [(0, 4 * KB)]
+
+    fs.cache.clear()
+    assert list((tmp_path / "blocks").glob("*/*")) == []
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+import kleinkram.hash_cache
+from kleinkram.hash_cache import HashCache
+from kleinkram.hash_cache import cached_b64_md5
+from kleinkram.utils import b64_md5
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = HashCache(tmp_path / "state" / "hashes.sqlite")
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def file(tmp_path):
+    path = tmp_path / "file.bag"
+    path.write_bytes(b"some bytes")
+    return path
+
+
+def test_hash_cache_hit(cache, file, monkeypatch):
+    assert cache.get(file) is None
+    assert cache.b64_md5(file) == b64_md5(file)
+    assert cache.get(file) == b64_md5(file)
+
+    def fail(_):
+        raise AssertionError("file should not be hashed")
+
+    monkeypatch.setattr(kleinkram.hash_cache, "b64_md5", fail)
+    assert cache.b64_md5(file) == b64_md5(file)
+
+
+def test_hash_cache_invalidated_by_size_and_mtime(cache, file):
+    cache.b64_md5(file)
+
+    file.write_bytes(b"other bytes")
+    assert cache.get(file) is None
+    assert cache.b64_md5(file) == b64_md5(file)
+
+    stat = file.stat()
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert cache.get(file) is None
+
+
+def test_hash_cache_invalidated_by_inode(cache, file, tmp_path):
+    cache.b64_md5(file)
+
+    # replace the file with a copy, size and mtime stay the same
+    stat = file.stat()
+    other = tmp_path / "other.bag"
+    other.write_bytes(file.read_bytes())
+    os.utime(other, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(other, file)
+
+    assert cache.get(file) is None
+
+
+def test_hash_cache_put_ignores_changed_file(cache, file):
+    stat = file.stat()
+    file.write_bytes(b"changed while hashing")
+    cache.put(file, "stale", stat=stat)
+    assert cache.get(file) is None
+
+
+def test_hash_cache_rehash(cache, file):
+    cache.put(file, "wrong", stat=file.stat())
+    assert cache.b64_md5(file) == "wrong"
+    assert cache.b64_md5(file, rehash=True) == b64_md5(file)
+    assert cache.get(file) == b64_md5(file)
+
+
+def test_cached_b64_md5_without_cache(file, monkeypatch):
+    monkeypatch.setattr(kleinkram.hash_cache, "get_hash_cache", lambda: None)
+    assert cached_b64_md5(file) == b64_md5(file)
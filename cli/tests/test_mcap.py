@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import io
+from datetime import datetime
+from datetime import timezone
+from typing import List
+from typing import Tuple
+
+import pytest
+
+pytest.importorskip("mcap")
+
+from mcap.reader import make_reader  # noqa: E402
+from mcap.records import Message  # noqa: E402
+from mcap.writer import CompressionType  # noqa: E402
+from mcap.writer import IndexType  # noqa: E402
+from mcap.writer import Writer  # noqa: E402
+
+import kleinkram.mcap  # noqa: E402
+from kleinkram.mcap import NS_PER_S  # noqa: E402
+from kleinkram.mcap import McapError  # noqa: E402
+from kleinkram.mcap import McapIndexMissing  # noqa: E402
+from kleinkram.mcap import McapWriter  # noqa: E402
+from kleinkram.mcap import copy_messages  # noqa: E402
+from kleinkram.mcap import read_chunk  # noqa: E402
+from kleinkram.mcap import read_summary  # noqa: E402
+from kleinkram.mcap import resolve_time  # noqa: E402
+from kleinkram.mcap import select_chunks  # noqa: E402
+from kleinkram.mcap import topic_matcher  # noqa: E402
+
+START = 1_700_000_000 * NS_PER_S
+TOPICS = ["/tf", "/camera/left", "/camera/right", "/imu"]
+
+
+def make_mcap(seconds: int = 100, chunk_size: int = 2000, compression: CompressionType = CompressionType.NONE) -> bytes:
+    """\
+    one message per topic and second, with small chunks, written by the reference writer
+    """
+    fp = io.BytesIO()
+    writer = Writer(fp, chunk_size=chunk_size, compression=compression)
+    writer.start(profile="ros2", library="test")
+    schema_id = writer.register_schema("std_msgs/String", "ros2msg", b"string data")
+    channel_ids = [writer.register_channel(topic, "cdr", schema_id, {"qos": "1"}) for topic in TOPICS]
+    for second in range(seconds):
+        for topic, channel_id in zip(TOPICS, channel_ids):
+            writer.add_message(channel_id, START + second * NS_PER_S, f"{topic} {second}".encode(), 0, sequence=second)
+    writer.finish()
+    return fp.getvalue()
+
+
+def _reader(data: bytes):
+    def read(offset: int, length: int) -> bytes:
+        read.requests.append((offset, length))
+        return data[offset : offset + length]  # noqa: E203
+
+    read.requests = []
+    return read
+
+
+def _chunk(data: bytes, idx) -> List:
+    return read_chunk(data[idx.chunk_start_offset : idx.chunk_start_offset + idx.chunk_length])  # noqa: E203
+
+
+def read_messages(data: bytes) -> List[Tuple[str, int]]:
+    """\
+    the topic and log time of all messages in an mcap file, read by the reference reader
+    """
+    reader = make_reader(io.BytesIO(data))
+    return [(channel.topic, message.log_time) for _, channel, message in reader.iter_messages()]
+
+
+@pytest.mark.parametrize("compression", [CompressionType.NONE, CompressionType.ZSTD, CompressionType.LZ4])
+def test_read_summary(compression):
+    data = make_mcap(compression=compression)
+    read = _reader(data)
+    summary = read_summary(read, len(data))
+
+    assert summary.header.profile == "ros2"
+    assert [channel.topic for channel in summary.channels.values()] == TOPICS
+    assert summary.channels[1].metadata == {"qos": "1"}
+    assert summary.schemas[1].data == b"string data"
+    assert summary.statistics.message_count == 400
+    assert summary.statistics.channel_message_counts == {1: 100, 2: 100, 3: 100, 4: 100}
+    assert summary.start_time == START
+    assert summary.end_time == START + 99 * NS_PER_S
+    assert len(summary.chunk_indexes) > 5
+    # small files are read at once
+    assert read.requests == [(0, len(data))]
+
+    # chunks are decompressed and checked
+    records = [record for idx in summary.chunk_indexes for record in _chunk(data, idx)]
+    messages = [record for record in records if isinstance(record, Message)]
+    assert len(messages) == 400
+    assert messages[0].data == b"/tf 0"
+
+
+def test_read_summary_of_large_file(monkeypatch):
+    monkeypatch.setattr(kleinkram.mcap, "TAIL_READ_SIZE", 100)
+    data = make_mcap()
+    read = _reader(data)
+    summary = read_summary(read, len(data))
+    assert len(summary.channels) == 4
+    # the tail, the rest of the summary and the header
+    assert len(read.requests) == 3
+    assert sum(length for _, length in read.requests) < len(data) // 2
+
+
+def test_read_summary_of_invalid_files():
+    with pytest.raises(McapError):
+        read_summary(_reader(b"not an mcap file" * 10), 160)
+
+    data = make_mcap()
+    truncated = data[:-1000]
+    with pytest.raises(McapError):
+        read_summary(_reader(truncated), len(truncated))
+
+    # valid files without a summary section or without a chunk index
+    for kwargs in [
+        dict(index_types=IndexType.NONE, repeat_channels=False, repeat_schemas=False, use_statistics=False),
+        dict(index_types=IndexType.NONE),
+    ]:
+        fp = io.BytesIO()
+        writer = Writer(fp, use_summary_offsets=False, **kwargs)
+        writer.start()
+        writer.add_message(writer.register_channel("/tf", "cdr", 0), START, b"x", START)
+        writer.finish()
+        with pytest.raises(McapIndexMissing):
+            read_summary(_reader(fp.getvalue()), len(fp.getvalue()))
+
+
+def test_read_chunk_checks_crc():
+    data = bytearray(make_mcap())
+    idx = read_summary(_reader(bytes(data)), len(data)).chunk_indexes[0]
+    # flip a byte in the records of the first chunk
+    data[idx.chunk_start_offset + idx.chunk_length - 1] ^= 0xFF
+    with pytest.raises(McapError, match="chunk"):
+        _chunk(bytes(data), idx)
+
+
+def test_select_chunks():
+    data = make_mcap()
+    summary = read_summary(_reader(data), len(data))
+    everything = select_chunks(summary, matches=topic_matcher(None))
+    assert everything == summary.chunk_indexes
+
+    window = select_chunks(summary, matches=topic_matcher(None), start=START + 10 * NS_PER_S, end=START + 20 * NS_PER_S)
+    assert 0 < len(window) < len(everything) / 4
+    assert all(idx.message_end_time >= START + 10 * NS_PER_S for idx in window)
+    assert all(idx.message_start_time <= START + 20 * NS_PER_S for idx in window)
+
+
+def test_select_chunks_by_topic():
+    fp = io.BytesIO()
+    writer = Writer(fp, chunk_size=200)
+    writer.start()
+    schema_id = writer.register_schema("s", "ros2msg", b"")
+    # the topics are recorded one after the other, they end up in different chunks
+    for topic in ["/tf", "/camera"]:
+        channel_id = writer.register_channel(topic, "cdr", schema_id)
+        for second in range(20):
+            writer.add_message(channel_id, START + second * NS_PER_S, b"x" * 50, 0)
+    writer.finish()
+    data = fp.getvalue()
+
+    summary = read_summary(_reader(data), len(data))
+    tf = select_chunks(summary, matches=topic_matcher(["/tf"]))
+    assert tf and all(idx.message_index_offsets.keys() == {1} for idx in tf)
+    assert select_chunks(summary, matches=topic_matcher(["/nothing"])) == []
+
+
+def test_copy_messages():
+    data = make_mcap(compression=CompressionType.ZSTD)
+    summary = read_summary(_reader(data), len(data))
+    matches = topic_matcher(["/tf", "/camera/*"])
+    start, end = START + 10 * NS_PER_S, START + 19 * NS_PER_S
+
+    fp = io.BytesIO()
+    writer = McapWriter(fp, profile=summary.header.profile)
+    n = 0
+    for idx in select_chunks(summary, matches=matches, start=start, end=end):
+        n += copy_messages(_chunk(data, idx), writer, summary, matches=matches, start=start, end=end)
+    writer.finish()
+
+    assert n == writer.message_count == 30
+    expected = [(topic, START + second * NS_PER_S) for second in range(10, 20) for topic in TOPICS if topic != "/imu"]
+    assert read_messages(fp.getvalue()) == expected
+
+    # the reference reader sees the same file as ours
+    reference = make_reader(io.BytesIO(fp.getvalue()))
+    assert reference.get_header().profile == "ros2"
+    filtered = read_summary(_reader(fp.getvalue()), len(fp.getvalue()))
+    assert [channel.topic for channel in filtered.channels.values()] == TOPICS[:3]
+    assert [channel.topic for channel in reference.get_summary().channels.values()] == TOPICS[:3]
+    assert filtered.statistics.message_count == 30
+    assert {schema.data for schema in filtered.schemas.values()} == {b"string data"}
+    messages = [message for _, _, message in reference.iter_messages(topics=["/tf"])]
+    assert [(message.sequence, message.data) for message in messages] == [(s, f"/tf {s}".encode()) for s in range(10, 20)]
+
+
+def test_resolve_time():
+    assert resolve_time(None, START) is None
+    assert resolve_time(1.5, START) == START + 1_500_000_000
+    assert resolve_time(datetime.fromtimestamp(1_700_000_000, tz=timezone.utc), START) == START
+
+
+def test_read_summary_without_package(monkeypatch):
+    monkeypatch.setattr(kleinkram.mcap, "HAS_MCAP", False)
+    with pytest.raises(McapError, match=r"kleinkram\[mcap\]"):
+        read_summary(_reader(b""), 0)
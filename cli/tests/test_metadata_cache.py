@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import sqlite3
+import stat
+
+import pytest
+
+import kleinkram.metadata_cache
+from kleinkram.config import Config
+from kleinkram.config import Credentials
+from kleinkram.config import MetadataCacheConfig
+from kleinkram.metadata_cache import MetadataCache
+from kleinkram.metadata_cache import get_metadata_cache
+from kleinkram.metadata_cache import metadata_scope
+from kleinkram.metadata_cache import prune_metadata_cache
+from tests.helpers import FakeClock
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(1000.0)
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = MetadataCache(tmp_path / "state" / "metadata.sqlite", clock=clock)
+    yield cache
+    cache.close()
+
+
+def _config(**credentials) -> Config:
+    config = Config(metadata_cache=MetadataCacheConfig(ttl=60))
+    config.credentials = Credentials(**credentials)
+    return config
+
+
+def test_metadata_cache_put_get(cache, clock):
+    entries = [{"uuid": "a", "name": "x"}]
+    assert cache.get("scope", "/files", {"missionUuids": ["m"]}) is None
+
+    cache.put("scope", "/files", {"missionUuids": ["m"]}, entries, etag='W/"1"')
+    listing = cache.get("scope", "/files", {"missionUuids": ["m"]})
+    assert listing is not None
+    assert listing.entries == entries
+    assert listing.etag == 'W/"1"'
+    assert cache.get("scope", "/files", {"missionUuids": ["other"]}) is None
+    assert cache.get("other", "/files", {"missionUuids": ["m"]}) is None
+
+    assert cache.is_fresh(listing, ttl=60)
+    clock.now += 60
+    assert not cache.is_fresh(listing, ttl=60)
+
+
+def test_metadata_cache_expire(cache):
+    cache.put("scope", "/files", {}, [])
+    cache.put("other", "/files", {}, [])
+    cache.expire("scope")
+
+    assert not cache.is_fresh(cache.get("scope", "/files", {}), ttl=60)
+    assert cache.is_fresh(cache.get("other", "/files", {}), ttl=60)
+
+
+def test_metadata_cache_max_age(tmp_path, clock):
+    cache = MetadataCache(tmp_path / "metadata.sqlite", max_age=3600, clock=clock)
+    cache.put("scope", "/files", {}, [{"uuid": "a"}])
+    clock.now += 3000
+    cache.put("scope", "/files", {}, [{"uuid": "a"}, {"uuid": "b"}], complete=False)
+    assert cache.get("scope", "/files", {}) is not None
+
+    # merged listings are dropped `max_age` after they were fetched completely
+    clock.now += 1000
+    assert cache.get("scope", "/files", {}) is None
+    cache.put("scope", "/files", {}, [{"uuid": "b"}])
+    assert cache.get("scope", "/files", {}).entries == [{"uuid": "b"}]
+    cache.close()
+
+
+def test_metadata_cache_evicts_old_listings(tmp_path, clock):
+    path = tmp_path / "metadata.sqlite"
+    cache = MetadataCache(path, max_age=3600, clock=clock)
+    cache.put("old", "/files", {}, [])
+    clock.now += 3000
+    cache.put("new", "/files", {}, [])
+    cache.close()
+
+    clock.now += 1000
+    MetadataCache(path, max_age=3600, clock=clock).close()
+    with sqlite3.connect(str(path)) as conn:
+        assert conn.execute("SELECT scope FROM listings").fetchall() == [("new",)]
+
+
+def test_metadata_cache_is_private(tmp_path, cache):
+    mode = stat.S_IMODE((tmp_path / "state" / "metadata.sqlite").stat().st_mode)
+    assert mode == 0o600
+
+
+def test_prune_metadata_cache(cache, monkeypatch):
+    monkeypatch.setattr(kleinkram.metadata_cache, "get_metadata_cache", lambda config: cache)
+    config = _config(api_key="a")
+    cache.put(metadata_scope(config), "/files", {}, [])
+    cache.put(metadata_scope(_config(api_key="b")), "/files", {}, [])
+
+    prune_metadata_cache(config)
+    assert cache.get(metadata_scope(config), "/files", {}) is not None
+    assert cache.get(metadata_scope(_config(api_key="b")), "/files", {}) is None
+
+
+def test_metadata_scope_per_user():
+    assert metadata_scope(_config(api_key="a")) == metadata_scope(_config(api_key="a"))
+    assert metadata_scope(_config(api_key="a")) != metadata_scope(_config(api_key="b"))
+    assert metadata_scope(_config(refresh_token="a")) != metadata_scope(_config(refresh_token="b"))
+
+
+def test_metadata_cache_is_opt_in():
+    assert get_metadata_cache(Config()) is None
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from threading import Thread
+from typing import List
+
+from kleinkram.progress import ByteCounter
+from kleinkram.progress import TransferProgress
+
+
+def test_byte_counter_across_threads():
+    counter = ByteCounter()
+
+    def add() -> None:
+        for _ in range(1000):
+            counter.add(3)
+
+    threads = [Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    counter.add(-24)
+    assert counter.value == 8 * 3000 - 24
+
+
+def test_transfer_progress_listeners_get_deltas():
+    deltas: List[int] = []
+    with TransferProgress(100, total_files=2, disable=True, listeners=[deltas.append], interval=60) as progress:
+        progress.update(10)
+        progress.update(15)
+        progress._refresh()
+        progress.update(-5)
+        progress.file_done()
+
+    assert deltas == [25, -5]
+    assert progress.bytes_done == 20
+
+
+def test_transfer_progress_skip_reduces_total():
+    with TransferProgress(100, total_files=2, interval=60) as progress:
+        progress.skip(40)
+        progress.update(60)
+        progress._refresh()
+        assert progress._pbar.total == 60
+        assert progress._pbar.n == 60
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import struct
+
+import pytest
+from rosbags.rosbag1 import Writer
+from rosbags.typesys import Stores
+from rosbags.typesys import get_typestore
+
+from kleinkram.rosbag import NS_PER_S
+from kleinkram.rosbag import BagError
+from kleinkram.rosbag import BagIndexMissing
+from kleinkram.rosbag import read_bag_index
+
+START = 1_700_000_000 * NS_PER_S
+
+
+def make_bag(path) -> bytes:
+    typestore = get_typestore(Stores.ROS1_NOETIC)
+    writer = Writer(path)
+    # several chunks
+    writer.chunk_threshold = 1000
+    with writer:
+        strings = writer.add_connection("/chatter", "std_msgs/msg/String", typestore=typestore)
+        numbers = writer.add_connection("/count", "std_msgs/msg/Int32", typestore=typestore)
+        for second in range(100):
+            writer.write(strings, START + second * NS_PER_S, struct.pack("<I", 5) + b"hello")
+            if second % 2 == 0:
+                writer.write(numbers, START + second * NS_PER_S, struct.pack("<i", second))
+    return path.read_bytes()
+
+
+def _reader(data: bytes):
+    def read(offset: int, length: int) -> bytes:
+        read.requests.append((offset, length))
+        return data[offset : offset + length]  # noqa: E203
+
+    read.requests = []
+    return read
+
+
+def test_read_bag_index(tmp_path):
+    data = make_bag(tmp_path / "test.bag")
+    read = _reader(data)
+    index = read_bag_index(read, len(data))
+
+    topics = {connection.topic: connection for connection in index.connections.values()}
+    assert topics["/chatter"].type == "std_msgs/String"
+    assert topics["/count"].type == "std_msgs/Int32"
+    assert index.message_counts == {topics["/chatter"].id: 100, topics["/count"].id: 50}
+    assert index.start_time == START
+    assert index.end_time == START + 99 * NS_PER_S
+
+    # the bag header and the index section
+    assert len(read.requests) == 2
+    assert read.requests[1][1] < len(data) / 2
+
+
+def test_read_bag_index_of_invalid_files(tmp_path):
+    with pytest.raises(BagError):
+        read_bag_index(_reader(b"not a bag" * 10), 90)
+
+    data = bytearray(make_bag(tmp_path / "test.bag"))
+    # an unindexed bag, e.g. when recording was interrupted
+    position = data.index(b"index_pos=") + len(b"index_pos=")
+    data[position : position + 8] = bytes(8)  # noqa: E203
+    with pytest.raises(BagIndexMissing):
+        read_bag_index(_reader(bytes(data)), len(data))
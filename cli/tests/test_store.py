@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+
+import pytest
+
+import kleinkram.store
+from kleinkram.config import Config
+from kleinkram.config import LocalStoreConfig
+from kleinkram.store import COPY
+from kleinkram.store import HARDLINK
+from kleinkram.store import LocalStore
+from kleinkram.store import link_or_copy
+from kleinkram.store import open_local_store
+from tests.helpers import FakeClock
+
+
+def _file(tmp_path, name: str, size: int = 100):
+    path = tmp_path / "downloads" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(os.urandom(size))
+    return path, base64.b64encode(hashlib.md5(path.read_bytes()).digest()).decode()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalStore(tmp_path / "store", clock=FakeClock(step=1))
+    yield store
+    store.close()
+
+
+def test_local_store_materialize(tmp_path, store):
+    path, file_hash = _file(tmp_path, "a.bag")
+    assert store.materialize(file_hash, tmp_path / "other.bag") is None
+
+    store.add(path, file_hash)
+    path.unlink()
+
+    dst = tmp_path / "experiment" / "a.bag"
+    dst.parent.mkdir()
+    dst.write_bytes(b"old")
+    assert store.materialize(file_hash, dst) is not None
+    assert base64.b64encode(hashlib.md5(dst.read_bytes()).digest()).decode() == file_hash
+    assert list(dst.parent.iterdir()) == [dst]
+
+
+def test_local_store_ignores_invalid_hashes(store):
+    assert store.get("not a hash") is None
+    assert store.get(base64.b64encode(b"\0" * 16).decode()) is None
+
+
+def test_local_store_drops_modified_files(tmp_path, store):
+    path, file_hash = _file(tmp_path, "a.bag")
+    store.add(path, file_hash)
+    stored = store.get(file_hash)
+    assert stored is not None
+
+    # e.g. a hardlinked destination that was written to
+    with open(stored, "ab") as f:
+        f.write(b"changed")
+    assert store.get(file_hash) is None
+    assert not stored.exists()
+
+
+def test_local_store_evicts_least_recently_used(tmp_path):
+    store = LocalStore(tmp_path / "store", max_size=250, clock=FakeClock(step=1))
+    try:
+        files = [_file(tmp_path, f"{name}.bag") for name in "abc"]
+        store.add(*files[0])
+        store.add(*files[1])
+        assert store.get(files[0][1]) is not None
+
+        store.add(*files[2])
+        assert store.size == 200
+        assert store.get(files[0][1]) is not None
+        assert store.get(files[1][1]) is None
+        assert store.get(files[2][1]) is not None
+
+        # files larger than the store are not added
+        store.add(*_file(tmp_path, "d.bag", size=300))
+        assert store.size == 200
+    finally:
+        store.close()
+
+
+def test_local_store_shared_between_instances(tmp_path, store):
+    path, file_hash = _file(tmp_path, "a.bag")
+    store.add(path, file_hash)
+
+    other = LocalStore(store.root)
+    try:
+        assert other.get(file_hash) is not None
+    finally:
+        other.close()
+
+
+def test_link_or_copy_fallbacks(tmp_path, monkeypatch):
+    src, _ = _file(tmp_path, "a.bag")
+
+    def fail(*_):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(kleinkram.store, "_reflink", fail)
+    assert link_or_copy(src, tmp_path / "b.bag") == HARDLINK
+    assert os.path.samefile(src, tmp_path / "b.bag")
+
+    monkeypatch.setattr(os, "link", fail)
+    assert link_or_copy(src, tmp_path / "c.bag") == COPY
+    assert (tmp_path / "c.bag").read_bytes() == src.read_bytes()
+
+
+def test_open_local_store(tmp_path):
+    assert open_local_store(Config()) is None
+
+    store = open_local_store(Config(local_store=LocalStoreConfig(path=str(tmp_path / "store"), max_size="1GB")))
+    assert store is not None
+    assert store.max_size == 10**9
+    store.close()
+
+    assert open_local_store(Config(local_store=LocalStoreConfig(path=str(tmp_path / "store"), max_size="lots"))) is None
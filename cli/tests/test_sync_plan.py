@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+from dataclasses import replace
+from datetime import datetime
+from datetime import timedelta
+from uuid import uuid4
+
+import pytest
+
+import kleinkram.hash_cache
+import kleinkram.sync_plan
+from kleinkram.hash_cache import HashCache
+from kleinkram.models import File
+from kleinkram.models import FileState
+from kleinkram.models import Mission
+from kleinkram.sync_plan import SyncDirection
+from kleinkram.sync_plan import SyncManifest
+from kleinkram.sync_plan import mission_dir
+from kleinkram.sync_plan import plan_sync
+from kleinkram.sync_plan import record_sync
+from kleinkram.sync_plan import unchanged_missions
+from tests.helpers import make_file
+
+NOW = datetime(2024, 1, 1)
+
+
+@pytest.fixture(autouse=True)
+def hash_cache(tmp_path, monkeypatch):
+    cache = HashCache(tmp_path / "hashes.sqlite")
+    monkeypatch.setattr(kleinkram.hash_cache, "_HASH_CACHE", cache)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def mission():
+    return Mission(
+        id=uuid4(),
+        name="mission",
+        created_at=NOW,
+        updated_at=NOW,
+        project_id=uuid4(),
+        project_name="project",
+        number_of_files=2,
+        size=8,
+    )
+
+
+@pytest.fixture
+def root(tmp_path, mission):
+    root = tmp_path / "root"
+    mission_dir(root, mission).mkdir(parents=True)
+    return root
+
+
+def _remote(mission: Mission, name: str, data: bytes, state: FileState = FileState.OK) -> File:
+    return make_file(name, len(data), hash=base64.b64encode(hashlib.md5(data).digest()).decode(), state=state, mission=mission)
+
+
+def _local(root, mission, name: str, data: bytes):
+    path = mission_dir(root, mission) / name
+    path.write_bytes(data)
+    return path
+
+
+def _no_hashing(monkeypatch):
+    def fail(path, rehash=False):
+        raise AssertionError(f"{path} should not be hashed")
+
+    monkeypatch.setattr(kleinkram.sync_plan, "cached_b64_md5", fail)
+
+
+def test_plan_sync_first_run(root, mission):
+    same = _local(root, mission, "same.bag", b"same")
+    changed = _local(root, mission, "changed.bag", b"local")
+    new = _local(root, mission, "new.bag", b"new")
+    unsupported = _local(root, mission, "notes.txt", b"notes")
+    badly_named = _local(root, mission, "bad name.bag", b"bad")
+    _local(root, mission, "missing.bag.part", b"partial")
+    remote = [
+        _remote(mission, "same.bag", b"same"),
+        _remote(mission, "changed.bag", b"remote"),
+        _remote(mission, "missing.bag", b"missing"),
+        _remote(mission, "uploading.bag", b"", state=FileState.UPLOADING),
+    ]
+
+    plan = plan_sync(root, [mission], remote, SyncManifest(root))
+
+    assert plan.downloads == {mission_dir(root, mission) / "missing.bag": remote[2]}
+    assert plan.uploads == {mission.id: {"new.bag": new}}
+    assert plan.in_sync == {same: remote[0]}
+    assert plan.conflicts == {changed: "differs from the remote file"}
+    assert set(plan.ignored) == {unsupported, badly_named}
+    assert plan.pending_missions == {mission.id}
+
+    # the remote file wins with `overwrite`
+    plan = plan_sync(root, [mission], remote, SyncManifest(root), overwrite=True)
+    assert changed in plan.downloads
+
+    # one way syncs
+    plan = plan_sync(root, [mission], remote, SyncManifest(root), direction=SyncDirection.DOWNLOAD)
+    assert plan.uploads == {}
+    plan = plan_sync(root, [mission], remote, SyncManifest(root), direction=SyncDirection.UPLOAD)
+    assert plan.downloads == {}
+
+
+def test_sync_skips_unchanged_missions(root, mission, monkeypatch):
+    files = [_remote(mission, "a.bag", b"aaaa"), _remote(mission, "b.bag", b"bbbb")]
+    manifest = SyncManifest(root)
+    plan = plan_sync(root, [mission], files, manifest)
+    assert len(plan.downloads) == 2
+    for path, file in plan.downloads.items():
+        path.write_bytes(b"aaaa" if file.name == "a.bag" else b"bbbb")
+    record_sync(manifest, plan, [mission])
+    manifest.save()
+
+    manifest = SyncManifest.load(root)
+    assert unchanged_missions(root, [mission], manifest) == {mission.id}
+
+    # files that did not change are not hashed again
+    _no_hashing(monkeypatch)
+    plan = plan_sync(root, [mission], files, manifest)
+    assert len(plan.in_sync) == 2
+
+    # new files on either side are noticed
+    assert unchanged_missions(root, [replace(mission, number_of_files=3)], manifest) == set()
+    _local(root, mission, "c.bag", b"c")
+    assert unchanged_missions(root, [mission], manifest) == set()
+
+
+def test_sync_follows_changes(root, mission, monkeypatch):
+    file = _remote(mission, "a.bag", b"aaaa")
+    path = _local(root, mission, "a.bag", b"aaaa")
+    manifest = SyncManifest(root)
+    plan = plan_sync(root, [mission], [file], manifest)
+    record_sync(manifest, plan, [mission])
+    assert plan.in_sync == {path: file}
+
+    # only the remote file changed, the local copy is replaced without hashing it
+    _no_hashing(monkeypatch)
+    updated = replace(_remote(mission, "a.bag", b"new!"), id=file.id, updated_at=file.updated_at + timedelta(hours=1))
+    assert plan_sync(root, [mission], [updated], manifest).downloads == {path: updated}
+    monkeypatch.undo()
+
+    # the local file changed
+    path.write_bytes(b"mine")
+    assert plan_sync(root, [mission], [file], manifest).conflicts == {path: "changed locally"}
+
+    # the remote file was deleted
+    assert plan_sync(root, [mission], [], manifest).conflicts == {path: "deleted remotely"}
+
+
+def test_record_sync_leaves_out_failed_downloads(root, mission):
+    file = _remote(mission, "a.bag", b"aaaa")
+    manifest = SyncManifest(root)
+    plan = plan_sync(root, [mission], [file], manifest)
+    assert plan.downloads
+
+    # the download failed
+    record_sync(manifest, plan, [mission])
+    assert manifest.files == {}
+    assert manifest.missions == {}
+
+
+def test_sync_manifest_round_trip(root, mission):
+    manifest = SyncManifest(root)
+    _local(root, mission, "a.bag", b"aaaa")
+    plan = plan_sync(root, [mission], [_remote(mission, "a.bag", b"aaaa")], manifest)
+    record_sync(manifest, plan, [mission])
+    manifest.save()
+
+    loaded = SyncManifest.load(root)
+    assert loaded.files == manifest.files
+    assert loaded.missions == manifest.missions
+
+    # a broken manifest is ignored
+    manifest.path.write_text("{")
+    assert SyncManifest.load(root).files == {}
@@ -7,6 +7,7 @@ from uuid import uuid4
 import pytest
 
 from kleinkram.errors import FileTypeNotSupported
+from kleinkram.utils import HashingReader
 from kleinkram.utils import b64_md5
 from kleinkram.utils import check_file_paths
 from kleinkram.utils import check_filename_is_sanatized
@@ -14,6 +15,8 @@ from kleinkram.utils import get_filename
 from kleinkram.utils import get_filename_map
 from kleinkram.utils import is_valid_uuid4
 from kleinkram.utils import parse_path_like
+from kleinkram.utils import parse_rate
+from kleinkram.utils import parse_size
 from kleinkram.utils import parse_uuid_like
 from kleinkram.utils import singleton_list
 from kleinkram.utils import split_args
@@ -112,6 +115,63 @@ def test_b64_md5():
         assert b64_md5(file) == "XrY7u+Ae7tCTyyK7j1rNww=="
 
 
+@pytest.mark.parametrize(
+    "s, expected",
+    [
+        pytest.param("1024", 1024, id="plain"),
+        pytest.param("10B", 10, id="bytes"),
+        pytest.param("64MB", 64 * 1000**2, id="decimal"),
+        pytest.param("64 mib", 64 * 1024**2, id="binary lowercase"),
+        pytest.param("1.5GB", 1500 * 1000**2, id="fractional"),
+    ],
+)
+def test_parse_size(s: str, expected: int) -> None:
+    assert parse_size(s) == expected
+
+
+@pytest.mark.parametrize("s", ["", "MB", "-1MB", "10 parsecs", "1.2.3GB"])
+def test_parse_size_invalid(s: str) -> None:
+    with pytest.raises(ValueError):
+        parse_size(s)
+
+
+@pytest.mark.parametrize(
+    "s, expected",
+    [
+        pytest.param("50MB/s", 50 * 1000**2, id="per second"),
+        pytest.param("50MB", 50 * 1000**2, id="no suffix"),
+        pytest.param(" 1 MiB/S ", 1024**2, id="whitespace"),
+    ],
+)
+def test_parse_rate(s: str, expected: int) -> None:
+    assert parse_rate(s) == expected
+
+
+@pytest.mark.parametrize("s", ["", "/s", "50MB/h", "fast"])
+def test_parse_rate_invalid(s: str) -> None:
+    with pytest.raises(ValueError):
+        parse_rate(s)
+
+
+def test_hashing_reader(tmp_path):
+    file = tmp_path / "file.txt"
+    file.write_text("hello world")
+
+    with open(file, "rb") as f:
+        reader = HashingReader(f)
+        assert reader.read(5) == b"hello"
+        reader.seek(0)  # re-reads do not change the hash
+        assert reader.read() == b"hello world"
+        assert reader.b64_md5(11) == b64_md5(file)
+        assert reader.b64_md5(12) is None
+
+    with open(file, "rb") as f:
+        reader = HashingReader(f)
+        reader.seek(6)  # skipped bytes are never hashed
+        reader.read()
+        assert reader.b64_md5(11) is None
+
+
 def test_singleton_list() -> None:
     assert [] == singleton_list(None)
     assert [1] == singleton_list(1)